@@ -176,11 +176,52 @@ def mktable_helper(tablename, auto=True, rawdir="./"):
     
     # All the info is now in the ObsTable.
     # Write the ObsTable to disk and close everything, we're done.
-    table.write_table()
-    table.pretty_table()
+    table.write_table(pretty=True)
     
     return
 
+def mktable_bulk(tablename, rawdir="./", nthreads=None, cache=None):
+    """
+    Create or append to an observation summary table without prompting.
+    
+    The primary headers of all the raw S*.fits files in rawdir are read
+    concurrently.  Consecutive frames with the same OBJECT, band, grism,
+    exposure time, LNRS, read mode and data type are grouped into one
+    record.  The data type, target name and applyto columns are derived
+    from the headers and from the other records of the night (see
+    records_from_runs()).  Records already in the table are not added
+    again.
+    
+    :param tablename: Filename for the table.  If it exists it will
+        be extended.
+    :type tablename: str
+    :param rawdir: Path to raw data.  [Default: "./"]
+    :type rawdir: str
+    :param nthreads: Number of threads reading the headers.
+        [Default: 4 per core]
+    :type nthreads: int
+    :param cache: Header cache to read the headers through.  
+        [Default: None, read the files]
+    :type cache: headercache.HeaderCache
+    :rtype: list of ObsRecord, the records added to the table.
+    """
+    import obstable
+    import os.path
+    
+    table = obstable.ObsTable()
+    table.filename = tablename
+    if os.path.exists(tablename):
+        table.read_table()
+    
+    frames = scan_raw_headers(rawdir, nthreads=nthreads, cache=cache)
+    records = records_from_runs(group_frames(frames))
+    new_records = [record for record in records 
+                   if record not in table.records]
+    table.add_records_to_table(new_records)
+    table.write_table(pretty=True)
+    
+    return new_records
+
 #def mkreduxscript(tablename, targetname, band, shorttarget,
 #                  rootname):
 #
@@ -241,8 +282,10 @@ def query_header(ad, requested_input):
     string.  The requested_input strings are defined in get_req_input_list(),
     and they correspond to columns in the observation summary table.
     
-    :param ad: AstroData object that contains the header information.
-    :type ad: AstroData object
+    :param ad: AstroData object that contains the header information, 
+        or the name of a raw file, in which case the primary header is
+        read through the header cache (see headercache.get_header()).
+    :type ad: AstroData object or str
     :param requested_input: Information to retrieve from the header.  The
         valid strings correspond to the 'id' in the dictionaries returned
         by get_req_input_list().  Only the prompts with 'in_hdr'=True are
@@ -251,6 +294,13 @@ def query_header(ad, requested_input):
     :rtype: str
     """
     
+    if isinstance(ad, basestring):
+        import headercache
+        info = header_to_frame_info(headercache.get_header(ad, 0), ad, 
+                                    None, None)
+        info['targetname'] = info['object']
+        return info[requested_input]
+    
     # warning: might not be efficient if the descriptor system is slow
     # might have to change to if-elif sequence.  (but it's kinda cool
     # looking this way.)
@@ -318,6 +368,295 @@ def parse_filerange(filerange):
     
     return filenumbers
 
+def scan_raw_headers(rawdir, nthreads=None, pattern='S*.fits', cache=None):
+    """
+    Read the primary header of every raw frame in a directory.
+    
+    Only the primary headers are read, never the pixels.  The files are
+    read by a pool of threads since the time is spent waiting on the disk.
+    
+    :param rawdir: Path to the raw data.
+    :type rawdir: str
+    :param nthreads: Number of threads.  [Default: 4 per core]
+    :type nthreads: int
+    :param pattern: Glob pattern of the raw file names.
+        [Default: 'S*.fits']
+    :type pattern: str
+    :param cache: Header cache.  Only the files missing from the cache, 
+        or modified since, are read.  [Default: None, read all the files]
+    :type cache: headercache.HeaderCache
+    :rtype: list of dict, one per frame, sorted by rootname and file 
+        number.  See get_frame_info() for the keys.
+    """
+    import glob
+    import os.path
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    
+    filenames = [filename for filename in 
+                 glob.glob(os.path.join(rawdir, pattern))
+                 if parse_raw_filename(filename) is not None]
+    if not filenames:
+        return []
+    
+    if cache is not None:
+        headers = cache.get_headers(filenames, 0, nthreads=nthreads)
+        frames = [header_to_frame_info(header, filename, 
+                                       *parse_raw_filename(filename))
+                  for (header, filename) in zip(headers, filenames)]
+    else:
+        if nthreads is None:
+            nthreads = 4 * multiprocessing.cpu_count()
+        pool = ThreadPool(max(1, min(nthreads, len(filenames))))
+        try:
+            frames = pool.map(get_frame_info, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    
+    frames.sort(key=lambda frame: (frame['rootname'], frame['number']))
+    return frames
+
+def parse_raw_filename(filename):
+    """
+    Split a raw Gemini file name into root name and file number.
+    
+    :param filename: Raw file name, with or without path, 
+        eg. S20131015S0038.fits
+    :type filename: str
+    :rtype: tuple (rootname, number), eg. ('S20131015', 38), or None if
+        the name is not a raw file name.
+    """
+    import os.path
+    import re
+    
+    match = re.match(r'^(S\d{8})S(\d{4})\.fits$', os.path.basename(filename))
+    if match is None:
+        return None
+    return (match.group(1), int(match.group(2)))
+
+def get_frame_info(filename, cache=None):
+    """
+    Get the table information for one raw frame from its primary header.
+    
+    :param filename: Raw file name.
+    :type filename: str
+    :param cache: Header cache.  [Default: None, read the file]
+    :type cache: headercache.HeaderCache
+    :rtype: dict with keys filename, rootname, number, object, obstype,
+        obsclass, band, grism, exptime, lnrs and rdmode.
+    """
+    from astropy.io import fits
+    
+    if cache is not None:
+        header = cache.get_header(filename, 0)
+    else:
+        header = fits.getheader(filename, 0)
+    (rootname, number) = parse_raw_filename(filename)
+    return header_to_frame_info(header, filename, rootname, number)
+
+def header_to_frame_info(header, filename, rootname, number):
+    """
+    Convert a primary header into the table information for the frame.
+    
+    The band, grism and read mode follow the pretty descriptor values
+    used by query_header(), eg. 'JH', 'dark', 'Faint'.  The LNRS is
+    the value from the header, see obstable.ObsRecord.
+    
+    :param header: Primary header of the raw frame.
+    :type header: Header
+    :param filename: Raw file name.
+    :type filename: str
+    :param rootname: Root name, eg. S20131015.
+    :type rootname: str
+    :param number: File number.
+    :type number: int
+    :rtype: dict
+    """
+    lnrs = int(header.get('LNRS', 1))
+    filters = [pretty_f2_name(header.get(keyword, 'Open')) 
+               for keyword in ('FILTER1', 'FILTER2')]
+    filters = [name for name in filters if name != 'Open']
+    band = filters[0] if filters else 'Open'
+    return {'filename': filename,
+            'rootname': rootname,
+            'number': number,
+            'object': str(header.get('OBJECT', '')).replace(' ', '_'),
+            'obstype': str(header.get('OBSTYPE', '')).upper(),
+            'obsclass': str(header.get('OBSCLASS', '')),
+            'band': band,
+            'grism': pretty_f2_name(header.get('GRISM', 'Open')),
+            'exptime': float(header.get('EXPTIME', 0.)),
+            'lnrs': lnrs,
+            'rdmode': F2_READ_MODES.get(lnrs, 'Unknown')}
+
+def pretty_f2_name(component):
+    """
+    Strip the Gemini component number from an F2 filter or grism name.
+    Eg. 'JH_G0809' becomes 'JH', 'DK_G0807' becomes 'dark'.
+    
+    :param component: Filter or grism name from the header.
+    :type component: str
+    :rtype: str
+    """
+    name = str(component).strip().split('_G')[0]
+    if name == 'DK':
+        name = 'dark'
+    return name
+
+def get_datatype(frame):
+    """
+    Return the table data type of a frame from OBSTYPE and OBSCLASS.
+    
+    :param frame: Frame information from get_frame_info().
+    :type frame: dict
+    :rtype: str, one of Science, Telluric, Dark, Flat, Arc, or the 
+        OBSTYPE for anything else.
+    """
+    if frame['obstype'] == 'OBJECT':
+        if frame['obsclass'] == 'science':
+            return 'Science'
+        return 'Telluric'
+    return {'DARK': 'Dark', 'FLAT': 'Flat', 'ARC': 'Arc'}.get(
+                frame['obstype'], frame['obstype'].capitalize())
+
+def group_frames(frames):
+    """
+    Group consecutive frames with the same setup into runs.
+    
+    A run ends when a frame with a different OBJECT, band, grism,
+    exposure time, LNRS, read mode or data type is found.  Missing file
+    numbers do not break a run.
+    
+    :param frames: Frame information, sorted by rootname and number.
+    :type frames: list of dict
+    :rtype: list of dict.  Each run has the keys of the frames, except 
+        filename and number, plus datatype and numbers (list of int).
+    """
+    runs = []
+    current_key = None
+    for frame in frames:
+        datatype = get_datatype(frame)
+        key = (frame['rootname'], frame['object'], frame['band'], 
+               frame['grism'], frame['exptime'], frame['lnrs'], 
+               frame['rdmode'], datatype)
+        if key != current_key:
+            run = dict(frame)
+            del run['filename']
+            del run['number']
+            run['datatype'] = datatype
+            run['numbers'] = []
+            runs.append(run)
+            current_key = key
+        runs[-1]['numbers'].append(frame['number'])
+    return runs
+
+def records_from_runs(runs):
+    """
+    Create ObsRecords from runs of frames.
+    
+    The target name of a Science run is its OBJECT.  Every other run is
+    associated to the Science target of the same night whose run is the
+    closest in file number; for Flat, Arc and Telluric runs, only the
+    Science runs in the same band are considered.
+    
+    The applyto column is derived as follows:
+      * Science: None
+      * Telluric: Science
+      * Flat, Arc: the Science and Telluric data types of the same band.
+      * Dark: the data types of the night with the same exposure time
+        and LNRS.
+    
+    :param runs: Runs from group_frames().
+    :type runs: list of dict
+    :rtype: list of ObsRecord
+    """
+    import obstable
+    
+    records = []
+    for run in runs:
+        night = [other for other in runs if other['rootname'] == run['rootname']]
+        science = [other for other in night if other['datatype'] == 'Science']
+        if run['datatype'] == 'Science':
+            targetname = run['object']
+            applyto = 'None'
+        else:
+            if run['datatype'] != 'Dark':
+                science = [other for other in science 
+                           if other['band'] == run['band']] or science
+            targetname = run['object']
+            if science:
+                closest = min(science, key=lambda other: 
+                              abs(other['numbers'][0] - run['numbers'][0]))
+                targetname = closest['object']
+            applyto = get_applyto(run, night)
+        
+        records.append(obstable.ObsRecord(targetname=targetname,
+                                          rootname=run['rootname'],
+                                          band=run['band'],
+                                          grism=run['grism'],
+                                          datatype=run['datatype'],
+                                          applyto=applyto,
+                                          filerange=format_filerange(
+                                                        run['numbers']),
+                                          exptime=run['exptime'],
+                                          lnrs=run['lnrs'],
+                                          rdmode=run['rdmode']))
+    return records
+
+def get_applyto(run, night):
+    """
+    Return the applyto string for a calibration run.  See 
+    records_from_runs().
+    
+    :param run: The calibration run.
+    :type run: dict
+    :param night: All the runs of the same night.
+    :type night: list of dict
+    :rtype: str
+    """
+    if run['datatype'] == 'Telluric':
+        return 'Science'
+    if run['datatype'] == 'Dark':
+        candidates = [other for other in night 
+                      if other['exptime'] == run['exptime'] and
+                      other['lnrs'] == run['lnrs']]
+        order = ['Science', 'Telluric', 'Flat', 'Arc']
+    else:
+        candidates = [other for other in night 
+                      if other['band'] == run['band']]
+        order = ['Science', 'Telluric']
+    datatypes = set([other['datatype'] for other in candidates])
+    applyto = [datatype for datatype in order if datatype in datatypes]
+    return ','.join(applyto) if applyto else 'None'
+
+def format_filerange(numbers):
+    """
+    Format a list of file numbers into a filerange string.  This is
+    the reverse of parse_filerange().
+    
+    :param numbers: File numbers.
+    :type numbers: list of int
+    :rtype: str, eg. '218-221,223-225'
+    """
+    ranges = []
+    numbers = sorted(numbers)
+    start = previous = numbers[0]
+    for number in numbers[1:] + [None]:
+        if number is not None and number == previous + 1:
+            previous = number
+            continue
+        if start == previous:
+            ranges.append('%d' % start)
+        else:
+            ranges.append('%d-%d' % (start, previous))
+        start = previous = number
+    return ','.join(ranges)
+
+# F2 read modes from the LNRS header value.  The header value is the
+# true number of read pairs minus 2 for LNRS>1 (see obstable.ObsRecord).
+F2_READ_MODES = {1: 'Bright', 2: 'Medium', 6: 'Faint'}
+
 def write_readme_template():
     """
     When creating a directory structure, create also a short README
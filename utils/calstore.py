@@ -0,0 +1,261 @@
+# calstore.py
+"""
+Content-addressed store of calibration products.
+
+Several targets of a program share the calibrations of a night.  The
+store builds each product once: a product is keyed by its kind, the
+sorted names of the raw frames it is made of and the processing
+parameters, and is linked into the reduction directories of the
+targets instead of being recomputed or copied.
+
+Layout of the store:
+    <root>/<kind>/<key[:2]>/<key>/<product files>
+    <root>/<kind>/<key[:2]>/<key>/calstore.json
+
+Usage:
+    store = CalibrationStore('/data/f2/calstore')
+    store.make_dark(darkfiles, target_dir='reduxHK', name='objdark.fits')
+    store.make_flat(flatfiles, target_dir='reduxHK', order=40)
+    # any other product, eg. a wavelength solution:
+    products = store.build('arc', arcfiles, {'order': 4}, write_solution)
+    store.link(products, 'reduxHK')
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DEFAULT_ROOT = os.path.join('~', '.f2_calstore')
+
+METADATA = 'calstore.json'
+
+def calibration_key(kind, filenames, parameters=None):
+    """
+    Key of a product.  Only the base names of the raw frames are used,
+    so the same frames read from different directories give the same key.
+    
+    Parameters
+    ----------
+    kind : str
+        Kind of product, eg. 'dark', 'flat', 'arc'.
+    filenames : list of str
+        Raw frames.
+    parameters : dict, optional
+        Processing parameters.  They must be JSON serializable.
+    
+    Returns
+    -------
+    str
+        SHA-1 hex digest.
+    """
+    content = {'kind': kind,
+               'frames': sorted(os.path.basename(filename)
+                                for filename in filenames),
+               'parameters': parameters or {}}
+    text = json.dumps(content, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class CalibrationStore(object):
+    """
+    Calibration products, stored once by content key.
+    
+    Parameters
+    ----------
+    root : str, optional
+        Directory of the store.  Default is $F2_CALSTORE, or
+        ~/.f2_calstore.
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = os.environ.get('F2_CALSTORE', DEFAULT_ROOT)
+        self.root = os.path.abspath(os.path.expanduser(root))
+    
+    def directory(self, kind, key):
+        """
+        Directory of a product.
+        """
+        return os.path.join(self.root, kind, key[:2], key)
+    
+    def get(self, kind, filenames, parameters=None):
+        """
+        Files of a product, if it is in the store.
+        
+        Returns
+        -------
+        dict or None
+            Path of each file of the product, by name.
+        """
+        key = calibration_key(kind, filenames, parameters)
+        directory = self.directory(kind, key)
+        if not os.path.exists(os.path.join(directory, METADATA)):
+            return None
+        return dict((name, os.path.join(directory, name))
+                    for name in read_metadata(directory)['products'])
+    
+    def build(self, kind, filenames, parameters, function):
+        """
+        Build a product unless it is already in the store.
+        
+        The function writes the product in a temporary directory of the
+        store, which is then renamed to its final place.  If another
+        process stored the same product in the meantime, its copy is
+        kept.
+        
+        Parameters
+        ----------
+        kind : str
+            Kind of product.
+        filenames : list of str
+            Raw frames.
+        parameters : dict
+            Processing parameters, passed to function.
+        function : callable
+            Called as function(outdir, filenames, **parameters); writes
+            the files of the product in outdir and returns their names.
+        
+        Returns
+        -------
+        dict
+            Path of each file of the product, by name.
+        """
+        products = self.get(kind, filenames, parameters)
+        if products is not None:
+            return products
+        
+        key = calibration_key(kind, filenames, parameters)
+        directory = self.directory(kind, key)
+        parent = os.path.dirname(directory)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+        tmpdir = tempfile.mkdtemp(prefix='.tmp', dir=parent)
+        try:
+            names = function(tmpdir, filenames, **(parameters or {}))
+            metadata = {'kind': kind,
+                        'frames': sorted(os.path.basename(filename)
+                                         for filename in filenames),
+                        'parameters': parameters or {},
+                        'products': [os.path.basename(name)
+                                     for name in names]}
+            with open(os.path.join(tmpdir, METADATA), 'w') as f:
+                json.dump(metadata, f, indent=1, sort_keys=True)
+            try:
+                os.rename(tmpdir, directory)
+            except OSError:
+                if not os.path.exists(os.path.join(directory, METADATA)):
+                    raise
+        finally:
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir)
+        return self.get(kind, filenames, parameters)
+    
+    def link(self, products, target_dir, names=None):
+        """
+        Link the files of a product into a reduction directory.
+        
+        Symbolic links are used, or hard links, or copies where they are
+        not supported.  Existing files of the same names are replaced.
+        
+        Parameters
+        ----------
+        products : dict
+            From get() or build().
+        target_dir : str
+            Reduction directory, eg. 'reduxHK'.
+        names : dict, optional
+            Name of the link for each product file, eg.
+            {'dark.fits': 'objdark.fits'}.  Default is the same name.
+        
+        Returns
+        -------
+        list of str
+            Paths of the links.
+        """
+        names = names or {}
+        links = []
+        for (name, path) in sorted(products.items()):
+            link = os.path.join(target_dir, names.get(name, name))
+            if os.path.lexists(link):
+                os.remove(link)
+            link_file(path, link)
+            links.append(link)
+        return links
+    
+    def make_dark(self, filenames, target_dir=None, name='dark.fits',
+                  mode='average'):
+        """
+        Combined dark, built once and linked as target_dir/name.
+        
+        Returns
+        -------
+        str
+            Path of the dark in the store.
+        """
+        products = self.build('dark', filenames, {'mode': mode},
+                              _build_dark)
+        if target_dir is not None:
+            self.link(products, target_dir, {'dark.fits': name})
+        return products['dark.fits']
+    
+    def make_flat(self, filenames, target_dir=None, flatfile='flat.fits',
+                  bpmfile='f2_ls_bpm.fits', **kwargs):
+        """
+        Normalized flat and BPM, see flatnorm.make_flat(), built once
+        and linked as target_dir/flatfile and target_dir/bpmfile.
+        
+        Returns
+        -------
+        tuple of str
+            Paths of the flat and the BPM in the store.
+        """
+        products = self.build('flat', filenames, kwargs, _build_flat)
+        if target_dir is not None:
+            self.link(products, target_dir, {'flat.fits': flatfile,
+                                             'f2_ls_bpm.fits': bpmfile})
+        return (products['flat.fits'], products['f2_ls_bpm.fits'])
+
+
+def _build_dark(outdir, filenames, mode):
+    from combine import combine_files
+    
+    combine_files(filenames, os.path.join(outdir, 'dark.fits'), mode=mode)
+    return ['dark.fits']
+
+def _build_flat(outdir, filenames, **kwargs):
+    from flatnorm import make_flat
+    
+    make_flat(filenames, os.path.join(outdir, 'flat.fits'),
+              os.path.join(outdir, 'f2_ls_bpm.fits'), **kwargs)
+    return ['flat.fits', 'f2_ls_bpm.fits']
+
+def read_metadata(directory):
+    """
+    Read the description of a stored product.
+    
+    Returns
+    -------
+    dict
+        Keys kind, frames, parameters and products.
+    """
+    with open(os.path.join(directory, METADATA)) as f:
+        return json.load(f)
+
+def link_file(source, link):
+    """
+    Symbolic link to source, or a hard link, or a copy.
+    """
+    try:
+        os.symlink(source, link)
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.link(source, link)
+    except (AttributeError, OSError):
+        shutil.copy2(source, link)
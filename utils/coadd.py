@@ -0,0 +1,409 @@
+# coadd.py
+"""
+Incremental co-add of the spectra of a target observed on several nights.
+
+Each target and band has a store of running accumulators on a common
+linear wavelength grid:
+
+    WSUM   = sum(w * flux)
+    WEIGHT = sum(w)
+    VSUM   = sum(w**2 * var)
+    NCONTRIB = number of nights
+
+so that the co-added spectrum is WSUM / WEIGHT, with the variance
+VSUM / WEIGHT**2.  The weights are the inverse variances, times an
+optional weight for the whole night.  Adding a night resamples its
+spectrum onto the grid and updates the accumulators, without reading
+the other nights.  The contribution of every night is also kept, so that
+a bad night can be subtracted again.  The pixels that no night covers
+any more are reset to 0, so that no rounding residue is left there.
+
+Layout of the store:
+    <root>/<target>/<band>/coadd.fits          PHU + WSUM, WEIGHT, VSUM,
+                                                NCONTRIB
+    <root>/<target>/<band>/nights/<night>.fits  same, for one night
+
+A night is written before the accumulators, each file atomically; after
+an interruption, rebuild() sums the nights again.
+
+Usage:
+    store = CoaddStore('/data/f2/coadd')
+    store.add('SDSSJ023318', 'JH', 'S20131027', spectrum, variance)
+    coadd = store.get('SDSSJ023318', 'JH')
+    coadd.remove('S20131225')
+    coadd.write('SDSSJ023318_JH_coadd.fits')
+"""
+
+import glob
+import os
+import numpy as np
+from astropy import units as u
+
+DEFAULT_ROOT = os.path.join('~', '.f2_coadd')
+
+ACCUMULATORS = 'coadd.fits'
+
+PLANES = ('WSUM', 'WEIGHT', 'VSUM', 'NCONTRIB')
+
+def resample(spectrum, variance, wavelengths, wunit):
+    """
+    Interpolate a spectrum and its variance onto a wavelength grid.
+    
+    Parameters
+    ----------
+    spectrum, variance : spectro.Spectrum
+    wavelengths : ndarray
+        Output wavelengths, increasing.
+    wunit : Unit
+        Units of the output wavelengths.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (flux, var), NaN outside the wavelength range of the spectrum.
+    """
+    wlen = np.asarray(spectrum.wlen, dtype=np.float64) * \
+           spectrum.wunit.to(wunit)
+    flux = np.asarray(spectrum.counts, dtype=np.float64)
+    var = np.asarray(variance.counts, dtype=np.float64)
+    if wlen[0] > wlen[-1]:
+        (wlen, flux, var) = (wlen[::-1], flux[::-1], var[::-1])
+    return (np.interp(wavelengths, wlen, flux, left=np.nan, right=np.nan),
+            np.interp(wavelengths, wlen, var, left=np.nan, right=np.nan))
+
+
+class Coadd(object):
+    """
+    Running co-add of one target in one band.
+    
+    Parameters
+    ----------
+    directory : str
+        Directory of the co-add, created with Coadd.create().
+    
+    Attributes
+    ----------
+    crval, cdelt : float
+        Wavelength of the first pixel and step of the grid.
+    npix : int
+    wunit : Unit
+    wsum, weight, vsum : ndarray
+        The accumulators.
+    ncontrib : ndarray
+        Number of nights that cover each pixel.
+    phu : Header
+        Primary header of the accumulator file.
+    """
+    def __init__(self, directory):
+        from astropy.io import fits
+        
+        self.directory = directory
+        with fits.open(os.path.join(directory, ACCUMULATORS)) as hdulist:
+            self.phu = hdulist[0].header.copy()
+            phu = self.phu
+            self.crval = float(phu['CRVAL1'])
+            self.cdelt = float(phu['CDELT1'])
+            self.npix = int(phu['NPIX'])
+            self.wunit = u.Unit(phu['WUNIT'])
+            (self.wsum, self.weight, self.vsum, self.ncontrib) = \
+                [np.array(hdulist[plane].data, dtype=np.float64)
+                 for plane in PLANES]
+    
+    @classmethod
+    def create(cls, directory, crval, cdelt, npix, wunit=u.Angstrom):
+        """
+        Create an empty co-add.
+        
+        Parameters
+        ----------
+        directory : str
+            New directory of the co-add.
+        crval, cdelt : float
+            Wavelength of the first pixel and step of the grid.
+        npix : int
+            Number of pixels of the grid.
+        wunit : Unit, optional
+            Units of the wavelengths.  Default = Angstrom.
+        
+        Returns
+        -------
+        Coadd
+        
+        Raises
+        ------
+        ValueError
+            If the co-add already exists.
+        """
+        from astropy.io import fits
+        
+        if os.path.exists(os.path.join(directory, ACCUMULATORS)):
+            raise ValueError('Co-add already exists: %s' % directory)
+        if not os.path.isdir(os.path.join(directory, 'nights')):
+            os.makedirs(os.path.join(directory, 'nights'))
+        phu = fits.Header()
+        phu['CRVAL1'] = (float(crval), 'Wavelength of the first pixel')
+        phu['CDELT1'] = (float(cdelt), 'Wavelength step')
+        phu['NPIX'] = (int(npix), 'Number of pixels')
+        phu['WUNIT'] = (u.Unit(wunit).to_string(), 'Wavelength units')
+        zeros = np.zeros(int(npix), dtype=np.float64)
+        write_planes(os.path.join(directory, ACCUMULATORS), phu,
+                     [zeros] * len(PLANES))
+        return cls(directory)
+    
+    @property
+    def wavelengths(self):
+        """
+        Wavelengths of the grid, in units of wunit.
+        """
+        return self.crval + self.cdelt * np.arange(self.npix)
+    
+    @property
+    def nights(self):
+        """
+        Names of the nights in the co-add, sorted.
+        """
+        return sorted(os.path.splitext(os.path.basename(filename))[0]
+                      for filename in glob.glob(self.night_file('*')))
+    
+    def night_file(self, night):
+        """
+        File of the contribution of a night.
+        """
+        return os.path.join(self.directory, 'nights', night + '.fits')
+    
+    def add(self, night, spectrum, variance, weight=1., replace=False):
+        """
+        Add the spectrum of a night.
+        
+        Parameters
+        ----------
+        night : str
+            Name of the night, eg. 'S20131027'.
+        spectrum, variance : spectro.Spectrum
+            Spectrum and variance of the night.  The pixels with a
+            variance that is not positive and finite are left out.
+        weight : float, optional
+            Weight of the night, applied on top of the inverse variance.
+            Default = 1.
+        replace : bool, optional
+            Replace the night if it is already in the co-add.
+            Default = False.
+        
+        Raises
+        ------
+        ValueError
+            If the night is already in the co-add and replace is False,
+            or if the spectrum does not overlap the grid.
+        """
+        from astropy.io import fits
+        
+        if night in self.nights:
+            if not replace:
+                raise ValueError('Night %s already in the co-add.' % night)
+            self.remove(night)
+        (flux, var) = resample(spectrum, variance, self.wavelengths,
+                               self.wunit)
+        good = np.isfinite(flux) & np.isfinite(var)
+        good[good] = var[good] > 0.
+        if not good.any():
+            raise ValueError('Night %s does not overlap the grid.' % night)
+        w = np.zeros(self.npix, dtype=np.float64)
+        w[good] = weight / var[good]
+        planes = [np.where(good, w * flux, 0.), w,
+                  np.where(good, w**2 * var, 0.), good.astype(np.float64)]
+        
+        phu = fits.Header()
+        phu['NIGHT'] = (night, 'Night of the spectrum')
+        phu['NWEIGHT'] = (weight, 'Weight of the night')
+        phu['NGOOD'] = (int(np.count_nonzero(good)),
+                        'Number of pixels contributed')
+        write_planes(self.night_file(night), phu, planes)
+        self._update(planes, 1.)
+    
+    def remove(self, night):
+        """
+        Subtract the contribution of a night.
+        
+        Raises
+        ------
+        ValueError
+            If the night is not in the co-add.
+        """
+        filename = self.night_file(night)
+        if not os.path.exists(filename):
+            raise ValueError('Night %s not in the co-add.' % night)
+        (_, planes) = read_planes(filename)
+        os.remove(filename)
+        self._update(planes, -1.)
+    
+    def rebuild(self):
+        """
+        Sum the contributions of the nights again, eg. after an
+        interrupted add() or remove().
+        """
+        accumulators = [np.zeros(self.npix, dtype=np.float64)
+                        for _ in PLANES]
+        for night in self.nights:
+            (_, planes) = read_planes(self.night_file(night))
+            for (accumulator, plane) in zip(accumulators, planes):
+                accumulator += plane
+        (self.wsum, self.weight, self.vsum, self.ncontrib) = accumulators
+        self._write()
+    
+    def result(self):
+        """
+        The co-added spectrum.
+        
+        Returns
+        -------
+        tuple of spectro.Spectrum
+            (spectrum, variance), NaN where no night contributes.
+        """
+        from spectro import Spectrum
+        
+        covered = (self.ncontrib > 0) & (self.weight > 0.)
+        safe = np.where(covered, self.weight, 1.)
+        flux = np.where(covered, self.wsum / safe, np.nan)
+        var = np.where(covered, self.vsum / safe**2, np.nan)
+        return (Spectrum.from_array(flux, self.crval, self.cdelt,
+                                    wunit=self.wunit),
+                Spectrum.from_array(var, self.crval, self.cdelt,
+                                    wunit=self.wunit))
+    
+    def write(self, filename):
+        """
+        Write the co-added spectrum, as PHU + SCI and VAR, with the list
+        of the nights in the PHU.
+        """
+        from astropy.io import fits
+        
+        (spectrum, variance) = self.result()
+        phu = fits.PrimaryHDU()
+        phu.header['NNIGHTS'] = (len(self.nights), 'Number of nights')
+        for night in self.nights:
+            phu.header.add_history('Night co-added: %s' % night)
+        spectrum.hdu.header['EXTNAME'] = 'SCI'
+        spectrum.hdu.header['EXTVER'] = 1
+        variance.hdu.header['EXTNAME'] = 'VAR'
+        variance.hdu.header['EXTVER'] = 1
+        fits.HDUList([phu, spectrum.hdu, variance.hdu]).writeto(
+            filename, overwrite=True)
+    
+    def _update(self, planes, sign):
+        accumulators = (self.wsum, self.weight, self.vsum, self.ncontrib)
+        for (accumulator, plane) in zip(accumulators, planes):
+            accumulator += sign * plane
+        # removing a night leaves rounding residue where no night is left.
+        empty = (self.ncontrib < 0.5)
+        for accumulator in accumulators:
+            accumulator[empty] = 0.
+        # and can leave tiny negative weights elsewhere.
+        self.weight[self.weight < 0.] = 0.
+        self._write()
+    
+    def _write(self):
+        self.phu['NNIGHTS'] = (len(self.nights), 'Number of nights')
+        write_planes(os.path.join(self.directory, ACCUMULATORS), self.phu,
+                     [self.wsum, self.weight, self.vsum, self.ncontrib])
+
+
+class CoaddStore(object):
+    """
+    Co-adds of all the targets, by target and band.
+    
+    Parameters
+    ----------
+    root : str, optional
+        Directory of the store.  Default is $F2_COADD, or ~/.f2_coadd.
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = os.environ.get('F2_COADD', DEFAULT_ROOT)
+        self.root = os.path.abspath(os.path.expanduser(root))
+    
+    def directory(self, target, band):
+        """
+        Directory of the co-add of a target and band.
+        """
+        return os.path.join(self.root, target, band)
+    
+    def get(self, target, band):
+        """
+        Co-add of a target and band, or None if there is none.
+        """
+        directory = self.directory(target, band)
+        if not os.path.exists(os.path.join(directory, ACCUMULATORS)):
+            return None
+        return Coadd(directory)
+    
+    def add(self, target, band, night, spectrum, variance, grid=None,
+            **kwargs):
+        """
+        Add the spectrum of a night to the co-add of a target and band,
+        creating it if needed.
+        
+        Parameters
+        ----------
+        target, band, night : str
+        spectrum, variance : spectro.Spectrum
+        grid : tuple, optional
+            (crval, cdelt, npix) of a new co-add.  Default is the
+            wavelength grid of the first spectrum, which must be linear.
+        **kwargs
+            Passed to Coadd.add().
+        
+        Returns
+        -------
+        Coadd
+        """
+        from telluric import linear_grid
+        
+        coadd = self.get(target, band)
+        if coadd is None:
+            if grid is None:
+                (crval, cdelt) = linear_grid(spectrum)
+                grid = (crval, cdelt, len(spectrum.counts))
+            coadd = Coadd.create(self.directory(target, band), *grid,
+                                 wunit=spectrum.wunit)
+        coadd.add(night, spectrum, variance, **kwargs)
+        return coadd
+    
+    def targets(self):
+        """
+        (target, band) of all the co-adds, sorted.
+        """
+        pattern = os.path.join(self.root, '*', '*', ACCUMULATORS)
+        return sorted(tuple(filename.split(os.sep)[-3:-1])
+                      for filename in glob.glob(pattern))
+
+
+def read_planes(filename):
+    """
+    Read an accumulator file.
+    
+    Returns
+    -------
+    tuple
+        (phu, [wsum, weight, vsum, ncontrib]), the planes as float64
+        arrays.
+    """
+    from astropy.io import fits
+    
+    with fits.open(filename) as hdulist:
+        return (hdulist[0].header.copy(),
+                [np.array(hdulist[plane].data, dtype=np.float64)
+                 for plane in PLANES])
+
+def write_planes(filename, phu, planes):
+    """
+    Write an accumulator file, atomically.
+    """
+    from astropy.io import fits
+    
+    hdus = [fits.PrimaryHDU(header=phu)]
+    for (name, plane) in zip(PLANES, planes):
+        hdus.append(fits.ImageHDU(np.asarray(plane, dtype=np.float64),
+                                  name=name))
+    tmpfile = filename + '.tmp'
+    fits.HDUList(hdus).writeto(tmpfile, overwrite=True)
+    os.rename(tmpfile, filename)
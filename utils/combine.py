@@ -0,0 +1,534 @@
+# combine.py
+"""
+Combine a stack of frames, eg. darks, into one frame.
+
+This replaces the gemcombine calls of the reduction scripts.  The input
+frames are memory-mapped and combined one block of rows at a time, so
+that the memory used depends on the block size and not on the number of
+frames.  The blocks are distributed to all the cores.
+
+shift_and_combine() replaces nscombine for the nodded science and
+telluric frames: they are aligned along the slit and combined from a
+stack in shared memory.
+
+Usage:
+    filenames = get_filenames('S20131002S', '217-223', prefix='f')
+    flatdark = combine_files(filenames, mode='average')
+    flatdark.write('flatdark.fits')
+"""
+
+import numpy as np
+
+COMBINE_MODES = ('average', 'median', 'sigclip')
+
+# Number of bytes per pixel per frame used while a block is combined:
+# float64 science and variance, the DQ, the mask and the temporaries.
+_BYTES_PER_PIXEL = 48
+
+# Frames opened by each worker process, see _init_worker().
+_WORKER_FRAMES = None
+
+# Shared stack of shift_and_combine(), see _init_shared().
+_SHARED_STACK = None
+
+def get_filenames(rootname, filerange, rawdir='', prefix=''):
+    """
+    Build the list of file names for a range of Gemini file numbers.
+    
+    Parameters
+    ----------
+    rootname : str
+        Root of the file names, eg. 'S20131002' or 'S20131002S'.
+    filerange : str
+        File numbers, as in the observation table, eg. '217-223'.
+    rawdir : str, optional
+        Directory of the files.
+    prefix : str, optional
+        Prefix added by the reduction steps, eg. 'f' for prepared frames.
+    
+    Returns
+    -------
+    list of str
+    """
+    import os.path
+    from bookkeeping import parse_filerange
+    
+    if not rootname.endswith('S'):
+        rootname += 'S'
+    return [os.path.join(rawdir, '%s%s%04d.fits' % (prefix, rootname, number))
+            for number in parse_filerange(filerange)]
+
+def combine_block(sci, var=None, dq=None, mode='average', nsigma=3.,
+                  maxiter=5):
+    """
+    Combine the same block of rows from a stack of frames.
+    
+    Pixels with a non-zero DQ are ignored.  Where a pixel is bad in all
+    the frames, all the frames are used and the output DQ is the
+    bitwise OR of the input DQ; elsewhere the output DQ is 0.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        Science pixels, shape (nframes, nrows, ncols).
+    var : ndarray, optional
+        Variance, same shape as sci.
+    dq : ndarray, optional
+        Data quality, same shape as sci.
+    mode : str, optional
+        'average', 'median' or 'sigclip'.  'sigclip' iteratively rejects
+        the pixels more than nsigma standard deviations away from the
+        median, then averages the others.  Default = 'average'.
+    nsigma : float, optional
+        Rejection threshold for 'sigclip'.  Default = 3.
+    maxiter : int, optional
+        Maximum number of rejection iterations for 'sigclip'.  Default = 5.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (sci, var, dq) with shape (nrows, ncols).  var is None if no
+        variance is given.  dq is an int16 array.
+    """
+    if mode not in COMBINE_MODES:
+        raise ValueError('Unknown combine mode: %s' % mode)
+    
+    data = np.asarray(sci, dtype=np.float64)
+    if dq is None:
+        good = np.ones(data.shape, dtype=bool)
+        allbad = np.zeros(data.shape[1:], dtype=bool)
+    else:
+        good = (np.asarray(dq) == 0)
+        allbad = ~good.any(axis=0)
+        good[:, allbad] = True
+    
+    if mode == 'sigclip':
+        for _ in range(maxiter):
+            masked = np.where(good, data, np.nan)
+            center = np.nanmedian(masked, axis=0)
+            sigma = np.nanstd(masked, axis=0)
+            keep = good & (np.abs(data - center) <= nsigma * sigma)
+            # never reject all the frames of a pixel.
+            empty = ~keep.any(axis=0)
+            keep[:, empty] = good[:, empty]
+            if (keep == good).all():
+                break
+            good = keep
+    
+    ngood = good.sum(axis=0)
+    masked = np.where(good, data, np.nan)
+    if mode == 'median':
+        out_sci = np.nanmedian(masked, axis=0)
+    else:
+        out_sci = np.nanmean(masked, axis=0)
+    
+    out_var = None
+    if var is not None:
+        varsum = np.where(good, np.asarray(var, dtype=np.float64), 0.)
+        out_var = varsum.sum(axis=0) / ngood**2
+        if mode == 'median':
+            # variance of the median of normally distributed values.
+            out_var *= np.pi / 2.
+    
+    out_dq = np.zeros(data.shape[1:], dtype=np.int16)
+    if dq is not None:
+        out_dq[allbad] = np.bitwise_or.reduce(np.asarray(dq), axis=0)[allbad]
+    
+    return (out_sci.astype(np.float32),
+            out_var.astype(np.float32) if out_var is not None else None,
+            out_dq)
+
+def get_block_rows(nframes, ncols, nprocs, max_memory):
+    """
+    Number of rows per block that keeps all the workers within
+    max_memory bytes.
+    """
+    rows = int(max_memory // (nprocs * nframes * ncols * _BYTES_PER_PIXEL))
+    return max(1, rows)
+
+def combine_files(filenames, output=None, mode='average', nsigma=3.,
+                  maxiter=5, max_memory=512e6, nprocs=None):
+    """
+    Combine a list of raw or prepared frames.
+    
+    The variance and DQ planes are propagated when all the inputs have
+    them.  The primary header of the first frame is copied to the
+    output, with NCOMBINE set to the number of frames.
+    
+    Parameters
+    ----------
+    filenames : list of str
+        Frames to combine.  See get_filenames().
+    output : str, optional
+        If given, write the combined frame to this file.
+    mode : str, optional
+        'average', 'median' or 'sigclip'.  See combine_block().
+        Default = 'average'.
+    nsigma : float, optional
+        Rejection threshold for 'sigclip'.  Default = 3.
+    maxiter : int, optional
+        Maximum number of rejection iterations.  Default = 5.
+    max_memory : float, optional
+        Approximate number of bytes used by all the workers at any time.
+        Default = 512e6.
+    nprocs : int, optional
+        Number of worker processes.  Default = number of cores.
+    
+    Returns
+    -------
+    frames.Frame
+    """
+    import multiprocessing
+    from frames import Frame
+    
+    if len(filenames) == 0:
+        raise ValueError('No frames to combine.')
+    if mode not in COMBINE_MODES:
+        raise ValueError('Unknown combine mode: %s' % mode)
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    
+    first = Frame.from_file(filenames[0])
+    (nrows, ncols) = first.shape
+    phu = first.phu.copy()
+    header = first.header.copy()
+    first.close()
+    
+    step = get_block_rows(len(filenames), ncols, nprocs, max_memory)
+    tasks = [(row, min(row + step, nrows), mode, nsigma, maxiter)
+             for row in range(0, nrows, step)]
+    
+    if nprocs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(nprocs, len(tasks)),
+                                    initializer=_init_worker,
+                                    initargs=(filenames,))
+        try:
+            results = pool.map(_combine_rows, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(filenames)
+        try:
+            results = [_combine_rows(task) for task in tasks]
+        finally:
+            _close_worker()
+    
+    sci = np.empty((nrows, ncols), dtype=np.float32)
+    var = None
+    if results[0][1] is not None:
+        var = np.empty((nrows, ncols), dtype=np.float32)
+    dq = None
+    if results[0][3]:
+        dq = np.empty((nrows, ncols), dtype=np.int16)
+    for (task, (block_sci, block_var, block_dq, has_dq)) in zip(tasks,
+                                                                 results):
+        (row0, row1) = task[:2]
+        sci[row0:row1] = block_sci
+        if var is not None:
+            var[row0:row1] = block_var
+        if dq is not None:
+            dq[row0:row1] = block_dq
+    
+    phu['NCOMBINE'] = (len(filenames), 'Number of frames combined')
+    phu['COMBMODE'] = (mode, 'Combine mode')
+    phu.add_history('Combined %s to %s' % (filenames[0], filenames[-1]))
+    combined = Frame(sci, var, dq, phu=phu, header=header)
+    if output is not None:
+        combined.write(output)
+    return combined
+
+def spatial_profile(sci, dq=None):
+    """
+    Median profile along the slit of a frame.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        2-D frame with the dispersion along the first axis.
+    dq : ndarray, optional
+        Pixels with a non-zero DQ are ignored.
+    
+    Returns
+    -------
+    ndarray
+        One value per pixel along the slit.
+    """
+    data = np.asarray(sci, dtype=np.float64)
+    if dq is not None:
+        data = np.where(np.asarray(dq) == 0, data, np.nan)
+    with np.errstate(invalid='ignore'):
+        profile = np.nanmedian(data, axis=0)
+    return np.where(np.isfinite(profile), profile, 0.)
+
+def measure_offsets(profiles, max_shift=None):
+    """
+    Shift of each profile onto the first one.
+    
+    The shift is the sub-pixel peak of the FFT cross-correlation of the
+    positive part of the profiles.  Only the positive part is used so
+    that, in sky-subtracted frames, the A-B and B-A pairs are not
+    confused with their negative images.
+    
+    Parameters
+    ----------
+    profiles : list of ndarray
+        Spatial profiles, see spatial_profile().
+    max_shift : float, optional
+        Largest shift searched, in pixels.  Default is half the length
+        of the profiles.
+    
+    Returns
+    -------
+    ndarray
+        Shift to apply to each frame, in pixels, 0 for the first.
+        A positive shift moves the features to larger pixels.
+    """
+    def positive(profile):
+        profile = np.asarray(profile, dtype=np.float64)
+        return np.clip(profile - np.median(profile), 0., None)
+    
+    reference = positive(profiles[0])
+    npix = reference.size
+    if max_shift is None:
+        max_shift = npix // 2
+    nfft = 2 * npix
+    lags = np.concatenate((np.arange(nfft // 2), np.arange(-nfft // 2, 0)))
+    allowed = np.flatnonzero(np.abs(lags) <= max_shift)
+    ref_fft = np.fft.rfft(reference, nfft)
+    
+    offsets = [0.]
+    for profile in profiles[1:]:
+        correlation = np.fft.irfft(ref_fft * 
+                                   np.conj(np.fft.rfft(positive(profile),
+                                                       nfft)), nfft)
+        best = allowed[np.argmax(correlation[allowed])]
+        (left, centre, right) = correlation[[best - 1, best, 
+                                             (best + 1) % nfft]]
+        curvature = left - 2. * centre + right
+        offset = 0.5 * (left - right) / curvature if curvature < 0. else 0.
+        offsets.append(lags[best] + offset)
+    return np.array(offsets)
+
+def shift_block(sci, var, dq, shift):
+    """
+    Shift rows of pixels along the slit by linear interpolation.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        Shape (nrows, npix), the slit along the second axis.
+    var : ndarray or None
+        Variance, same shape.
+    dq : ndarray
+        Data quality, same shape.
+    shift : float
+        Shift in pixels.  A positive shift moves the features to larger
+        pixels.
+    
+    Returns
+    -------
+    tuple
+        (sci, var, dq).  The pixels shifted in from outside the frame
+        are flagged DQ_NODATA.
+    """
+    from frames import DQ_NODATA
+    
+    npix = sci.shape[1]
+    positions = np.arange(npix) - shift
+    outside = (positions < 0.) | (positions > npix - 1.)
+    low = np.clip(np.floor(positions).astype(int), 0, npix - 2)
+    frac = np.clip(positions - low, 0., 1.)
+    
+    out_sci = (1. - frac) * sci[:, low] + frac * sci[:, low + 1]
+    out_var = None
+    if var is not None:
+        out_var = (1. - frac)**2 * var[:, low] + frac**2 * var[:, low + 1]
+        out_var[:, outside] = 0.
+    out_dq = np.where(frac < 1., dq[:, low], 0) | \
+             np.where(frac > 0., dq[:, low + 1], 0)
+    out_sci[:, outside] = 0.
+    out_dq[:, outside] |= DQ_NODATA
+    return (out_sci, out_var, out_dq.astype(np.int16))
+
+def shift_and_combine(frames, offsets=None, mode='sigclip', nsigma=3.,
+                      maxiter=5, dispaxis=None, max_memory=512e6,
+                      nprocs=None):
+    """
+    Align nodded 2-D spectra along the slit and combine them.
+    
+    This replaces nscombine.  The frames are copied once into a stack
+    in shared memory; the worker processes read their block of rows from
+    it, shift every frame by its offset and combine the block with
+    combine_block().  The frames are not written to disk.
+    
+    Parameters
+    ----------
+    frames : list of frames.Frame
+        Sky-subtracted frames, eg. from skysub.reduce_frames().
+    offsets : array_like, optional
+        Shift of each frame along the slit, in pixels.  Default is
+        measured with measure_offsets().
+    mode : str, optional
+        'average', 'median' or 'sigclip'.  Default = 'sigclip'.
+    nsigma : float, optional
+        Rejection threshold for 'sigclip'.  Default = 3.
+    maxiter : int, optional
+        Maximum number of rejection iterations.  Default = 5.
+    dispaxis : int, optional
+        Dispersion axis, 1 along the rows or 2 along the columns.
+        Default is DISPAXIS from the headers, or 2.
+    max_memory : float, optional
+        Approximate number of bytes used by all the workers at any time,
+        on top of the shared stack.  Default = 512e6.
+    nprocs : int, optional
+        Number of worker processes.  Default = number of cores.
+    
+    Returns
+    -------
+    frames.Frame
+        On the grid of the first frame, with the offsets in the
+        history of the primary header.
+    """
+    import multiprocessing
+    from frames import Frame
+    
+    if len(frames) == 0:
+        raise ValueError('No frames to combine.')
+    if mode not in COMBINE_MODES:
+        raise ValueError('Unknown combine mode: %s' % mode)
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    first = frames[0]
+    if dispaxis is None:
+        dispaxis = first.header.get('DISPAXIS', first.phu.get('DISPAXIS', 2))
+    transpose = (dispaxis == 1)
+    
+    def oriented(data):
+        data = np.asarray(data)
+        return data.T if transpose else data
+    
+    (nrows, ncols) = oriented(first.sci).shape
+    shape = (len(frames), nrows, ncols)
+    has_var = all(frame.var is not None for frame in frames)
+    shared = {'shape': shape,
+              'sci': _shared_array(shape, 'f'),
+              'var': _shared_array(shape, 'f') if has_var else None,
+              'dq': _shared_array(shape, 'h')}
+    (sci, var, dq) = [_as_array(shared[name], shape) 
+                      if shared[name] is not None else None
+                      for name in ('sci', 'var', 'dq')]
+    for (index, frame) in enumerate(frames):
+        sci[index] = oriented(frame.sci)
+        if has_var:
+            var[index] = oriented(frame.var)
+        dq[index] = oriented(frame.dq) if frame.dq is not None else 0
+    
+    if offsets is None:
+        offsets = measure_offsets([spatial_profile(sci[index], dq[index])
+                                   for index in range(len(frames))])
+    offsets = [float(offset) for offset in offsets]
+    
+    step = get_block_rows(len(frames), ncols, nprocs, max_memory)
+    tasks = [(row, min(row + step, nrows), offsets, mode, nsigma, maxiter)
+             for row in range(0, nrows, step)]
+    if nprocs > 1 and len(tasks) > 1:
+        # the stack is inherited by the workers, not pickled.
+        pool = multiprocessing.Pool(min(nprocs, len(tasks)),
+                                    initializer=_init_shared,
+                                    initargs=(shared,))
+        try:
+            results = pool.map(_shift_combine_rows, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_shared(shared)
+        try:
+            results = [_shift_combine_rows(task) for task in tasks]
+        finally:
+            _init_shared(None)
+    
+    out_sci = np.concatenate([result[0] for result in results])
+    out_var = None
+    if has_var:
+        out_var = np.concatenate([result[1] for result in results])
+    out_dq = np.concatenate([result[2] for result in results])
+    if transpose:
+        out_sci = out_sci.T
+        out_var = out_var.T if out_var is not None else None
+        out_dq = out_dq.T
+    
+    phu = first.phu.copy()
+    phu['NCOMBINE'] = (len(frames), 'Number of frames combined')
+    phu['COMBMODE'] = (mode, 'Combine mode')
+    phu.add_history('Offsets along the slit: %s' % 
+                    ' '.join('%.2f' % offset for offset in offsets))
+    return Frame(np.ascontiguousarray(out_sci),
+                 np.ascontiguousarray(out_var) if has_var else None,
+                 np.ascontiguousarray(out_dq), phu=phu,
+                 header=first.header.copy())
+
+def _init_worker(filenames):
+    # Open all the frames once per worker; only the rows of a block
+    # are read from the memory maps.
+    from frames import Frame
+    
+    global _WORKER_FRAMES
+    _WORKER_FRAMES = [Frame.from_file(filename) for filename in filenames]
+
+def _close_worker():
+    global _WORKER_FRAMES
+    for frame in _WORKER_FRAMES:
+        frame.close()
+    _WORKER_FRAMES = None
+
+def _combine_rows(task):
+    (row0, row1, mode, nsigma, maxiter) = task
+    frames = _WORKER_FRAMES
+    sci = np.array([frame.sci[row0:row1] for frame in frames])
+    var = None
+    if all(frame.var is not None for frame in frames):
+        var = np.array([frame.var[row0:row1] for frame in frames])
+    dq = None
+    has_dq = all(frame.dq is not None for frame in frames)
+    if has_dq:
+        dq = np.array([frame.dq[row0:row1] for frame in frames])
+    (sci, var, dq) = combine_block(sci, var, dq, mode=mode, nsigma=nsigma,
+                                   maxiter=maxiter)
+    return (sci, var, dq, has_dq)
+
+def _shared_array(shape, typecode):
+    # Shared memory for a stack, inherited by the worker processes.
+    from multiprocessing.sharedctypes import RawArray
+    
+    return RawArray(typecode, int(np.prod(shape)))
+
+def _as_array(raw, shape):
+    return np.ctypeslib.as_array(raw).reshape(shape)
+
+def _init_shared(shared):
+    global _SHARED_STACK
+    _SHARED_STACK = shared
+
+def _shift_combine_rows(task):
+    (row0, row1, offsets, mode, nsigma, maxiter) = task
+    shared = _SHARED_STACK
+    shape = shared['shape']
+    sci = _as_array(shared['sci'], shape)
+    var = _as_array(shared['var'], shape) if shared['var'] is not None \
+          else None
+    dq = _as_array(shared['dq'], shape)
+    
+    block_sci = np.empty((shape[0], row1 - row0, shape[2]))
+    block_var = np.empty(block_sci.shape) if var is not None else None
+    block_dq = np.empty(block_sci.shape, dtype=np.int16)
+    for (index, offset) in enumerate(offsets):
+        (block_sci[index], shifted_var, block_dq[index]) = shift_block(
+            sci[index, row0:row1], 
+            var[index, row0:row1] if var is not None else None,
+            dq[index, row0:row1], offset)
+        if var is not None:
+            block_var[index] = shifted_var
+    return combine_block(block_sci, block_var, block_dq, mode=mode,
+                         nsigma=nsigma, maxiter=maxiter)
@@ -0,0 +1,300 @@
+# crreject.py
+"""
+Cosmic-ray and hot-pixel rejection for F2 2-D frames.
+
+The detection follows the Laplacian edge method of L.A.Cosmic (van
+Dokkum 2001, PASP 113, 1420), without the subsampling: a cosmic ray is
+sharper than the point spread function, so it stands out in the
+Laplacian of the frame relative to the noise, and it has no counterpart
+in the fine structure of the frame, which flags stars and emission
+lines.  The Laplacian is the sum of two 1-D second differences and the
+median filters are applied along one axis at a time, so that the whole
+frame is processed with 1-D operations.  The frame is cut in tiles of
+rows, processed on a thread pool.
+
+The detected pixels are flagged DQ_COSMIC in the DQ plane.  Pixels that
+are detected in most frames of a sequence are hot pixels and are
+flagged DQ_BAD instead.
+
+Usage:
+    (frame, mask) = clean_frame(frame, rdmode='faint')
+    masks = clean_frames(frames, rdmode=record.rdmode)
+"""
+
+import numpy as np
+
+# Detection thresholds for each read mode.  The faint mode, with more
+# reads, has less read noise and is cleaned more aggressively.
+RDMODE_PARAMETERS = {'bright': {'sigclip': 6.0, 'sigfrac': 0.3,
+                                'objlim': 5.0},
+                     'medium': {'sigclip': 5.0, 'sigfrac': 0.3,
+                                'objlim': 4.0},
+                     'faint': {'sigclip': 4.5, 'sigfrac': 0.3,
+                               'objlim': 3.0}}
+
+# Rows added on each side of a tile: enough for the 7-pixel median of
+# the fine structure and the growth of the detections.
+_TILE_MARGIN = 8
+
+def get_parameters(rdmode, **overrides):
+    """
+    Detection parameters of a read mode.
+    
+    Parameters
+    ----------
+    rdmode : str or obstable.ObsRecord
+        Read mode, eg. 'Faint', or a record with an rdmode attribute.
+    **overrides
+        Parameters to change, eg. sigclip=5.
+    
+    Returns
+    -------
+    dict
+        sigclip, sigfrac, objlim and readnoise (in electrons).
+    
+    Raises
+    ------
+    ValueError
+        If the read mode is unknown.
+    """
+    from frames import F2_READ_NOISE
+    
+    rdmode = getattr(rdmode, 'rdmode', rdmode)
+    key = str(rdmode).lower()
+    if key not in RDMODE_PARAMETERS:
+        raise ValueError('Unknown read mode: %s' % rdmode)
+    parameters = dict(RDMODE_PARAMETERS[key])
+    parameters['readnoise'] = F2_READ_NOISE[key]
+    parameters.update(overrides)
+    return parameters
+
+def laplacian(data):
+    """
+    Laplacian of an image, as the sum of the second differences along
+    the two axes.  The edges are repeated.
+    """
+    padded = np.pad(data, 1, mode='edge')
+    centre = padded[1:-1, 1:-1]
+    return (4. * centre - padded[:-2, 1:-1] - padded[2:, 1:-1] -
+            padded[1:-1, :-2] - padded[1:-1, 2:])
+
+def separable_median(data, size):
+    """
+    Median filter along the columns, then along the rows.  This is an
+    approximation of the 2-D median filter, at a fraction of the cost.
+    """
+    from scipy import ndimage
+    
+    filtered = ndimage.median_filter(data, size=(size, 1), mode='nearest')
+    return ndimage.median_filter(filtered, size=(1, size), mode='nearest')
+
+def detect_cosmics(sci, var=None, dq=None, sigclip=5., sigfrac=0.3,
+                   objlim=4., readnoise=6.0, gain=None):
+    """
+    Find the cosmic rays of a frame, or of a tile of a frame.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        2-D science pixels, in ADU.
+    var : ndarray, optional
+        Variance, in ADU**2.  Default is computed from the counts, the
+        gain and the read noise.
+    dq : ndarray, optional
+        Pixels with a non-zero DQ are replaced by the local median and
+        are never flagged.
+    sigclip : float, optional
+        Detection threshold, in standard deviations of the Laplacian.
+        Default = 5.
+    sigfrac : float, optional
+        Fraction of sigclip for the neighbours of a detection.
+        Default = 0.3.
+    objlim : float, optional
+        Minimum contrast between the Laplacian and the fine structure.
+        Default = 4.
+    readnoise : float, optional
+        Read noise, in electrons.  Default = 6.0.
+    gain : float, optional
+        Gain, in electrons per ADU.  Default = frames.F2_GAIN.
+    
+    Returns
+    -------
+    ndarray
+        Boolean mask of the cosmic rays.
+    """
+    from scipy import ndimage
+    from frames import F2_GAIN
+    
+    if gain is None:
+        gain = F2_GAIN
+    data = np.asarray(sci, dtype=np.float64)
+    median5 = separable_median(data, 5)
+    bad = None
+    if dq is not None:
+        bad = (np.asarray(dq) != 0)
+        data = np.where(bad, median5, data)
+    
+    if var is not None:
+        noise = np.sqrt(np.clip(np.asarray(var, dtype=np.float64), 0.,
+                                None))
+    else:
+        noise = np.sqrt(np.clip(median5, 0., None) * gain +
+                        readnoise**2) / gain
+    noise = np.maximum(noise, 1.e-6)
+    
+    # the Laplacian of white noise has a variance 20 times larger.
+    significance = np.clip(laplacian(data), 0., None) / \
+                   (np.sqrt(20.) * noise)
+    significance -= separable_median(significance, 5)
+    
+    median3 = separable_median(data, 3)
+    fine = (median3 - separable_median(median3, 7)) / noise
+    fine = np.maximum(fine, 0.01)
+    
+    cosmics = (significance > sigclip) & (significance / fine > objlim)
+    # grow the detections to the fainter pixels of the same hit.
+    neighbours = ndimage.binary_dilation(cosmics, np.ones((3, 3), bool))
+    cosmics |= neighbours & (significance > sigfrac * sigclip)
+    if bad is not None:
+        cosmics &= ~bad
+    return cosmics
+
+def clean_frame(frame, rdmode='faint', tile=256, nthreads=None,
+                **overrides):
+    """
+    Flag the cosmic rays of a frame in its DQ plane.
+    
+    Parameters
+    ----------
+    frame : frames.Frame
+    rdmode : str or obstable.ObsRecord, optional
+        Read mode, see get_parameters().  Default = 'faint'.
+    tile : int, optional
+        Number of rows per tile.  Default = 256.
+    nthreads : int, optional
+        Number of threads.  Default = number of cores.
+    **overrides
+        Detection parameters, see detect_cosmics().
+    
+    Returns
+    -------
+    tuple
+        (frame, mask): the frame, with DQ_COSMIC set in a new DQ plane,
+        and the boolean mask of the detections.
+    """
+    from frames import Frame, DQ_COSMIC
+    
+    mask = find_cosmics(frame, rdmode, tile, nthreads, **overrides)
+    dq = np.zeros(frame.shape, dtype=np.int16) if frame.dq is None \
+         else np.array(frame.dq, dtype=np.int16)
+    dq[mask] |= DQ_COSMIC
+    phu = frame.phu.copy()
+    phu['NCOSMIC'] = (int(np.count_nonzero(mask)),
+                      'Number of pixels flagged as cosmic rays')
+    cleaned = Frame(frame.sci, frame.var, dq, phu=phu, header=frame.header,
+                    filename=frame.filename)
+    return (cleaned, mask)
+
+def find_cosmics(frame, rdmode='faint', tile=256, nthreads=None,
+                 **overrides):
+    """
+    Detect the cosmic rays of a frame, tile by tile on a thread pool.
+    
+    See clean_frame() for the parameters.
+    
+    Returns
+    -------
+    ndarray
+        Boolean mask of the cosmic rays.
+    """
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    
+    parameters = get_parameters(rdmode, **overrides)
+    (nrows, ncols) = frame.shape
+    mask = np.zeros((nrows, ncols), dtype=bool)
+    tiles = [(row, min(row + tile, nrows)) for row in range(0, nrows, tile)]
+    
+    def process(bounds):
+        (row0, row1) = bounds
+        start = max(0, row0 - _TILE_MARGIN)
+        stop = min(nrows, row1 + _TILE_MARGIN)
+        tile_var = frame.var[start:stop] if frame.var is not None else None
+        tile_dq = frame.dq[start:stop] if frame.dq is not None else None
+        detected = detect_cosmics(frame.sci[start:stop], tile_var, tile_dq,
+                                  **parameters)
+        mask[row0:row1] = detected[row0 - start:row1 - start]
+    
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads > 1 and len(tiles) > 1:
+        pool = ThreadPool(min(nthreads, len(tiles)))
+        try:
+            pool.map(process, tiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for bounds in tiles:
+            process(bounds)
+    return mask
+
+def flag_hot_pixels(masks, fraction=0.5):
+    """
+    Pixels detected in most frames of a sequence: cosmic rays do not
+    hit the same pixel twice, hot pixels do.
+    
+    Parameters
+    ----------
+    masks : list of ndarray
+        Detections in each frame.
+    fraction : float, optional
+        Minimum fraction of the frames.  Default = 0.5.
+    
+    Returns
+    -------
+    ndarray
+        Boolean mask of the hot pixels.
+    """
+    counts = np.sum(masks, axis=0)
+    return counts >= max(2, fraction * len(masks))
+
+def clean_frames(frames, rdmode='faint', hot_fraction=0.5, **kwargs):
+    """
+    Flag the cosmic rays and the hot pixels of a sequence of frames.
+    
+    The hot pixels are flagged DQ_BAD in all the frames; the other
+    detections are flagged DQ_COSMIC.
+    
+    Parameters
+    ----------
+    frames : list of frames.Frame
+        Frames of the same sequence.  Their DQ planes are replaced.
+    rdmode : str or obstable.ObsRecord, optional
+        Read mode.  Default = 'faint'.
+    hot_fraction : float, optional
+        See flag_hot_pixels().  Default = 0.5.
+    **kwargs
+        Passed to clean_frame().
+    
+    Returns
+    -------
+    tuple
+        (masks, hot): the cosmic rays of each frame and the hot pixels.
+    """
+    from frames import DQ_BAD, DQ_COSMIC
+    
+    masks = []
+    for frame in frames:
+        (cleaned, mask) = clean_frame(frame, rdmode, **kwargs)
+        frame.dq = cleaned.dq
+        frame.phu = cleaned.phu
+        masks.append(mask)
+    hot = flag_hot_pixels(masks, hot_fraction) if len(frames) > 2 else \
+          np.zeros(frames[0].shape, dtype=bool)
+    for (frame, mask) in zip(frames, masks):
+        frame.dq[hot & mask] &= ~np.int16(DQ_COSMIC)
+        frame.dq[hot] |= DQ_BAD
+        mask &= ~hot
+        frame.phu['NCOSMIC'] = int(np.count_nonzero(mask))
+    return (masks, hot)
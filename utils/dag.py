@@ -0,0 +1,444 @@
+# dag.py
+"""
+Dependency-graph executor for the reduction steps of an ObsTable.
+
+The reduction templates run their steps strictly in order.  Here the
+steps are derived from the datatype and applyto columns of the table:
+
+    Dark -> Flat -> Arc -> Telluric -> Science -> telluric correction
+
+Every node is identified by a hash of its parameters, of the size and
+modification time of its raw files, and of the hashes of the nodes it
+depends on.  The hashes and the results of the nodes that ran are kept
+in a state file; a node is run again only if its hash changed, so that
+changing eg. the order of a flat redoes only the nodes that use the flat.
+Nodes that do not depend on each other, eg. the telluric and the science
+of a target, or different targets, run concurrently.
+
+Usage:
+    table = obstable.ObsTable('obsTable.txt')
+    graph = build_graph(table, steps, rawdir='raw',
+                        parameters={'flat': {'order': 40}})
+    report = graph.run(state_file='reduction_state.json', nworkers=4)
+
+Each step is called as step(record, inputs, **parameters), where
+inputs maps the names of the nodes it depends on to their results.
+The results must be JSON serializable, eg. the names of the files
+written.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+STAGES = ('dark', 'flat', 'arc', 'telluric', 'science', 'tellcorr')
+
+# ObsTable datatype of the records processed by each stage.
+STAGE_DATATYPES = {'dark': 'Dark',
+                   'flat': 'Flat',
+                   'arc': 'Arc',
+                   'telluric': 'Telluric',
+                   'science': 'Science'}
+
+class Node(object):
+    """
+    One step of the reduction, applied to one record of the table.
+    
+    Parameters
+    ----------
+    name : str
+        Unique name, eg. 'flat:SDSSJ0117:S20131002:055'.
+    stage : str
+        One of STAGES.
+    function : callable
+        The step, see the module documentation.
+    record : obstable.ObsRecord
+        Record processed.
+    parameters : dict, optional
+        Keyword arguments of the step.
+    depends : list of str, optional
+        Names of the nodes this one needs.
+    files : list of str, optional
+        Raw files read by the step, used in the hash.
+    """
+    def __init__(self, name, stage, function, record, parameters=None,
+                 depends=None, files=None):
+        self.name = name
+        self.stage = stage
+        self.function = function
+        self.record = record
+        self.parameters = dict(parameters or {})
+        self.depends = list(depends or [])
+        self.files = list(files or [])
+        self.hash = None
+    
+    def compute_hash(self, depend_hashes):
+        """
+        Hash of everything the result depends on.
+        
+        Parameters
+        ----------
+        depend_hashes : list of str
+            Hashes of the nodes in self.depends, in the same order.
+        
+        Returns
+        -------
+        str
+        """
+        content = {'name': self.name,
+                   'stage': self.stage,
+                   'record': self.record.get_fields()
+                             if self.record is not None else None,
+                   'parameters': self.parameters,
+                   'depends': sorted(zip(self.depends, depend_hashes)),
+                   'files': [file_signature(filename)
+                             for filename in sorted(self.files)]}
+        text = json.dumps(content, sort_keys=True, default=repr)
+        self.hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return self.hash
+
+
+class Graph(object):
+    """
+    Nodes of the reduction and the dependencies between them.
+    """
+    def __init__(self):
+        self.nodes = {}
+    
+    def add(self, node):
+        """
+        Add a node.  Its name must be unique.
+        """
+        if node.name in self.nodes:
+            raise ValueError('Duplicate node: %s' % node.name)
+        self.nodes[node.name] = node
+    
+    def order(self):
+        """
+        Names of the nodes, each after the nodes it depends on.
+        
+        Returns
+        -------
+        list of str
+        
+        Raises
+        ------
+        ValueError
+            If a dependency is unknown or if there is a cycle.
+        """
+        ordered = []
+        state = {}
+        for name in sorted(self.nodes):
+            stack = [(name, False)]
+            while stack:
+                (current, done) = stack.pop()
+                if done:
+                    state[current] = 'done'
+                    ordered.append(current)
+                    continue
+                if state.get(current) == 'done':
+                    continue
+                if state.get(current) == 'visiting':
+                    raise ValueError('Dependency cycle at %s' % current)
+                if current not in self.nodes:
+                    raise ValueError('Unknown dependency: %s' % current)
+                state[current] = 'visiting'
+                stack.append((current, True))
+                for depend in reversed(self.nodes[current].depends):
+                    if state.get(depend) != 'done':
+                        stack.append((depend, False))
+        return ordered
+    
+    def compute_hashes(self):
+        """
+        Hash all the nodes.
+        
+        Returns
+        -------
+        dict
+            Hash of each node, by name.
+        """
+        hashes = {}
+        for name in self.order():
+            node = self.nodes[name]
+            hashes[name] = node.compute_hash([hashes[depend] for depend
+                                              in node.depends])
+        return hashes
+    
+    def stale(self, state):
+        """
+        Names of the nodes to run: their hash is not in the state, or a
+        node they depend on is stale.
+        
+        Parameters
+        ----------
+        state : dict
+            See read_state().
+        
+        Returns
+        -------
+        list of str
+            In dependency order.
+        """
+        hashes = self.compute_hashes()
+        stale = []
+        for name in self.order():
+            entry = state.get(name)
+            if entry is None or entry.get('hash') != hashes[name] or \
+               any(depend in stale for depend in self.nodes[name].depends):
+                stale.append(name)
+        return stale
+    
+    def run(self, state_file=None, nworkers=1, force=None):
+        """
+        Run the stale nodes, the independent ones concurrently.
+        
+        A node that fails is reported and the nodes that depend on it
+        are skipped; the others still run.  The state file is updated
+        after each node, so an interrupted run resumes where it stopped.
+        
+        Parameters
+        ----------
+        state_file : str, optional
+            JSON file with the hashes and the results of the previous
+            runs.  Default is to run everything and keep no state.
+        nworkers : int, optional
+            Number of threads.  Default = 1.
+        force : list of str, optional
+            Names of nodes to run even if they are up to date.
+        
+        Returns
+        -------
+        dict
+            'ran', 'skipped', 'uptodate': lists of names; 'failed': dict of
+            the exceptions by name; 'results': dict of the results of all
+            the nodes that succeeded.
+        """
+        from multiprocessing.pool import ThreadPool
+        
+        state = read_state(state_file)
+        for name in force or []:
+            state.pop(name, None)
+        todo = self.stale(state)
+        hashes = dict((name, node.hash) for (name, node)
+                      in self.nodes.items())
+        results = dict((name, entry.get('result')) for (name, entry)
+                       in state.items() if name in self.nodes and
+                       name not in todo)
+        report = {'ran': [], 'skipped': [], 'failed': {},
+                  'uptodate': sorted(results), 'results': results}
+        
+        pending = list(todo)
+        running = set()
+        condition = threading.Condition()
+        
+        def finished(name, result, error):
+            with condition:
+                try:
+                    running.discard(name)
+                    if error is None:
+                        # a result that cannot be stored, or a state file
+                        # that cannot be written, fails the node.
+                        try:
+                            json.dumps(result)
+                            state[name] = {'hash': hashes[name],
+                                           'result': result}
+                            write_state(state_file, state)
+                        except Exception as err:    # pylint: disable=W0703
+                            error = err
+                    if error is None:
+                        results[name] = result
+                        report['ran'].append(name)
+                    else:
+                        report['failed'][name] = error
+                        state.pop(name, None)
+                finally:
+                    # the main loop waits for this, whatever happened.
+                    condition.notify()
+        
+        def call(name):
+            node = self.nodes[name]
+            inputs = dict((depend, results[depend])
+                          for depend in node.depends)
+            try:
+                result = node.function(node.record, inputs,
+                                       **node.parameters)
+            except Exception as error:
+                finished(name, None, error)
+            else:
+                finished(name, result, None)
+        
+        pool = ThreadPool(max(1, nworkers))
+        try:
+            with condition:
+                while pending or running:
+                    blocked = set(report['failed']) | set(report['skipped'])
+                    for name in list(pending):
+                        depends = self.nodes[name].depends
+                        if any(depend in blocked for depend in depends):
+                            pending.remove(name)
+                            report['skipped'].append(name)
+                            blocked.add(name)
+                        elif all(depend in results for depend in depends):
+                            pending.remove(name)
+                            running.add(name)
+                            pool.apply_async(call, (name,))
+                    if running:
+                        condition.wait()
+                    elif pending:
+                        # only nodes waiting on skipped ones are left.
+                        report['skipped'].extend(pending)
+                        pending = []
+        finally:
+            pool.close()
+            pool.join()
+        write_state(state_file, state)
+        return report
+
+
+def file_signature(filename):
+    """
+    (name, size, mtime) of a file, or (name, None, None) if it is missing.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return (filename, None, None)
+    return (filename, stat.st_size, int(stat.st_mtime))
+
+def read_state(state_file):
+    """
+    Read the state of the previous runs.
+    
+    Returns
+    -------
+    dict
+        {name: {'hash': str, 'result': result}}, empty if the file does
+        not exist or state_file is None.
+    """
+    if state_file is None or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+def write_state(state_file, state):
+    """
+    Write the state, atomically.  Nothing is done if state_file is None.
+    """
+    if state_file is None:
+        return
+    tmpfile = state_file + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.rename(tmpfile, state_file)
+
+def node_name(stage, record):
+    """
+    Name of the node of a stage for a record, eg.
+    'dark:SDSSJ0117:S20131002:592-595'.
+    """
+    return '%s:%s:%s:%s' % (stage, record.targetname, record.rootname,
+                            record.filerange)
+
+def find_calibrations(table, datatype, record):
+    """
+    Calibration records of a data type that apply to a record.
+    
+    Darks must apply to the data type of the record and have the same
+    night, exposure time and LNRS; the darks of the same target are
+    preferred.  Flats and arcs must belong to the
+    same target and band.
+    
+    Parameters
+    ----------
+    table : obstable.ObsTable
+    datatype : str
+        'Dark', 'Flat' or 'Arc'.
+    record : obstable.ObsRecord
+    
+    Returns
+    -------
+    list of obstable.ObsRecord
+    """
+    if datatype == 'Dark':
+        criteria = {'datatype': 'Dark',
+                    'applyto': [record.datatype, 'contains'],
+                    'rootname': record.rootname,
+                    'exptime': record.exptime,
+                    'lnrs': record.lnrs}
+    else:
+        criteria = {'datatype': datatype,
+                    'targetname': record.targetname,
+                    'band': record.band}
+    records = table.select_records_from_table(criteria)
+    if datatype == 'Dark':
+        # darks taken for the same target, when there are some.
+        records = [dark for dark in records
+                   if dark.targetname == record.targetname] or records
+    return records
+
+def build_graph(table, steps, rawdir='', parameters=None):
+    """
+    Derive the reduction graph from an observation table.
+    
+    There is one node per record for the dark, flat, arc, telluric and
+    science stages, and one telluric correction node per science record.
+    The dependencies are:
+      * flat: its darks;
+      * arc: its darks and the flats of the target and band;
+      * telluric, science: their darks, flats and arcs;
+      * tellcorr: the science and the tellurics of the target and band.
+    Stages without a step in steps get no nodes, and are dropped from
+    the dependencies.
+    
+    Parameters
+    ----------
+    table : obstable.ObsTable
+    steps : dict
+        Step function of each stage, by stage name.  See STAGES.
+    rawdir : str, optional
+        Directory of the raw files, hashed with the nodes.  Default = ''.
+    parameters : dict, optional
+        Keyword arguments of the steps, by stage name.
+    
+    Returns
+    -------
+    Graph
+    """
+    from combine import get_filenames
+    
+    parameters = parameters or {}
+    graph = Graph()
+    
+    def add(stage, record, depends, files):
+        if stage not in steps:
+            return
+        depends = [name for name in depends if name.split(':')[0] in steps]
+        graph.add(Node(node_name(stage, record), stage, steps[stage],
+                       record, parameters.get(stage), depends, files))
+    
+    for stage in STAGES[:-1]:
+        for record in table.select_records_from_table(
+                {'datatype': STAGE_DATATYPES[stage]}):
+            depends = []
+            if stage != 'dark':
+                depends += [node_name('dark', dark) for dark in
+                            find_calibrations(table, 'Dark', record)]
+            if stage in ('arc', 'telluric', 'science'):
+                depends += [node_name('flat', flat) for flat in
+                            find_calibrations(table, 'Flat', record)]
+            if stage in ('telluric', 'science'):
+                depends += [node_name('arc', arc) for arc in
+                            find_calibrations(table, 'Arc', record)]
+            files = get_filenames(record.rootname, record.filerange, rawdir)
+            add(stage, record, depends, files)
+    
+    for record in table.select_records_from_table({'datatype': 'Science'}):
+        tellurics = table.select_records_from_table(
+            {'datatype': 'Telluric', 'targetname': record.targetname,
+             'band': record.band})
+        depends = [node_name('science', record)] + \
+                  [node_name('telluric', telluric) for telluric in tellurics]
+        add('tellcorr', record, depends, [])
+    return graph
@@ -0,0 +1,389 @@
+# extract.py
+"""
+Optimal extraction of 1-D spectra from rectified 2-D frames.
+
+This replaces nsextract and the trace position entered by hand.  The
+trace is found on the spatial profile collapsed along the dispersion,
+followed along the dispersion in blocks, and the spatial profile is
+estimated in the same blocks and interpolated between them.  The
+extraction itself is the optimal, variance-weighted, extraction of
+Horne (1986, PASP 98, 609), done on the whole 2-D array at once with
+iterative rejection of the deviant pixels (cosmic rays).
+
+The result is returned as spectro.Spectrum objects, without writing
+any file.
+
+Usage:
+    frame = Frame.from_file('tfobj_comb.fits')
+    (spectrum, variance, extraction) = extract_spectrum(frame)
+"""
+
+import numpy as np
+
+class Extraction(object):
+    """
+    Result of an optimal extraction.
+    
+    Attributes
+    ----------
+    flux : ndarray
+        Extracted spectrum.
+    var : ndarray
+        Variance of the extracted spectrum.
+    trace : ndarray
+        Spatial position of the trace at each dispersion pixel.
+    profile : ndarray
+        Normalized spatial profile, same shape as the frame.
+    mask : ndarray
+        Boolean, True for the pixels used, same shape as the frame.
+    """
+    def __init__(self, flux, var, trace, profile, mask):
+        self.flux = flux
+        self.var = var
+        self.trace = trace
+        self.profile = profile
+        self.mask = mask
+
+
+def find_trace(data, mask=None, sign=1):
+    """
+    Find the spatial position of the brightest source.
+    
+    The frame is collapsed with a median along the dispersion, which
+    ignores the sky lines and the cosmic rays, and the maximum of the
+    profile is centroided.
+    
+    Parameters
+    ----------
+    data : ndarray
+        2-D frame, dispersion along the first axis.
+    mask : ndarray, optional
+        Boolean, True for the good pixels.
+    sign : int, optional
+        1 to find a positive trace, -1 for a negative one, eg. the
+        B position of a sky-subtracted ABBA frame.  Default = 1.
+    
+    Returns
+    -------
+    float
+        0-based spatial position.
+    """
+    data = sign * np.asarray(data, dtype=np.float64)
+    if mask is not None:
+        data = np.where(mask, data, np.nan)
+    with np.errstate(invalid='ignore'):
+        profile = np.nanmedian(data, axis=0)
+    profile = np.where(np.isfinite(profile), profile, -np.inf)
+    peak = int(np.argmax(profile))
+    if 0 < peak < profile.size - 1 and np.isfinite(profile[peak - 1]) and \
+       np.isfinite(profile[peak + 1]):
+        (left, centre, right) = profile[peak - 1:peak + 2]
+        curvature = left - 2. * centre + right
+        if curvature < 0.:
+            return peak + 0.5 * (left - right) / curvature
+    return float(peak)
+
+def trace_along_dispersion(data, centre, width=5., mask=None, block=64,
+                           order=2):
+    """
+    Follow the trace along the dispersion and fit its position.
+    
+    The frame is median-combined in blocks of rows; in each block the
+    position is the flux-weighted centroid within width of centre.  A
+    polynomial is fitted to the block positions.
+    
+    Parameters
+    ----------
+    data : ndarray
+        2-D frame, dispersion along the first axis.
+    centre : float
+        Position of the trace, from find_trace().
+    width : float, optional
+        Half-width of the centroid window, in pixels.  Default = 5.
+    mask : ndarray, optional
+        Boolean, True for the good pixels.
+    block : int, optional
+        Number of rows per block.  Default = 64.
+    order : int, optional
+        Order of the polynomial.  Default = 2.
+    
+    Returns
+    -------
+    ndarray
+        Position of the trace for every row.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if mask is not None:
+        data = np.where(mask, data, np.nan)
+    (nrows, ncols) = data.shape
+    columns = np.arange(ncols)
+    window = np.abs(columns - centre) <= width
+    
+    starts = np.arange(0, nrows, block)
+    with np.errstate(invalid='ignore'):
+        profiles = np.array([np.nanmedian(data[start:start + block], axis=0)
+                             for start in starts])
+    weights = np.where(window & np.isfinite(profiles),
+                       np.clip(profiles, 0., None), 0.)
+    total = weights.sum(axis=1)
+    valid = total > 0.
+    if valid.sum() <= order:
+        return np.full(nrows, centre)
+    positions = (weights * columns).sum(axis=1)[valid] / total[valid]
+    rows = (starts + np.minimum(block, nrows - starts) / 2. - 0.5)[valid]
+    
+    used = np.ones(rows.size, dtype=bool)
+    for _ in range(3):
+        coeffs = np.polyfit(rows[used], positions[used], order)
+        residuals = positions - np.polyval(coeffs, rows)
+        sigma = max(np.std(residuals[used]), 0.1)
+        keep = np.abs(residuals) <= 3. * sigma
+        if (keep == used).all() or keep.sum() <= order:
+            break
+        used = keep
+    return np.polyval(coeffs, np.arange(nrows))
+
+def aperture_mask(shape, trace, width):
+    """
+    Boolean mask of the pixels within width of the trace.
+    """
+    columns = np.arange(shape[1])[np.newaxis, :]
+    return np.abs(columns - trace[:, np.newaxis]) <= width
+
+def fit_profile(data, mask, aperture, block=64):
+    """
+    Estimate the normalized spatial profile.
+    
+    The data in the aperture are summed in blocks of rows, each block
+    is normalized, and the block profiles are linearly interpolated
+    along the dispersion for every row.  Negative values are set to
+    zero and each row is normalized to a sum of 1 within the aperture.
+    
+    Parameters
+    ----------
+    data : ndarray
+        2-D frame, dispersion along the first axis.
+    mask : ndarray
+        Boolean, True for the good pixels.
+    aperture : ndarray
+        Boolean, True for the pixels in the aperture.
+    block : int, optional
+        Number of rows per block.  Default = 64.
+    
+    Returns
+    -------
+    ndarray
+        Profile, same shape as data, 0 outside the aperture.
+    """
+    nrows = data.shape[0]
+    use = mask & aperture
+    values = np.where(use, data, 0.)
+    starts = np.arange(0, nrows, block)
+    sums = np.add.reduceat(values, starts, axis=0)
+    counts = np.add.reduceat(use.astype(np.float64), starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(counts > 0, sums / counts, 0.)
+    means = np.clip(means, 0., None)
+    totals = means.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        blocks = np.where(totals > 0, means / totals, 0.)
+    
+    centres = starts + np.minimum(block, nrows - starts) / 2. - 0.5
+    rows = np.arange(nrows, dtype=np.float64)
+    index = np.clip(np.searchsorted(centres, rows) - 1, 0,
+                    max(centres.size - 2, 0))
+    if centres.size > 1:
+        frac = np.clip((rows - centres[index]) /
+                       (centres[index + 1] - centres[index]), 0., 1.)
+        profile = (1. - frac[:, np.newaxis]) * blocks[index] + \
+                  frac[:, np.newaxis] * blocks[index + 1]
+    else:
+        profile = np.repeat(blocks, nrows, axis=0)
+    
+    profile = np.where(aperture, profile, 0.)
+    norm = profile.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profile = np.where(norm > 0, profile / norm, 0.)
+    return profile
+
+def optimal_extract(data, var, profile, mask, nsigma=5., niter=5):
+    """
+    Horne optimal extraction of all the rows at once.
+    
+    f = sum(M P D / V) / sum(M P^2 / V) and var(f) = sum(M P) /
+    sum(M P^2 / V).  The pixels that deviate from f P by more than
+    nsigma standard deviations are masked and the extraction repeated.
+    
+    Parameters
+    ----------
+    data, var : ndarray
+        2-D frame and variance, dispersion along the first axis.
+    profile : ndarray
+        Normalized spatial profile, see fit_profile().
+    mask : ndarray
+        Boolean, True for the good pixels.
+    nsigma : float, optional
+        Rejection threshold.  Default = 5.
+    niter : int, optional
+        Maximum number of rejection iterations.  Default = 5.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (flux, variance, mask) with the final mask.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    var = np.asarray(var, dtype=np.float64)
+    mask = mask & (profile > 0.) & (var > 0.) & np.isfinite(data)
+    safe_var = np.where(mask, var, 1.)
+    for iteration in range(niter + 1):
+        weight = np.where(mask, profile / safe_var, 0.)
+        denominator = (weight * profile).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flux = np.where(denominator > 0,
+                            (weight * np.where(mask, data, 0.)).sum(axis=1)
+                            / denominator, 0.)
+        deviation = (data - flux[:, np.newaxis] * profile)**2 / safe_var
+        reject = mask & (deviation > nsigma**2)
+        # the last pass only extracts, so that the flux, the variance and
+        # the returned mask agree.
+        if iteration == niter or not reject.any():
+            break
+        # reject only the worst pixel of each row per iteration.
+        worst = np.argmax(np.where(reject, deviation, -1.), axis=1)
+        rows = np.flatnonzero(reject.any(axis=1))
+        mask[rows, worst[rows]] = False
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(denominator > 0,
+                            np.where(mask, profile, 0.).sum(axis=1) /
+                            denominator, 0.)
+    return (flux, variance, mask)
+
+def extract(data, var, dq=None, centre=None, width=None, sign=1,
+            block=64, nsigma=5.):
+    """
+    Find the trace, fit the profile and extract the spectrum.
+    
+    Parameters
+    ----------
+    data, var : ndarray
+        2-D frame and variance, dispersion along the first axis.
+    dq : ndarray, optional
+        Data quality, 0 for the good pixels.
+    centre : float, optional
+        Spatial position of the trace, eg. tel_position in the scripts.
+        Default is found with find_trace().
+    width : float, optional
+        Half-width of the aperture.  Default is 3 times the FWHM of the
+        collapsed profile.
+    sign : int, optional
+        -1 to extract a negative trace.  Default = 1.
+    block : int, optional
+        Number of rows per block for the trace and the profile.
+    nsigma : float, optional
+        Rejection threshold of the extraction.  Default = 5.
+    
+    Returns
+    -------
+    Extraction
+    """
+    data = sign * np.asarray(data, dtype=np.float64)
+    var = np.asarray(var, dtype=np.float64)
+    mask = np.isfinite(data) & np.isfinite(var)
+    if dq is not None:
+        mask &= (np.asarray(dq) == 0)
+    
+    if centre is None:
+        centre = find_trace(data, mask)
+    if width is None:
+        width = 3. * estimate_fwhm(data, mask, centre)
+    trace = trace_along_dispersion(data, centre, width, mask, block)
+    aperture = aperture_mask(data.shape, trace, width)
+    profile = fit_profile(data, mask, aperture, block)
+    (flux, variance, mask) = optimal_extract(data, var, profile, mask,
+                                             nsigma)
+    return Extraction(sign * flux, variance, trace, profile, mask)
+
+def estimate_fwhm(data, mask, centre):
+    """
+    FWHM of the collapsed spatial profile around centre, in pixels.
+    """
+    with np.errstate(invalid='ignore'):
+        profile = np.nanmedian(np.where(mask, data, np.nan), axis=0)
+    profile = np.where(np.isfinite(profile), profile, 0.)
+    profile -= np.median(profile)
+    peak = int(round(centre))
+    half = profile[peak] / 2.
+    if half <= 0.:
+        return 2.
+    left = peak
+    while left > 0 and profile[left - 1] > half:
+        left -= 1
+    right = peak
+    while right < profile.size - 1 and profile[right + 1] > half:
+        right += 1
+    return max(float(right - left + 1), 2.)
+
+def extract_spectrum(frame, dispaxis=None, wunit=None, **kwargs):
+    """
+    Extract a rectified frame into Spectrum objects.
+    
+    The dispersion solution is read from the SCI header, as written by
+    nstransform or rectify.RectificationMap.apply_frame().
+    
+    Parameters
+    ----------
+    frame : frames.Frame
+        Rectified frame with a VAR plane.
+    dispaxis : int, optional
+        Dispersion axis, as DISPAXIS.  Default is DISPAXIS from the
+        headers, or 2.
+    wunit : Unit, optional
+        Wavelength unit.  Default is from the WAT keywords, or Angstrom.
+    **kwargs
+        Passed to extract(), eg. centre, width, sign.
+    
+    Returns
+    -------
+    tuple
+        (spectrum, variance, extraction): the spectrum and its variance
+        as spectro.Spectrum, and the Extraction with the trace and the
+        profile.
+    """
+    from astropy import units as u
+    from astropy.io import fits
+    from spectro import Spectrum
+    
+    header = frame.header
+    if dispaxis is None:
+        dispaxis = header.get('DISPAXIS', frame.phu.get('DISPAXIS', 2))
+    data = np.asarray(frame.sci)
+    var = np.asarray(frame.var) if frame.var is not None else None
+    dq = np.asarray(frame.dq) if frame.dq is not None else None
+    if var is None:
+        raise ValueError('The frame has no variance plane.')
+    if dispaxis == 1:
+        data = data.T
+        var = var.T
+        dq = dq.T if dq is not None else None
+    
+    extraction = extract(data, var, dq, **kwargs)
+    
+    axis = dispaxis
+    crval = header.get('CRVAL%d' % axis, 1.)
+    cdelt = header.get('CD%d_%d' % (axis, axis),
+                       header.get('CDELT%d' % axis, 1.))
+    crpix = header.get('CRPIX%d' % axis, 1.)
+    if wunit is None:
+        try:
+            wunit = Spectrum.get_wunit(fits.Header([('WAT1_001',
+                                       header.get('WAT%d_001' % axis, ''))]))
+        except (IndexError, ValueError):
+            wunit = u.Angstrom
+    
+    spectrum = Spectrum.from_array(extraction.flux, crval, cdelt, crpix,
+                                   wunit=wunit, header=frame.phu)
+    variance = Spectrum.from_array(extraction.var, crval, cdelt, crpix,
+                                   wunit=wunit, header=frame.phu)
+    return (spectrum, variance, extraction)
@@ -0,0 +1,256 @@
+# flatnorm.py
+"""
+Normalize a spectroscopic flat field and derive the bad pixel mask.
+
+This replaces the interactive nsflat step.  The lamp profile along the
+dispersion axis is fitted with a Legendre polynomial for all the columns
+at once: the design matrix is the same for every column, so the fit is
+one matrix product with its pseudo-inverse.  The order is chosen by
+cross-validation over a grid of candidates instead of by eye.
+
+Usage:
+    filenames = combine.get_filenames('S20131002', '055', prefix='cdf')
+    (flat, bpm, order) = make_flat(filenames, 'flat.fits', 'f2_ls_bpm.fits')
+"""
+
+import numpy as np
+
+DEFAULT_ORDERS = (20, 40, 60, 80, 100, 120)
+
+def legendre_design(npix, order):
+    """
+    Legendre design matrix over the pixels of the dispersion axis.
+    
+    Parameters
+    ----------
+    npix : int
+        Number of pixels along the dispersion axis.
+    order : int
+        Order of the polynomial.
+    
+    Returns
+    -------
+    ndarray
+        Shape (npix, order+1).
+    """
+    x = np.linspace(-1., 1., npix)
+    return np.polynomial.legendre.legvander(x, order)
+
+def fit_profiles(data, good, order, niter=3, nsigma=3.):
+    """
+    Fit every column of data along the first axis.
+    
+    Bad pixels, and pixels rejected by the fit, are replaced by the model
+    of the previous iteration so that all the columns can still be fitted
+    with the same pseudo-inverse.
+    
+    Parameters
+    ----------
+    data : ndarray
+        Shape (npix, ncols), the dispersion axis first.
+    good : ndarray
+        Boolean, same shape, False for the pixels to ignore.
+    order : int
+        Order of the Legendre polynomial.
+    niter : int, optional
+        Number of rejection iterations.  Default = 3.
+    nsigma : float, optional
+        Rejection threshold, in standard deviations of the residuals
+        of each column.  Default = 3.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (model, good), the fitted profiles and the updated mask.
+    """
+    design = legendre_design(data.shape[0], order)
+    pinv = np.linalg.pinv(design)
+    good = good.copy()
+    filled = fill_bad_pixels(data, good)
+    for _ in range(niter + 1):
+        model = np.dot(design, np.dot(pinv, filled))
+        residuals = np.where(good, data - model, 0.)
+        ngood = np.maximum(good.sum(axis=0), 1)
+        sigma = np.sqrt((residuals**2).sum(axis=0) / ngood)
+        good &= np.abs(data - model) <= nsigma * sigma
+        filled = np.where(good, data, model)
+    return (model, good)
+
+def fill_bad_pixels(data, good):
+    """
+    Replace the bad pixels of each column by the median of its good
+    pixels, as a starting point for the fit.
+    """
+    masked = np.where(good, data, np.nan)
+    with np.errstate(invalid='ignore'):
+        median = np.nanmedian(masked, axis=0)
+    median = np.where(np.isfinite(median), median, 0.)
+    return np.where(good, data, median)
+
+def select_order(data, good, orders=DEFAULT_ORDERS, nfolds=5):
+    """
+    Choose the fit order by k-fold cross-validation.
+    
+    The pixels along the dispersion axis are split into nfolds
+    interleaved folds.  For each candidate order, each fold is predicted
+    from a fit to the other folds, for all the columns at once, and the
+    squared errors of the good pixels are summed.
+    
+    Parameters
+    ----------
+    data : ndarray
+        Shape (npix, ncols), the dispersion axis first.
+    good : ndarray
+        Boolean, same shape, False for the pixels to ignore.
+    orders : sequence of int, optional
+        Candidate orders.  Default = DEFAULT_ORDERS.
+    nfolds : int, optional
+        Number of folds.  Default = 5.
+    
+    Returns
+    -------
+    tuple
+        (order, errors), the best order and the cross-validation error
+        of each candidate.
+    """
+    npix = data.shape[0]
+    # the bad pixels are filled with a fit of the highest order so that
+    # every fold can be fitted with one pseudo-inverse.
+    (model, good) = fit_profiles(data, good, max(orders), niter=1)
+    filled = np.where(good, data, model)
+    folds = np.arange(npix) % nfolds
+    
+    errors = []
+    for order in orders:
+        design = legendre_design(npix, order)
+        error = 0.
+        for fold in range(nfolds):
+            test = (folds == fold)
+            pinv = np.linalg.pinv(design[~test])
+            prediction = np.dot(design[test], np.dot(pinv, filled[~test]))
+            residuals = np.where(good[test], data[test] - prediction, 0.)
+            error += (residuals**2).sum()
+        errors.append(error / good.sum())
+    
+    return (orders[int(np.argmin(errors))], errors)
+
+def normalize_flat(flat, order=None, orders=DEFAULT_ORDERS, nfolds=5,
+                   thr_flo=0.35, thr_fup=3.0, dispaxis=None, niter=3):
+    """
+    Normalize a flat field by its lamp profile.
+    
+    Each column along the dispersion axis is divided by its fitted
+    profile.  The pixels are flagged as bad where the normalized flat is
+    below thr_flo or above thr_fup, where the fitted profile is below
+    thr_flo times its median (unilluminated), and where the input DQ is
+    set.  The normalized flat is set to 1 at the bad pixels.
+    
+    Parameters
+    ----------
+    flat : frames.Frame
+        Dark-subtracted and cut flat.
+    order : int, optional
+        Order of the fit.  Default is chosen by select_order().
+    orders : sequence of int, optional
+        Candidate orders for the cross-validation.
+    nfolds : int, optional
+        Number of folds for the cross-validation.  Default = 5.
+    thr_flo : float, optional
+        Lower threshold.  Default = 0.35, as in the reduction scripts.
+    thr_fup : float, optional
+        Upper threshold.  Default = 3.0.
+    dispaxis : int, optional
+        Dispersion axis, 1 along the rows or 2 along the columns, as the
+        DISPAXIS keyword.  Default is DISPAXIS from the headers, or 2.
+    niter : int, optional
+        Number of rejection iterations of the fit.  Default = 3.
+    
+    Returns
+    -------
+    tuple
+        (normflat, bpm, order): the normalized flat as a frames.Frame,
+        the boolean bad pixel mask and the order used.
+    """
+    from frames import Frame, DQ_BAD
+    
+    if dispaxis is None:
+        dispaxis = flat.header.get('DISPAXIS', flat.phu.get('DISPAXIS', 2))
+    transpose = (dispaxis == 1)
+    
+    data = np.asarray(flat.sci, dtype=np.float64)
+    good = np.isfinite(data)
+    if flat.dq is not None:
+        good &= (np.asarray(flat.dq) == 0)
+    if transpose:
+        data = data.T
+        good = good.T
+    data = np.where(good, data, 0.)
+    
+    if order is None:
+        (order, _) = select_order(data, good, orders, nfolds)
+    (model, _) = fit_profiles(data, good, order, niter=niter)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = data / model
+        unlit = model < thr_flo * np.median(model[good])
+    bpm = ~good | unlit | ~np.isfinite(normalized) | \
+          (normalized < thr_flo) | (normalized > thr_fup)
+    normalized[bpm] = 1.
+    
+    var = None
+    if flat.var is not None:
+        var = np.asarray(flat.var, dtype=np.float64)
+        if transpose:
+            var = var.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = var / model**2
+        var[bpm] = 0.
+    
+    if transpose:
+        normalized = normalized.T
+        bpm = bpm.T
+        var = var.T if var is not None else None
+    
+    dq = np.where(bpm, DQ_BAD, 0).astype(np.int16)
+    phu = flat.phu.copy()
+    phu['FLATORDR'] = (order, 'Order of the flat normalization')
+    phu['THR_FLO'] = (thr_flo, 'Lower threshold of the flat')
+    phu['THR_FUP'] = (thr_fup, 'Upper threshold of the flat')
+    normflat = Frame(normalized.astype(np.float32),
+                     var.astype(np.float32) if var is not None else None,
+                     dq, phu=phu, header=flat.header.copy())
+    return (normflat, bpm, order)
+
+def make_flat(filenames, flatfile='flat.fits', bpmfile='f2_ls_bpm.fits',
+              **kwargs):
+    """
+    Combine the flats, normalize them and write the flat and the BPM.
+    
+    Parameters
+    ----------
+    filenames : list of str
+        Dark-subtracted and cut flats, eg. the cdf@flat.lis frames.
+    flatfile : str, optional
+        Output normalized flat.  Default = 'flat.fits'.
+    bpmfile : str, optional
+        Output bit-packed bad pixel mask, see frames.write_bpm().
+        Default = 'f2_ls_bpm.fits'.
+    **kwargs
+        Passed to normalize_flat().
+    
+    Returns
+    -------
+    tuple
+        (normflat, bpm, order), see normalize_flat().
+    """
+    from combine import combine_files
+    from frames import Frame, write_bpm
+    
+    if len(filenames) == 1:
+        flat = Frame.from_file(filenames[0], memmap=False)
+    else:
+        flat = combine_files(filenames, mode='average')
+    (normflat, bpm, order) = normalize_flat(flat, **kwargs)
+    normflat.write(flatfile)
+    write_bpm(bpmfile, bpm)
+    return (normflat, bpm, order)
@@ -0,0 +1,303 @@
+# frames.py
+"""
+Container for F2 frames with science, variance and data quality planes.
+
+The Gemini IRAF tasks store a prepared frame as a multi-extension FITS
+file: the primary header (PHU) followed by the SCI, VAR and DQ
+extensions.  A raw F2 frame has its pixels in the PHU, with a leading
+axis of length 1.  Frame reads both, memory-mapped, and writes the
+Gemini layout.
+"""
+
+import numpy as np
+
+# DQ bits, as used by the Gemini IRAF packages.
+DQ_BAD = 1
+DQ_NONLINEAR = 2
+DQ_SATURATED = 4
+DQ_COSMIC = 8
+DQ_NODATA = 16
+
+# F2 detector gain, in electrons per ADU, and read noise, in electrons,
+# for each read mode.
+F2_GAIN = 4.44
+F2_READ_NOISE = {'bright': 11.7, 'medium': 6.0, 'faint': 5.0}
+
+class Frame(object):
+    """
+    One frame: science pixels with optional variance and DQ planes.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        2-D science pixels.
+    var : ndarray, optional
+        Variance of the science pixels.
+    dq : ndarray, optional
+        Data quality bits, 0 for good pixels.
+    phu : Header, optional
+        Primary header.
+    header : Header, optional
+        Header of the science extension.
+    filename : str, optional
+        File the frame was read from.
+    """
+    def __init__(self, sci, var=None, dq=None, phu=None, header=None,
+                 filename=None):
+        from astropy.io import fits
+        
+        self.sci = sci
+        self.var = var
+        self.dq = dq
+        self.phu = phu if phu is not None else fits.Header()
+        self.header = header if header is not None else fits.Header()
+        self.filename = filename
+        self.hdulist = None
+    
+    @classmethod
+    def from_file(cls, filename, memmap=True):
+        """
+        Read a frame from a raw or a prepared FITS file.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the FITS file.
+        memmap : bool, optional
+            Memory-map the pixels.  Nothing is read until the arrays
+            are accessed.  Default = True.
+        
+        Returns
+        -------
+        Frame
+            With memmap, the file stays open until close() is called.
+        """
+        from astropy.io import fits
+        
+        hdulist = fits.open(filename, memmap=memmap)
+        extnames = [hdu.name for hdu in hdulist]
+        if 'SCI' in extnames:
+            sci_hdu = hdulist['SCI']
+            var = hdulist['VAR'].data if 'VAR' in extnames else None
+            dq = hdulist['DQ'].data if 'DQ' in extnames else None
+            header = sci_hdu.header
+        else:
+            sci_hdu = hdulist[0]
+            var = None
+            dq = None
+            header = None
+        
+        frame = cls(squeeze_frame(sci_hdu.data), squeeze_frame(var),
+                    squeeze_frame(dq), phu=hdulist[0].header,
+                    header=header, filename=filename)
+        if memmap:
+            frame.hdulist = hdulist
+        else:
+            hdulist.close()
+        return frame
+    
+    @property
+    def shape(self):
+        """
+        Shape of the science pixels.
+        """
+        return self.sci.shape
+    
+    def close(self):
+        """
+        Close the file opened by from_file(), if any.
+        """
+        if self.hdulist is not None:
+            self.hdulist.close()
+            self.hdulist = None
+    
+    def to_hdulist(self):
+        """
+        Build the Gemini multi-extension layout: PHU, SCI, VAR and DQ.
+        VAR and DQ are left out if not set.
+        
+        Returns
+        -------
+        HDUList
+        """
+        from astropy.io import fits
+        
+        header = self.phu.copy()
+        # the pixels move to the SCI extension.
+        for keyword in ('NAXIS1', 'NAXIS2', 'NAXIS3'):
+            header.remove(keyword, ignore_missing=True)
+        phu = fits.PrimaryHDU(header=header)
+        phu.header['NEXTEND'] = 1 + (self.var is not None) + \
+                                (self.dq is not None)
+        hdulist = fits.HDUList([phu])
+        for (extname, data) in (('SCI', self.sci), ('VAR', self.var),
+                                ('DQ', self.dq)):
+            if data is None:
+                continue
+            header = self.header.copy() if extname == 'SCI' else None
+            hdu = fits.ImageHDU(np.asarray(data), header=header,
+                                name=extname)
+            hdu.header['EXTVER'] = 1
+            hdulist.append(hdu)
+        return hdulist
+    
+    def write(self, filename, clobber=True):
+        """
+        Write the frame in the Gemini multi-extension layout.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the output file.
+        clobber : bool, optional
+            Overwrite an existing file.  Default = True.
+        """
+        import os.path
+        
+        if os.path.exists(filename):
+            if not clobber:
+                raise IOError('File exists: %s' % filename)
+            os.remove(filename)
+        self.to_hdulist().writeto(filename, output_verify='silentfix')
+
+
+def subtract_frames(frame, other):
+    """
+    Subtract a frame, eg. a dark or a sky, propagating VAR and DQ.
+    
+    Parameters
+    ----------
+    frame, other : Frame
+    
+    Returns
+    -------
+    Frame
+        With the headers of frame.  The variances add and the DQ are
+        combined with a bitwise OR.
+    """
+    sci = np.asarray(frame.sci, dtype=np.float32) - other.sci
+    var = _combine_var(frame.var, other.var, lambda a, b: a + b)
+    dq = _combine_dq(frame.dq, other.dq)
+    return Frame(sci.astype(np.float32), var, dq, phu=frame.phu.copy(),
+                 header=frame.header.copy(), filename=frame.filename)
+
+def divide_frames(frame, other):
+    """
+    Divide by a frame, eg. a normalized flat, propagating VAR and DQ.
+    
+    Pixels where other is 0 are set to 0 and flagged DQ_BAD.
+    
+    Parameters
+    ----------
+    frame, other : Frame
+    
+    Returns
+    -------
+    Frame
+        With the headers of frame.
+    """
+    numerator = np.asarray(frame.sci, dtype=np.float64)
+    denominator = np.asarray(other.sci, dtype=np.float64)
+    zero = (denominator == 0.)
+    safe = np.where(zero, 1., denominator)
+    sci = np.where(zero, 0., numerator / safe)
+    # var(a/b) = var(a)/b**2 + a**2 var(b)/b**4
+    var = _combine_var(frame.var, other.var,
+                       lambda a, b: a / safe**2 + sci**2 * b / safe**2,
+                       fill=0.)
+    if var is not None:
+        var[zero] = 0.
+    dq = _combine_dq(frame.dq, other.dq)
+    if zero.any():
+        dq = np.zeros(sci.shape, dtype=np.int16) if dq is None else dq
+        dq[zero] |= DQ_BAD
+    return Frame(sci.astype(np.float32), var, dq, phu=frame.phu.copy(),
+                 header=frame.header.copy(), filename=frame.filename)
+
+def _combine_var(var, other, function, fill=0.):
+    # A missing variance counts as 0, but two missing variances give None.
+    if var is None and other is None:
+        return None
+    var = fill if var is None else np.asarray(var, dtype=np.float64)
+    other = fill if other is None else np.asarray(other, dtype=np.float64)
+    return np.asarray(function(var, other), dtype=np.float32)
+
+def _combine_dq(dq, other):
+    if dq is None and other is None:
+        return None
+    if dq is None:
+        return np.array(other, dtype=np.int16)
+    if other is None:
+        return np.array(dq, dtype=np.int16)
+    return (np.asarray(dq) | np.asarray(other)).astype(np.int16)
+
+def squeeze_frame(data):
+    """
+    Drop the leading axes of length 1 of a raw F2 image.  A raw frame
+    is stored as a (1, 2048, 2048) cube.
+    
+    Parameters
+    ----------
+    data : ndarray or None
+    
+    Returns
+    -------
+    ndarray or None
+        2-D view of the data.
+    """
+    if data is None:
+        return None
+    while data.ndim > 2 and data.shape[0] == 1:
+        data = data[0]
+    return data
+
+def write_bpm(filename, mask, clobber=True):
+    """
+    Write a bad pixel mask with 8 pixels per byte.
+    
+    The mask is packed along the rows with numpy.packbits and stored as
+    an 8-bit FITS image.  BPMNCOLS records the number of columns of the
+    unpacked mask.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the output file.
+    mask : ndarray
+        2-D boolean mask, True for bad pixels.
+    clobber : bool, optional
+        Overwrite an existing file.  Default = True.
+    """
+    import os.path
+    from astropy.io import fits
+    
+    if os.path.exists(filename):
+        if not clobber:
+            raise IOError('File exists: %s' % filename)
+        os.remove(filename)
+    hdu = fits.PrimaryHDU(np.packbits(np.asarray(mask, dtype=bool), axis=1))
+    hdu.header['BPMNCOLS'] = (mask.shape[1], 'Number of columns unpacked')
+    hdu.header['NBADPIX'] = (int(np.count_nonzero(mask)), 
+                             'Number of bad pixels')
+    hdu.writeto(filename)
+
+def read_bpm(filename):
+    """
+    Read a bad pixel mask written by write_bpm().
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the BPM file.
+    
+    Returns
+    -------
+    ndarray
+        2-D boolean mask, True for bad pixels.
+    """
+    from astropy.io import fits
+    
+    with fits.open(filename) as hdulist:
+        hdu = hdulist[0]
+        ncols = hdu.header['BPMNCOLS']
+        return np.unpackbits(hdu.data, axis=1)[:, :ncols].astype(bool)
@@ -0,0 +1,285 @@
+"""
+Persistent on-disk cache of FITS headers.
+
+Reading a few keywords from thousands of raw files on a slow external
+drive is dominated by the disk access.  The HeaderCache stores all the
+headers of each file in a SQLite database, keyed by the absolute path.
+An entry is valid only if the size and the modification time of the file
+have not changed since it was cached.  The least recently used entries
+are evicted when the cache grows beyond its maximum number of files.
+
+Usage:
+    cache = HeaderCache()
+    phu = cache.get_header('S20131002S0046.fits')
+    sci = cache.get_header('S20131002S0046.fits', ('SCI', 1))
+    cache.prefill('/Volumes/f2data/raw')
+"""
+
+import os
+import os.path
+import json
+import time
+import sqlite3
+
+DEFAULT_CACHE_ENV = 'F2_HEADER_CACHE'
+DEFAULT_CACHE_NAME = os.path.join('~', '.f2_header_cache.sqlite')
+DEFAULT_MAXENTRIES = 50000
+
+_DEFAULT_CACHE = None
+
+class HeaderCache(object):
+    """
+    SQLite cache of the headers of FITS files.
+    
+    :param filename: Name of the SQLite database.  It is created if it
+        does not exist.  [Default: $F2_HEADER_CACHE, or
+        ~/.f2_header_cache.sqlite]
+    :type filename: str
+    :param maxentries: Maximum number of files in the cache.
+        [Default: 50000]
+    :type maxentries: int
+    """
+    def __init__(self, filename=None, maxentries=DEFAULT_MAXENTRIES):
+        if filename is None:
+            filename = os.environ.get(DEFAULT_CACHE_ENV, DEFAULT_CACHE_NAME)
+        self.filename = os.path.expanduser(filename)
+        self.maxentries = maxentries
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS headers '
+                                '(path TEXT PRIMARY KEY, size INTEGER, '
+                                'mtime REAL, atime REAL, headers TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS headers_atime '
+                                'ON headers (atime)')
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        cursor = self.connection.execute('SELECT COUNT(*) FROM headers')
+        return cursor.fetchone()[0]
+    
+    def close(self):
+        """
+        Close the database.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+    
+    def get_header(self, filename, extension=0):
+        """
+        Return a header of a FITS file, from the cache if it is up to date.
+        
+        :param filename: Name of the FITS file.
+        :type filename: str
+        :param extension: Index, EXTNAME or (EXTNAME, EXTVER) of the
+            extension.  [Default: 0, the PHU]
+        :type extension: int, str or tuple
+        :rtype: astropy.io.fits.Header
+        """
+        return self.get_headers([filename], extension)[0]
+    
+    def get_headers(self, filenames, extension=0, nthreads=None):
+        """
+        Return the same header from each file of a list.
+        
+        Only the files that are not in the cache, or that have changed,
+        are read.  They are read by a pool of threads and added to the
+        cache in one transaction.
+        
+        :param filenames: Names of the FITS files.
+        :type filenames: list of str
+        :param extension: Index, EXTNAME or (EXTNAME, EXTVER) of the
+            extension.  [Default: 0, the PHU]
+        :type extension: int, str or tuple
+        :param nthreads: Number of threads reading the files not in the
+            cache.  [Default: 4 per core]
+        :type nthreads: int
+        :rtype: list of astropy.io.fits.Header
+        """
+        entries = self._lookup(filenames)
+        missing = [filename for filename in filenames
+                   if entries[filename] is None]
+        self.hits += len(filenames) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            entries.update(self._read_and_store(missing, nthreads))
+        
+        return [select_header(entries[filename], extension)
+                for filename in filenames]
+    
+    def prefill(self, rawdir, pattern='*.fits', nthreads=None):
+        """
+        Add all the files of a directory to the cache.
+        
+        :param rawdir: Directory to scan.
+        :type rawdir: str
+        :param pattern: Glob pattern of the files.  [Default: '*.fits']
+        :type pattern: str
+        :param nthreads: Number of threads reading the files.
+            [Default: 4 per core]
+        :type nthreads: int
+        :rtype: int, number of files that had to be read.
+        """
+        import glob
+        
+        filenames = sorted(glob.glob(os.path.join(rawdir, pattern)))
+        misses = self.misses
+        self.get_headers(filenames, nthreads=nthreads)
+        return self.misses - misses
+    
+    def evict(self, maxentries=None):
+        """
+        Remove the least recently used files until at most maxentries
+        are left.
+        
+        :param maxentries: Number of files to keep.
+            [Default: self.maxentries]
+        :type maxentries: int
+        """
+        if maxentries is None:
+            maxentries = self.maxentries
+        self.connection.execute('DELETE FROM headers WHERE path IN '
+                                '(SELECT path FROM headers '
+                                'ORDER BY atime DESC LIMIT -1 OFFSET ?)',
+                                (maxentries,))
+        self.connection.commit()
+    
+    def clear(self):
+        """
+        Remove all the files from the cache.
+        """
+        self.connection.execute('DELETE FROM headers')
+        self.connection.commit()
+    
+    def _lookup(self, filenames):
+        # Returns {filename: list of header strings, or None if the entry
+        # is missing or stale}.  Updates the access time of the hits.
+        entries = {}
+        now = time.time()
+        hits = []
+        for filename in filenames:
+            entries[filename] = None
+            path = os.path.abspath(filename)
+            stat = os.stat(path)
+            row = self.connection.execute('SELECT size, mtime, headers FROM '
+                                          'headers WHERE path=?',
+                                          (path,)).fetchone()
+            if row is None or row[0] != stat.st_size or \
+                    row[1] != stat.st_mtime:
+                continue
+            entries[filename] = json.loads(row[2])
+            hits.append((now, path))
+        if hits:
+            self.connection.executemany('UPDATE headers SET atime=? '
+                                        'WHERE path=?', hits)
+            self.connection.commit()
+        return entries
+    
+    def _read_and_store(self, filenames, nthreads=None):
+        # Read the headers with a thread pool; sqlite writes stay in
+        # this thread.
+        import multiprocessing
+        from multiprocessing.pool import ThreadPool
+        
+        if len(filenames) == 1:
+            results = [read_entry(filenames[0])]
+        else:
+            if nthreads is None:
+                nthreads = 4 * multiprocessing.cpu_count()
+            pool = ThreadPool(max(1, min(nthreads, len(filenames))))
+            try:
+                results = pool.map(read_entry, filenames)
+            finally:
+                pool.close()
+                pool.join()
+        
+        now = time.time()
+        rows = [(path, size, mtime, now, json.dumps(headers))
+                for (path, size, mtime, headers) in results]
+        self.connection.executemany('INSERT OR REPLACE INTO headers '
+                                    'VALUES (?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+        if len(self) > self.maxentries:
+            self.evict()
+        
+        return dict(zip(filenames,
+                        [headers for (_, _, _, headers) in results]))
+
+def read_entry(filename):
+    """
+    Read all the headers of a FITS file, without the data.
+    
+    The size and modification time are taken before the file is opened
+    so that a file modified while it is read is read again next time.
+    
+    :param filename: Name of the FITS file.
+    :type filename: str
+    :rtype: tuple (abspath, size, mtime, list of header strings)
+    """
+    from astropy.io import fits
+    
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    hdulist = fits.open(path, memmap=True)
+    try:
+        headers = [hdu.header.tostring() for hdu in hdulist]
+    finally:
+        hdulist.close()
+    return (path, stat.st_size, stat.st_mtime, headers)
+
+def select_header(headers, extension=0):
+    """
+    Find an extension in the list of header strings of a file.
+    
+    :param headers: Header strings, in the order of the extensions.
+    :type headers: list of str
+    :param extension: Index, EXTNAME or (EXTNAME, EXTVER).
+    :type extension: int, str or tuple
+    :rtype: astropy.io.fits.Header
+    """
+    from astropy.io import fits
+    
+    if isinstance(extension, int):
+        return fits.Header.fromstring(headers[extension])
+    
+    if isinstance(extension, tuple):
+        (extname, extver) = extension
+    else:
+        (extname, extver) = (extension, None)
+    for header_string in headers[1:]:
+        header = fits.Header.fromstring(header_string)
+        if str(header.get('EXTNAME', '')).upper() != extname.upper():
+            continue
+        if extver is None or header.get('EXTVER', 1) == extver:
+            return header
+    raise KeyError('Extension %s not found.' % str(extension))
+
+def get_default_cache():
+    """
+    Return the HeaderCache shared by the module functions, opening it
+    the first time.
+    
+    :rtype: HeaderCache
+    """
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = HeaderCache()
+    return _DEFAULT_CACHE
+
+def get_header(filename, extension=0, cache=None):
+    """
+    Return a header of a FITS file through the header cache.
+    
+    :param filename: Name of the FITS file.
+    :type filename: str
+    :param extension: Index, EXTNAME or (EXTNAME, EXTVER) of the
+        extension.  [Default: 0, the PHU]
+    :type extension: int, str or tuple
+    :param cache: Cache to use.  [Default: get_default_cache()]
+    :type cache: HeaderCache
+    :rtype: astropy.io.fits.Header
+    """
+    if cache is None:
+        cache = get_default_cache()
+    return cache.get_header(filename, extension)
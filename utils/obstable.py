@@ -12,6 +12,17 @@ Table access Classes
 #etc.
 # pylint: enable=C0301
 
+# Columns with a hash index, and the type of their values.
+INDEXED_COLUMNS = {'targetname': str,
+                   'rootname': str,
+                   'band': str,
+                   'grism': str,
+                   'datatype': str,
+                   'applyto': str,
+                   'exptime': float,
+                   'lnrs': int,
+                   'rdmode': str}
+
 class ObsTable:
     """
     Represents an observations summary table.  Create or extend
@@ -28,6 +39,9 @@ class ObsTable:
     
     def __init__(self, filename=None, records=None):
         self.records = []
+        self.indexes = {}
+        self.applyto_index = {}
+        self.reindex()
         self.add_records_to_table(records)
         self.length = len(self.records)
         self.filename = ObsTable.validate_filename(filename)
@@ -65,30 +79,119 @@ class ObsTable:
         """
         
         if isinstance(records, list):
-            self.records.extend(records)
+            new_records = records
         elif isinstance(records, ObsRecord):
-            self.records.append(records)
+            new_records = [records]
         elif records is None:
-            pass
+            new_records = []
         else:
             raise RuntimeError
+        for record in new_records:
+            self._index_record(record, len(self.records))
+            self.records.append(record)
         self.length = len(self.records)           
         return
 
-#    def select_records_from_table(self, criteria):
-#        # criteria is a dictionary
-#        #   targetname: ["selection string",equals/contain]
-#        #   rootname:  ["selection string", equals/contain]
-#        #   band: ["string", equals]
-#        #   grism: ["string", equals]
-#        #   datatype: ["string", equals]
-#        #   applyto:  ["string", equals]
-#        #   exptime:  [float, equals]
-#        #   LNRS:     [integer, equals]
-#        #   rdmode:   [string, equals]
-#        #
-#        selected_records = []
-#        return selected_records
+    def reindex(self):
+        """
+        Rebuild the indexes from scratch.  Needed only if records
+        already in the table have been modified.
+        """
+        self.indexes = dict((column, {}) for column in INDEXED_COLUMNS)
+        self.applyto_index = {}
+        for (position, record) in enumerate(self.records):
+            self._index_record(record, position)
+        return
+
+    def _index_record(self, record, position):
+        """
+        Add a record to the indexes.
+        
+        :param record: Record to index.
+        :type record: ObsRecord
+        :param position: Position of the record in self.records.
+        :type position: int
+        """
+        for (column, index) in self.indexes.items():
+            index.setdefault(getattr(record, column), set()).add(position)
+        # applyto can hold several comma-separated data types.
+        if record.applyto is not None:
+            for token in record.applyto.split(','):
+                self.applyto_index.setdefault(token, set()).add(position)
+        return
+
+    def select_records_from_table(self, criteria):
+        """
+        Return the records that match all the criteria.
+        
+        Each criterion is an index lookup.  An "equals" criterion is a
+        direct lookup.  A "contains" criterion scans the distinct values
+        of the column, not the records.  For applyto, "contains" matches
+        one of the comma-separated data types exactly, eg. "Science"
+        matches "Science,Arc".  The criteria are combined with a logical
+        AND.
+        
+        :param criteria: Dictionary with the column names as keys.  The
+            values are either the value to match, or a list with the value
+            and the match type, 'equals' or 'contains'.  Column names are
+            targetname, rootname, band, grism, datatype, applyto, exptime,
+            LNRS and rdmode.  Eg. {'datatype': 'Dark',
+            'applyto': ['Science', 'contains'], 'exptime': 90.,
+            'LNRS': 6, 'rdmode': 'faint'}
+        :type criteria: dict
+        :rtype: list of ObsRecord, in table order.
+        """
+        selected = None
+        for (column, criterion) in criteria.items():
+            if isinstance(criterion, (list, tuple)):
+                (value, match) = criterion
+            else:
+                (value, match) = (criterion, 'equals')
+            positions = self._lookup(column.lower(), value, match)
+            if selected is None:
+                selected = positions
+            else:
+                selected = selected & positions
+            if not selected:
+                break
+        
+        if selected is None:
+            return list(self.records)
+        return [self.records[position] for position in sorted(selected)]
+
+    def _lookup(self, column, value, match):
+        """
+        Return the positions of the records that match one criterion.
+        
+        :param column: Name of the column, lower case.
+        :type column: str
+        :param value: Value to match.
+        :type value: str, float or int
+        :param match: 'equals' or 'contains'.
+        :type match: str
+        :rtype: set of int
+        """
+        if column not in INDEXED_COLUMNS:
+            raise KeyError(column)
+        index = self.indexes[column]
+        value = INDEXED_COLUMNS[column](value)
+        
+        if match == 'equals':
+            return set(index.get(value, set()))
+        elif match == 'contains':
+            if INDEXED_COLUMNS[column] is not str:
+                errmsg = '"contains" is not valid for column %s' % column
+                raise ValueError(errmsg)
+            if column == 'applyto':
+                return set(self.applyto_index.get(value, set()))
+            positions = set()
+            for (key, key_positions) in index.items():
+                if key is not None and value in key:
+                    positions |= key_positions
+            return positions
+        else:
+            errmsg = 'Invalid match type "%s"' % match
+            raise ValueError(errmsg)
     
     def print_table(self):
         """
@@ -99,43 +202,58 @@ class ObsTable:
             print record.print_record()
         return
     
-    def read_table(self, filename=None):
+    def read_table(self, filename=None, use_sidecar=True):
         """
         Read table from file on disk.
         
+        Both the tab-separated and the pretty fixed-width formats are
+        read.  If a binary sidecar (see write_sidecar()) exists and is
+        up to date with the file, the columns are loaded from the
+        sidecar instead of parsing the text.
+        
         :param filename: Name of the file to read.  If filename is None,
             then the instance's filename attribute must be defined.
         :type filename: str
+        :param use_sidecar: Use the binary sidecar if it is up to date.
+            [Default: True]
+        :type use_sidecar: bool
         """
         
         if filename is None and self.filename is None:
             raise ValueError
         elif filename is None:
             filename = self.filename
-            
-        try:
+        
+        columns = None
+        if use_sidecar:
+            columns = read_sidecar(filename)
+        
+        if columns is not None:
+            records = records_from_columns(columns)
+        else:
+            records = []
             with open(filename, 'r') as table:
-                # reset the instance.
-                self.records = []
-                self.length = 0
                 for line in table:
                     if line.startswith('#'):
                         continue
                     try:
                         record = ObsRecord()
                         record.read_record(line)
-                        self.add_records_to_table(record)
+                        records.append(record)
                     except ValueError:
                         #probably the title bar  
                         # (pretty format doesn't start with #)
                         continue
-        except IOError:
-            raise
-        table.close()
+        
+        # reset the instance.
+        self.records = []
+        self.length = 0
+        self.reindex()
+        self.add_records_to_table(records)
 
         return
     
-    def write_table(self, filename=None, clobber=True):
+    def write_table(self, filename=None, clobber=True, pretty=False):
         """
         Write table to file on disk.
         
@@ -145,6 +263,9 @@ class ObsTable:
         :param clobber: Set whether the file can be overwritten or not.
             [Default: True]
         :type clobber: bool
+        :param pretty: Write the human readable fixed-width format
+            instead of the tab-separated format.  [Default: False]
+        :type pretty: bool
         
         """
         import os
@@ -160,43 +281,258 @@ class ObsTable:
                     filename
                 raise IOError
             with open(filename, 'w') as table:
-                table.write(self.titlebar)
-                table.write("\n")
-                for record in self.records:
-                    table.write(record.print_record())
+                if pretty:
+                    table.write(format_pretty_table(self.records))
+                else:
+                    table.write(self.titlebar)
                     table.write("\n")
+                    for record in self.records:
+                        table.write(record.print_record())
+                        table.write("\n")
         except IOError:
             raise
         table.close()
 
         return
     
-#    def append_table(self, filename=None):
-#        # use case:  file on disk.  ObsTable contains all new records.  
-#        # Append new records.
-#        # no checks whether there are duplication.  keep it simple for now.
-#        # Not sure if I really need this.  Probably easier to have the whole 
-#        # table in memory in the ObsTable.  It's easy enough to merge the 
-#        # records if I have two ObsTable.
-#        return
+    def append_records(self, records, filename=None):
+        """
+        Add records to the table and append them to the file on disk,
+        without rewriting the file.  Only the first line of the file is
+        read, to find the format and, for the pretty format, the column
+        widths.  If the file does not exist, it is created.
+        
+        No checks are made for duplicates.
+        
+        :param records: Record or list of records to append.
+        :type records: ObsRecord or list of ObsRecord
+        :param filename: Name of the file.  If filename is None, then the
+            instance's filename attribute must be set.
+        :type filename: str
+        """
+        import os
+        
+        if filename is None and self.filename is None:
+            raise IOError
+        elif filename is None:
+            filename = self.filename
+        if isinstance(records, ObsRecord):
+            records = [records]
+        
+        self.add_records_to_table(records)
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            self.write_table(filename)
+            return
+        
+        with open(filename, 'r') as table:
+            header = table.readline().rstrip('\n')
+        if header.startswith('#'):
+            lines = [record.print_record() for record in records]
+        else:
+            widths = get_pretty_widths(header)
+            rows = [record.get_fields() for record in records]
+            if any([len(field) > width for row in rows 
+                    for (field, width) in zip(row, widths)]):
+                # too wide for the columns on disk, re-pad the whole file.
+                with open(filename, 'r') as table:
+                    lines = table.read().splitlines()[1:]
+                rows = [split_pretty_line(line, widths) 
+                        for line in lines if line.strip()] + rows
+                with open(filename, 'w') as table:
+                    table.write(format_pretty_rows(rows))
+                return
+            lines = [format_pretty_line(row, widths) for row in rows]
+        with open(filename, 'a') as table:
+            for line in lines:
+                table.write(line)
+                table.write("\n")
+        return
 
     def pretty_table(self):
         """
         Rewrite the table into a pretty format to make it more human
-        readable.  The write_table routine does a good job but the
-        ascii.write() function makes it even better.  Unfortunately,
-        for ascii.write to work well, the table must be read from disk
-        by ascii.read.  This means double the i/o.  If the table were
-        big that would be a performance hit, but for now, it is not
-        a problem.
-        """
-        from astropy.io import ascii
-        table = ascii.read(self.filename)
-        ascii.write(table, output=self.filename, 
-                    Writer=ascii.FixedWidth, bookend=False, 
-                    delimiter=None)
+        readable.  The fixed-width format is written in a single pass
+        from the records in memory; the file is not read back.
+        """
+        self.write_table(pretty=True)
         return
 
+    def get_columns(self):
+        """
+        Return the table as columns.
+        
+        :rtype: dict of ndarray, keyed by the record attribute names.
+        """
+        import numpy as np
+        
+        columns = {}
+        for name in RECORD_ATTRIBUTES:
+            values = [getattr(record, name) for record in self.records]
+            if name in ('exptime', 'lnrs'):
+                columns[name] = np.array(values, dtype=INDEXED_COLUMNS[name])
+            else:
+                columns[name] = np.array([str(value) for value in values])
+        return columns
+
+    def write_sidecar(self, filename=None):
+        """
+        Write the columns to a binary NPZ sidecar next to the table file,
+        named filename + '.npz'.  The size and modification time of the
+        table file are stored in the sidecar; the sidecar is ignored by
+        read_table() once the table file changes.
+        
+        :param filename: Name of the table file.  If filename is None, 
+            then the instance's filename attribute must be set.
+        :type filename: str
+        """
+        import os
+        import numpy as np
+        
+        if filename is None and self.filename is None:
+            raise IOError
+        elif filename is None:
+            filename = self.filename
+        
+        stat = os.stat(filename)
+        columns = self.get_columns()
+        np.savez(get_sidecar_name(filename), source_size=stat.st_size,
+                 source_mtime=stat.st_mtime, **columns)
+        return
+
+# pylint: disable=C0301
+# Names of the columns in the file and the corresponding ObsRecord attributes.
+COLUMN_NAMES = ['Targetname', 'rootname', 'band', 'grism', 'datatype', 'applyto', 'filerange', 'exptime', 'LNRS', 'rdmode']
+RECORD_ATTRIBUTES = ['targetname', 'rootname', 'band', 'grism', 'datatype', 'applyto', 'filerange', 'exptime', 'lnrs', 'rdmode']
+# pylint: enable=C0301
+
+def format_pretty_line(fields, widths):
+    """
+    Format one line of the fixed-width table.  The fields are right
+    justified and separated by two spaces.
+    
+    :param fields: Values of the columns, as strings.
+    :type fields: list of str
+    :param widths: Width of each column.
+    :type widths: list of int
+    :rtype: str
+    """
+    return '  '.join([field.rjust(width) 
+                      for (field, width) in zip(fields, widths)])
+
+def format_pretty_table(records):
+    """
+    Format records into the fixed-width table, including the header.
+    The columns are as wide as their widest value or name.
+    
+    :param records: Records to format.
+    :type records: list of ObsRecord
+    :rtype: str
+    """
+    return format_pretty_rows([record.get_fields() for record in records])
+
+def format_pretty_rows(rows):
+    """
+    Format rows of fields into the fixed-width table, including the
+    header.  The columns are as wide as their widest value or name.
+    
+    :param rows: Values of the columns of each row, as strings.
+    :type rows: list of list of str
+    :rtype: str
+    """
+    widths = [len(name) for name in COLUMN_NAMES]
+    for row in rows:
+        widths = [max(width, len(field)) for (width, field) in zip(widths, row)]
+    lines = [format_pretty_line(COLUMN_NAMES, widths)]
+    lines.extend([format_pretty_line(row, widths) for row in rows])
+    return '\n'.join(lines) + '\n'
+
+def get_pretty_widths(header):
+    """
+    Get the column widths from the header line of a fixed-width table.
+    The column names are right justified, so each column ends where its
+    name ends.
+    
+    :param header: First line of the fixed-width table.
+    :type header: str
+    :rtype: list of int
+    """
+    widths = []
+    previous_end = -2
+    position = 0
+    for name in header.split():
+        position = header.index(name, position) + len(name)
+        widths.append(position - previous_end - 2)
+        previous_end = position
+    return widths
+
+def split_pretty_line(line, widths):
+    """
+    Split one line of the fixed-width table into its fields.
+    
+    :param line: Line of the fixed-width table.
+    :type line: str
+    :param widths: Width of each column, see get_pretty_widths().
+    :type widths: list of int
+    :rtype: list of str
+    """
+    fields = []
+    start = 0
+    for width in widths:
+        fields.append(line[start:start + width].strip())
+        start += width + 2
+    return fields
+
+def get_sidecar_name(filename):
+    """
+    Return the name of the binary sidecar for a table file.
+    
+    :param filename: Name of the table file.
+    :type filename: str
+    :rtype: str
+    """
+    return filename + '.npz'
+
+def read_sidecar(filename):
+    """
+    Read the columns from the binary sidecar of a table file, if the
+    sidecar exists and is up to date with the file.
+    
+    :param filename: Name of the table file.
+    :type filename: str
+    :rtype: dict of ndarray, or None if there is no valid sidecar.
+    """
+    import os
+    import numpy as np
+    
+    sidecar = get_sidecar_name(filename)
+    if not os.path.exists(sidecar):
+        return None
+    stat = os.stat(filename)
+    npz = np.load(sidecar)
+    try:
+        if npz['source_size'] != stat.st_size or \
+           npz['source_mtime'] != stat.st_mtime:
+            return None
+        columns = dict((name, npz[name]) for name in RECORD_ATTRIBUTES)
+    finally:
+        npz.close()
+    return columns
+
+def records_from_columns(columns):
+    """
+    Create ObsRecords from table columns.
+    
+    :param columns: Columns keyed by record attribute names.
+    :type columns: dict of ndarray
+    :rtype: list of ObsRecord
+    """
+    # The ObsRecord arguments are in column order and the constructor
+    # converts exptime and lnrs.
+    records = []
+    for values in zip(*[columns[name] for name in RECORD_ATTRIBUTES]):
+        records.append(ObsRecord(*[str(value) for value in values]))
+    return records
+
 # pylint: disable=R0902
 class ObsRecord:
     """
@@ -281,6 +617,17 @@ class ObsRecord:
             self.rdmode)
         return record_string
     
+    def get_fields(self):
+        """
+        Return the values of the record as strings, in column order.
+        
+        :rtype: list of str
+        """
+        return [str(self.targetname), str(self.rootname), str(self.band),
+                str(self.grism), str(self.datatype), str(self.applyto),
+                str(self.filerange), '%.1f' % self.exptime,
+                '%d' % self.lnrs, str(self.rdmode)]
+    
     def read_record(self, line):
         """
         Parse an ascii representation of a record.  The string is a line
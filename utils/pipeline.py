@@ -0,0 +1,421 @@
+# pipeline.py
+"""
+In-memory reduction pipeline.
+
+The IRAF reduction writes every intermediate step to disk with a prefix
+(f, df, cdf, rdf, tfarc, ...) and reads it back for the next step.
+Pipeline keeps the frames, with their VAR and DQ planes, as arrays
+between the stages.  Only the steps listed as checkpoints are written,
+under the usual prefixed names, and every stage is recorded in memory
+as a provenance entry.
+
+The prefix chain is kept: subtracting the dark from the frame with
+prefix 'f' gives 'df', so checkpoints are requested by the same names
+as the files of the IRAF reduction.
+
+Usage:
+    pipe = Pipeline(checkpoint=['rdf', 'obj_comb'])
+    names = pipe.load(combine.get_filenames('S20131002', '055-058'),
+                      prefix='f')
+    pipe.subtract_dark(names, pipe.load_product('objdark.fits', 'objdark'))
+    pipe.divide_flat(names, pipe.load_product('flat.fits', 'flat'))
+    pipe.combine(names, 'obj_comb')
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class ProvenanceEntry(object):
+    """
+    One stage applied by a Pipeline.
+    
+    Attributes
+    ----------
+    stage : str
+        Name of the stage.
+    inputs : list of str
+        Prefixed names of the inputs.
+    outputs : list of str
+        Prefixed names of the outputs.
+    parameters : dict
+        Parameters of the stage.
+    products : list of str
+        Names of the products used by the stage, eg. the dark.
+    elapsed : float
+        Run time, in seconds.
+    written : list of str
+        Files written as checkpoints.
+    """
+    def __init__(self, stage, inputs, outputs, parameters, elapsed,
+                 products=None):
+        self.stage = stage
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.parameters = dict(parameters)
+        self.products = [name for name in products or [] if name is not None]
+        self.elapsed = elapsed
+        self.written = []
+    
+    def __str__(self):
+        parameters = ', '.join('%s=%s' % item for item in
+                               sorted(self.parameters.items()))
+        return '%s(%s) %s -> %s' % (self.stage, parameters,
+                                    ','.join(self.inputs),
+                                    ','.join(self.outputs))
+
+
+class Pipeline(object):
+    """
+    Frames kept in memory between the reduction stages.
+    
+    Frames are stored by rootname, eg. 'S20131002S0055', together with
+    their current prefix.  Products, eg. a dark or a combined frame, are
+    stored by name.
+    
+    Parameters
+    ----------
+    checkpoint : iterable of str, optional
+        Prefixes (eg. 'rdf') and product names (eg. 'obj_comb') to
+        write to disk when they are produced.  Default is nothing.
+    outdir : str, optional
+        Directory of the checkpoints.  Default = './'.
+    """
+    def __init__(self, checkpoint=None, outdir='./'):
+        self.checkpoint = set(checkpoint or [])
+        self.outdir = outdir
+        self.frames = OrderedDict()
+        self.prefixes = {}
+        self.products = OrderedDict()
+        self.provenance = []
+    
+    def name(self, rootname):
+        """
+        Prefixed name of a frame, eg. 'rdfS20131002S0055'.
+        """
+        if rootname in self.frames:
+            return self.prefixes[rootname] + rootname
+        return rootname
+    
+    def add(self, rootname, frame, prefix=''):
+        """
+        Add a frame to the pipeline.
+        
+        Parameters
+        ----------
+        rootname : str
+            Name of the frame, without prefix or extension.
+        frame : frames.Frame
+        prefix : str, optional
+            Current prefix of the frame.  Default = ''.
+        """
+        self.frames[rootname] = frame
+        self.prefixes[rootname] = prefix
+    
+    def load(self, filenames, prefix='', memmap=False):
+        """
+        Read frames from disk.  This is the only time they are read.
+        
+        Parameters
+        ----------
+        filenames : list of str
+            FITS files.  The prefix, if any, is removed from the base
+            name to get the rootname.
+        prefix : str, optional
+            Prefix of the files.  Default = ''.
+        memmap : bool, optional
+            Memory-map the pixels.  Default = False.
+        
+        Returns
+        -------
+        list of str
+            Rootnames of the frames.
+        """
+        from frames import Frame
+        
+        rootnames = []
+        for filename in filenames:
+            basename = os.path.basename(filename)
+            if basename.endswith('.fits'):
+                basename = basename[:-len('.fits')]
+            if prefix and basename.startswith(prefix):
+                basename = basename[len(prefix):]
+            self.add(basename, Frame.from_file(filename, memmap=memmap),
+                     prefix)
+            rootnames.append(basename)
+        self._record('load', filenames, [self.name(rootname) for rootname
+                                         in rootnames], {}, 0.)
+        return rootnames
+    
+    def load_product(self, filename, name):
+        """
+        Read a product, eg. a dark or a flat, from disk.
+        
+        Returns
+        -------
+        frames.Frame
+        """
+        from frames import Frame
+        
+        self.products[name] = Frame.from_file(filename, memmap=False)
+        self._record('load', [filename], [name], {}, 0.)
+        return self.products[name]
+    
+    def run(self, stage, rootnames, function, prefix, products=None,
+            **parameters):
+        """
+        Apply a function to frames, in memory.
+        
+        Parameters
+        ----------
+        stage : str
+            Name of the stage, for the provenance.
+        rootnames : list of str
+            Frames to process.
+        function : callable
+            Called as function(frame, **parameters), returns the new
+            frames.Frame.
+        prefix : str
+            Added in front of the prefix of each frame, eg. 'd'.
+        products : list of str, optional
+            Names of the products used, eg. the dark, followed by
+            history().
+        **parameters
+            Passed to function and recorded.
+        
+        Returns
+        -------
+        list of str
+            The rootnames, for chaining.
+        """
+        start = time.time()
+        inputs = [self.name(rootname) for rootname in rootnames]
+        for rootname in rootnames:
+            frame = self.frames[rootname]
+            result = function(frame, **parameters)
+            if result is not frame:
+                frame.close()
+            self.frames[rootname] = result
+            self.prefixes[rootname] = prefix + self.prefixes[rootname]
+        outputs = [self.name(rootname) for rootname in rootnames]
+        entry = self._record(stage, inputs, outputs, parameters,
+                             time.time() - start, products)
+        for rootname in rootnames:
+            if self.prefixes[rootname] in self.checkpoint:
+                entry.written.append(self.write(rootname))
+        return rootnames
+    
+    def subtract_dark(self, rootnames, dark, prefix='d'):
+        """
+        Subtract a dark from frames.
+        
+        Parameters
+        ----------
+        rootnames : list of str
+        dark : frames.Frame or str
+            The dark, or the name of a product.
+        prefix : str, optional
+            Default = 'd'.
+        
+        Returns
+        -------
+        list of str
+        """
+        from frames import subtract_frames
+        
+        (frame_dark, name) = self._product(dark)
+        return self.run('subtract_dark', rootnames,
+                        lambda frame, dark: subtract_frames(frame,
+                                                            frame_dark),
+                        prefix, products=[name], dark=name)
+    
+    def divide_flat(self, rootnames, flat, prefix='r'):
+        """
+        Divide frames by a normalized flat.
+        
+        Parameters
+        ----------
+        rootnames : list of str
+        flat : frames.Frame or str
+            The flat, or the name of a product.
+        prefix : str, optional
+            Default = 'r', as nsreduce.
+        
+        Returns
+        -------
+        list of str
+        """
+        from frames import divide_frames
+        
+        (frame_flat, name) = self._product(flat)
+        return self.run('divide_flat', rootnames,
+                        lambda frame, flat: divide_frames(frame, frame_flat),
+                        prefix, products=[name], flat=name)
+    
+    def reject_cosmics(self, rootnames, rdmode='faint', prefix='',
+                       **kwargs):
+        """
+        Flag the cosmic rays of frames, see crreject.clean_frame().
+        
+        Parameters
+        ----------
+        rootnames : list of str
+        rdmode : str, optional
+            Read mode.  Default = 'faint'.
+        prefix : str, optional
+            Default is no prefix: the DQ planes are updated in place.
+        **kwargs
+            Passed to crreject.clean_frame().
+        
+        Returns
+        -------
+        list of str
+        """
+        from crreject import clean_frame
+        
+        return self.run('reject_cosmics', rootnames,
+                        lambda frame, rdmode, **kwargs:
+                        clean_frame(frame, rdmode, **kwargs)[0],
+                        prefix, rdmode=rdmode, **kwargs)
+    
+    def rectify(self, rootnames, rectmap, prefix='t'):
+        """
+        Rectify frames with a rectify.RectificationMap.
+        
+        Returns
+        -------
+        list of str
+        """
+        return self.run('rectify', rootnames,
+                        lambda frame, key: rectmap.apply_frame(frame),
+                        prefix, key=rectmap.key)
+    
+    def combine(self, rootnames, name, mode='average', nsigma=3.,
+                maxiter=5):
+        """
+        Combine frames into a product.
+        
+        Parameters
+        ----------
+        rootnames : list of str
+            Frames to combine.
+        name : str
+            Name of the product, eg. 'obj_comb'.
+        mode : str, optional
+            See combine.combine_block().  Default = 'average'.
+        nsigma : float, optional
+            Default = 3.
+        maxiter : int, optional
+            Default = 5.
+        
+        Returns
+        -------
+        frames.Frame
+        """
+        from combine import combine_block
+        from frames import Frame
+        
+        start = time.time()
+        stack = [self.frames[rootname] for rootname in rootnames]
+        sci = np.array([frame.sci for frame in stack], dtype=np.float32)
+        var = None
+        if all(frame.var is not None for frame in stack):
+            var = np.array([frame.var for frame in stack], dtype=np.float32)
+        dq = None
+        has_dq = all(frame.dq is not None for frame in stack)
+        if has_dq:
+            dq = np.array([frame.dq for frame in stack], dtype=np.int16)
+        (sci, var, dq) = combine_block(sci, var, dq, mode, nsigma, maxiter)
+        
+        phu = stack[0].phu.copy()
+        phu['NCOMBINE'] = (len(stack), 'Number of frames combined')
+        phu['COMBMODE'] = (mode, 'Combine mode')
+        combined = Frame(sci, var, dq if has_dq else None, phu=phu,
+                         header=stack[0].header.copy())
+        self.products[name] = combined
+        entry = self._record('combine', [self.name(rootname) for rootname
+                                         in rootnames], [name],
+                             {'mode': mode, 'nsigma': nsigma,
+                              'maxiter': maxiter}, time.time() - start)
+        if name in self.checkpoint:
+            entry.written.append(self.write(name))
+        return combined
+    
+    def write(self, name):
+        """
+        Write a frame or a product, with the stages that made it as
+        HISTORY cards.
+        
+        Parameters
+        ----------
+        name : str
+            Rootname of a frame, or name of a product.
+        
+        Returns
+        -------
+        str
+            Name of the file written.
+        """
+        from frames import Frame
+        
+        if name in self.frames:
+            frame = self.frames[name]
+            target = self.name(name)
+        else:
+            frame = self.products[name]
+            target = name
+        filename = os.path.join(self.outdir, target + '.fits')
+        # the cards go to a copy, so that writing again does not repeat
+        # them.
+        phu = frame.phu.copy()
+        existing = set(str(card) for card in phu.get('HISTORY', []))
+        for entry in self.history(target):
+            card = str(entry)[:70]
+            if card not in existing:
+                phu.add_history(card)
+                existing.add(card)
+        Frame(frame.sci, frame.var, frame.dq, phu=phu, header=frame.header,
+              filename=frame.filename).write(filename)
+        return filename
+    
+    def history(self, name):
+        """
+        Provenance entries that led to a prefixed frame or a product.
+        
+        Parameters
+        ----------
+        name : str
+            Prefixed name, eg. 'rdfS20131002S0055', or product name.
+        
+        Returns
+        -------
+        list of ProvenanceEntry
+            In the order they were applied.
+        """
+        wanted = set([name])
+        entries = []
+        for entry in reversed(self.provenance):
+            if wanted.intersection(entry.outputs):
+                entries.append(entry)
+                wanted.update(entry.inputs)
+                wanted.update(entry.products)
+        entries.reverse()
+        return entries
+    
+    def _product(self, product):
+        # Accept a product name or a Frame, return (frame, name).
+        if isinstance(product, basestring):
+            return (self.products[product], product)
+        for (name, frame) in self.products.items():
+            if frame is product:
+                return (product, name)
+        return (product, product.filename)
+    
+    def _record(self, stage, inputs, outputs, parameters, elapsed,
+                products=None):
+        entry = ProvenanceEntry(stage, inputs, outputs, parameters, elapsed,
+                                products)
+        self.provenance.append(entry)
+        return entry
@@ -3,6 +3,133 @@
 Collection of classes to help create plots.
 """
 import matplotlib.pyplot as plt
+import numpy as np
+
+def minmax_decimate(xdata, ydata, xlow, xhigh, nbins):
+    """
+    Reduce a sorted series to its min/max envelope over nbins columns.
+    
+    The range [xlow, xhigh] is divided in nbins columns, normally one per
+    screen pixel.  For each column, only the points with the minimum and
+    the maximum values are kept, in their original order.  Narrow
+    features like emission peaks or telluric residuals are preserved.
+    One point on each side of the range is kept so that the line runs
+    to the edges of the axes.  The first NaN of each column is also kept,
+    so that the gaps in the data stay gaps in the line.
+    
+    :param xdata: X values, sorted in increasing order.
+    :type xdata: ndarray
+    :param ydata: Y values.
+    :type ydata: ndarray
+    :param xlow: Lower limit of the range to keep.
+    :type xlow: float
+    :param xhigh: Upper limit of the range to keep.
+    :type xhigh: float
+    :param nbins: Number of columns.
+    :type nbins: int
+    :rtype: tuple of ndarray
+    """
+    first = max(np.searchsorted(xdata, xlow, side='left') - 1, 0)
+    last = min(np.searchsorted(xdata, xhigh, side='right') + 1, xdata.size)
+    xdata = xdata[first:last]
+    ydata = ydata[first:last]
+    if xdata.size <= 2 * nbins or xhigh <= xlow:
+        return (xdata, ydata)
+    
+    columns = ((xdata - xlow) * (nbins / float(xhigh - xlow))).astype(int)
+    # xdata is sorted, so each column is a contiguous segment.
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+    lengths = np.diff(np.append(starts, xdata.size))
+    # fmin and fmax ignore the NaN, unless the whole segment is NaN.
+    segment_min = np.repeat(np.fmin.reduceat(ydata, starts), lengths)
+    segment_max = np.repeat(np.fmax.reduceat(ydata, starts), lengths)
+    # Position of the first minimum, maximum and NaN in each segment, or
+    # xdata.size if there is none.
+    index = np.arange(xdata.size)
+    imin = np.minimum.reduceat(np.where(ydata == segment_min, index, 
+                                        xdata.size), starts)
+    imax = np.minimum.reduceat(np.where(ydata == segment_max, index,
+                                        xdata.size), starts)
+    inan = np.minimum.reduceat(np.where(np.isnan(ydata), index, 
+                                        xdata.size), starts)
+    keep = np.unique(np.concatenate(([0], imin, imax, inan, 
+                                     [xdata.size - 1])))
+    keep = keep[keep < xdata.size]
+    return (xdata[keep], ydata[keep])
+
+
+class FigurePool:
+    """
+    Pool of figures that can be reused from one plot to the next.
+    
+    Creating a figure is expensive and figures that are never closed
+    accumulate in long sessions.  A plot created with a pool takes an
+    idle figure from the pool, if any, and gives it back when released.
+    
+    :param maxsize: Maximum number of idle figures to keep.  Figures
+        released when the pool is full are closed.  [Default: 4]
+    :type maxsize: int
+    """
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.idle = []
+    
+    def acquire(self):
+        """
+        Return an idle figure, or a new one if the pool is empty.
+        
+        :rtype: Figure
+        """
+        if self.idle:
+            return self.idle.pop()
+        return plt.figure()
+    
+    def release(self, fig):
+        """
+        Give a figure back to the pool.
+        
+        :param fig: Figure obtained from acquire().
+        :type fig: Figure
+        """
+        if len(self.idle) < self.maxsize:
+            self.idle.append(fig)
+        else:
+            plt.close(fig)
+    
+    def close_all(self):
+        """
+        Close all the idle figures.
+        """
+        for fig in self.idle:
+            plt.close(fig)
+        self.idle = []
+
+
+class OffscreenFigurePool(FigurePool):
+    """
+    Pool of figures drawn on an Agg canvas, whatever the pyplot backend.
+    
+    The figures are not managed by pyplot: they never open a window and
+    need no display, eg. for a library that only writes PNG files.
+    
+    :param maxsize: Maximum number of idle figures to keep.  [Default: 4]
+    :type maxsize: int
+    """
+    def acquire(self):
+        """
+        Return an idle figure, or a new one if the pool is empty.
+        
+        :rtype: Figure
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        if self.idle:
+            return self.idle.pop()
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        return fig
+
 
 class Plot:
     """
@@ -10,15 +137,77 @@ class Plot:
     
     :param title: Plot title. Optional.
     :type title: str
+    :param pool: Pool from which to take the figure.  If None, a new
+        figure is created.  Optional.
+    :type pool: FigurePool
     """
-    def __init__(self, title=None):
-        self.fig = plt.figure()
-        self.axplot = self.fig.add_subplot(1, 1, 1)
+    def __init__(self, title=None, pool=None):
+        self.pool = pool
+        self.idle_lines = []
+        self.decimated_lines = []
+        self.lod_callback = None
+        if pool is None:
+            self.fig = plt.figure()
+        else:
+            self.fig = pool.acquire()
+        if self.fig.axes:
+            self.axplot = self.fig.axes[0]
+            self._recycle_axes()
+        else:
+            self.axplot = self.fig.add_subplot(1, 1, 1)
         for item in [self.fig, self.axplot]:
             item.patch.set_visible(False)
         if title is not None:
             self.set_title(title)
     
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+    
+    def _recycle_axes(self):
+        """
+        Prepare the axes of a reused figure.  The lines are kept, hidden,
+        so that their data can be replaced in place.  The rest of the
+        decorations are removed.
+        """
+        self.idle_lines = list(self.axplot.lines)
+        for line in self.idle_lines:
+            line.set_visible(False)
+        for text in list(self.axplot.texts):
+            text.remove()
+        self.axplot.set_title('')
+        self.axplot.set_xlabel('')
+        self.axplot.set_ylabel('')
+        self.axplot.set_autoscale_on(True)
+    
+    def _discard_idle_lines(self):
+        """
+        Remove the reusable lines that were not used by this plot.
+        """
+        for line in self.idle_lines:
+            line.remove()
+        self.idle_lines = []
+    
+    def release(self):
+        """
+        Release the figure.  It goes back to the pool if there is one,
+        otherwise it is closed.  The plot cannot be used afterwards.
+        """
+        if self.fig is None:
+            return
+        if self.lod_callback is not None:
+            self.axplot.callbacks.disconnect(self.lod_callback)
+            self.lod_callback = None
+        self.decimated_lines = []
+        if self.pool is None:
+            plt.close(self.fig)
+        else:
+            self.pool.release(self.fig)
+        self.fig = None
+        self.axplot = None
+    
     def set_title(self, title):
         """
         Add a title to the plot.
@@ -50,13 +239,40 @@ class SpPlot(Plot):
     """
     Class to create and customize a spectrum plot. Subclasses Plot.
     
+    When a pool is used, the lines of the reused figure are updated in
+    place and, by default, nothing is drawn until render() or write_png()
+    is called.
+    
     :param title: Title to assign to the plot.
     :type title: str
+    :param pool: Pool from which to take the figure.  Optional.
+    :type pool: FigurePool
+    :param autodraw: Redraw the canvas after each operation.  
+        [Default: True without a pool, False with a pool]
+    :type autodraw: bool
     """
-    def __init__(self, title=None):
-        Plot.__init__(self, title)
+    def __init__(self, title=None, pool=None, autodraw=None):
+        Plot.__init__(self, title, pool)
+        if autodraw is None:
+            autodraw = pool is None
+        self.autodraw = autodraw
+    
+    def _draw(self):
+        """
+        Redraw the canvas, if autodraw is on.
+        """
+        if self.autodraw:
+            self.fig.canvas.draw()
     
-    def plot_spectrum(self, sp1d, title=None, color='k'):
+    def render(self):
+        """
+        Draw the canvas.  Use when autodraw is off.
+        """
+        self._discard_idle_lines()
+        self.fig.canvas.draw()
+        return
+    
+    def plot_spectrum(self, sp1d, title=None, color='k', decimate=False):
         """
         Plot the spectrum (counts vs wavelength) with title and axis labels.
         
@@ -64,16 +280,55 @@ class SpPlot(Plot):
         :type sp1d: Spectrum object.
         :param title: Title for the plot. Optional.
         :type title: str
+        :param decimate: If True, draw only the min/max envelope of the
+            spectrum, one column per screen pixel.  The envelope is
+            recomputed from the full resolution arrays, for the visible
+            range only, every time the x-axis limits change.
+            [Default: False]
+        :type decimate: bool
         """
         if title is not None:
             self.set_title(title)
         self.set_axis_label(''.join(['Wavelength [', sp1d.wunit.name,']']), 'x')
         self.set_axis_label('Counts', 'y')
-        self.axplot.plot(sp1d.wlen, sp1d.counts, color)
+        (xdata, ydata) = (sp1d.wlen, sp1d.counts)
+        if decimate:
+            (xdata, ydata) = minmax_decimate(xdata, ydata, xdata[0],
+                                             xdata[-1], self._ncolumns())
+        if self.idle_lines:
+            # reuse a line from the pooled figure
+            line = self.idle_lines.pop(0)
+            line.set_data(xdata, ydata)
+            line.set_color(color)
+            line.set_visible(True)
+            self.axplot.relim(visible_only=True)
+        else:
+            line = self.axplot.plot(xdata, ydata, color)[0]
         self.axplot.axis('tight')
-        self.fig.canvas.draw()
+        if decimate:
+            self.decimated_lines.append((line, sp1d.wlen, sp1d.counts))
+            if self.lod_callback is None:
+                self.lod_callback = self.axplot.callbacks.connect(
+                                    'xlim_changed', self._update_decimated)
+        self._draw()
         return
 
+    def _ncolumns(self):
+        """
+        Width of the axes in screen pixels.
+        """
+        return max(int(self.axplot.bbox.width), 1)
+
+    def _update_decimated(self, axes):
+        """
+        Recompute the envelope of the decimated lines for the new x-axis
+        limits.  Called by matplotlib when the limits change.
+        """
+        (xlow, xhigh) = sorted(axes.get_xlim())
+        nbins = self._ncolumns()
+        for (line, wlen, counts) in self.decimated_lines:
+            line.set_data(*minmax_decimate(wlen, counts, xlow, xhigh, nbins))
+
     def adjust_ylimits(self, ylim1, ylim2):
         """
         Adjust the lower and upper bounds to the y-axis.
@@ -84,7 +339,7 @@ class SpPlot(Plot):
         :type ylim2: float
         """
         self.axplot.set_ylim(ylim1, ylim2)
-        self.fig.canvas.draw()
+        self._draw()
         return
 
     def erase_plot(self, line_position=0):
@@ -95,8 +350,13 @@ class SpPlot(Plot):
             erase.
         :type line_position: int
         """
-        self.axplot.lines.pop(line_position).remove
-        self.fig.canvas.draw()
+        visible_lines = [line for line in self.axplot.lines 
+                         if line not in self.idle_lines]
+        line = visible_lines[line_position]
+        line.remove()
+        self.decimated_lines = [item for item in self.decimated_lines
+                                if item[0] is not line]
+        self._draw()
         return
 
     def annotate_lines(self, lines):
@@ -125,7 +385,7 @@ class SpPlot(Plot):
                              verticalalignment='center',
                              fontsize=10)
                 i += 1
-        self.fig.canvas.draw()
+        self._draw()
 
         return
 
@@ -140,7 +400,8 @@ class SpPlot(Plot):
             ??Is the extension .png required or is it added automatically??
         :type output_name: str
         """        
+        self._discard_idle_lines()
         self.fig.savefig(output_name)
         return
     
-    
\ No newline at end of file
+    
@@ -0,0 +1,237 @@
+# prepare.py
+"""
+Prepare raw F2 frames: nonlinearity correction, saturation flagging and
+variance, as f2prepare with fl_vardq, fl_correct, fl_saturated and
+fl_nonlinear.
+
+The raw frames are memory-mapped and every correction is an array
+operation over the whole frame.  The frames of a list are prepared on a
+thread pool, so that a night of data is limited by the disk and not by
+task launches.  The output is the Gemini layout, PHU + SCI, VAR and DQ,
+with the 'f' prefix.
+
+The nonlinearity correction and the saturation flags are only applied
+when the caller gives the coefficients and the limits of the detector,
+see correct_nonlinearity(); the f2prepare values are not in this package.
+
+The variance is the Poisson noise of the corrected counts plus the read
+noise of the read mode.  The read mode is given by the number of reads,
+LNRS.  The header LNRS is off by two for the multiple-read modes, as
+noted in obstable.ObsRecord: a header LNRS of 2 or 6 means 4 or 8 reads.
+The table stores the header value, which is what is expected here.
+
+Usage:
+    nonlinearity = {'linlimit': linlimit, 'saturation': saturation,
+                    'coeffs': (c1, c2)}
+    outputs = prepare_files(combine.get_filenames('S20131002', '217-240',
+                                                  rawdir='raw'),
+                            nonlinearity=nonlinearity)
+    frames = prepare_record(record, rawdir='raw', write=False)
+"""
+
+import numpy as np
+
+def true_lnrs(lnrs):
+    """
+    Number of reads from the header LNRS: the header value is two short
+    for the multiple-read modes.
+    
+    Parameters
+    ----------
+    lnrs : int
+        LNRS from the header, or the LNRS column of the ObsTable.
+    
+    Returns
+    -------
+    int
+    """
+    lnrs = int(lnrs)
+    return lnrs + 2 if lnrs > 1 else lnrs
+
+def get_read_mode(lnrs):
+    """
+    Read mode, 'bright', 'medium' or 'faint', of a header LNRS.
+    
+    Raises
+    ------
+    ValueError
+        If the LNRS is not one of the F2 read modes.
+    """
+    from bookkeeping import F2_READ_MODES
+    
+    lnrs = int(lnrs)
+    if lnrs not in F2_READ_MODES:
+        raise ValueError('Unknown LNRS: %d' % lnrs)
+    return F2_READ_MODES[lnrs].lower()
+
+def read_noise(lnrs):
+    """
+    Read noise, in electrons, for a header LNRS.
+    """
+    from frames import F2_READ_NOISE
+    
+    return F2_READ_NOISE[get_read_mode(lnrs)]
+
+def correct_nonlinearity(counts, linlimit, saturation, coeffs):
+    """
+    Correct the nonlinearity and flag the nonlinear and saturated pixels.
+    
+    The corrected counts are counts * (1 + c1 * counts + c2 * counts**2 +
+    ...).  Pixels above linlimit are flagged DQ_NONLINEAR, pixels above
+    saturation DQ_SATURATED and are not corrected.
+    
+    Parameters
+    ----------
+    counts : ndarray
+        Raw counts, in ADU.
+    linlimit, saturation : float
+        Limits in raw ADU.
+    coeffs : tuple of float
+        (c1, c2, ...), coefficients of the correction.
+    
+    Returns
+    -------
+    tuple
+        (corrected, dq), float32 and int16 arrays.
+    """
+    from frames import DQ_NONLINEAR, DQ_SATURATED
+    
+    counts = np.asarray(counts, dtype=np.float32)
+    clipped = np.minimum(counts, saturation)
+    factor = np.float32(1.)
+    for (power, coeff) in enumerate(coeffs, 1):
+        factor = factor + np.float32(coeff) * clipped**power
+    corrected = np.where(counts > saturation, counts, clipped * factor)
+    dq = np.zeros(counts.shape, dtype=np.int16)
+    dq[counts > linlimit] |= DQ_NONLINEAR
+    dq[counts >= saturation] |= DQ_SATURATED
+    return (corrected.astype(np.float32), dq)
+
+def prepare_frame(filename, lnrs=None, bpm=None, gain=None,
+                  nonlinearity=None):
+    """
+    Prepare one raw frame.
+    
+    Parameters
+    ----------
+    filename : str
+        Raw F2 frame.
+    lnrs : int, optional
+        Header LNRS, eg. from ObsRecord.lnrs.  Default is LNRS from the
+        header.
+    bpm : ndarray, optional
+        Bad pixel mask, flagged DQ_BAD.
+    gain : float, optional
+        Gain, in electrons per ADU.  Default = frames.F2_GAIN.
+    nonlinearity : dict, optional
+        linlimit, saturation and coeffs of the read mode of the frame,
+        see correct_nonlinearity().  Default is no correction and no
+        nonlinear or saturated flags.
+    
+    Returns
+    -------
+    frames.Frame
+    """
+    from frames import Frame, F2_GAIN, DQ_BAD
+    
+    if gain is None:
+        gain = F2_GAIN
+    raw = Frame.from_file(filename, memmap=True)
+    try:
+        phu = raw.phu.copy()
+        if lnrs is None:
+            lnrs = phu['LNRS']
+        if nonlinearity is not None:
+            (sci, dq) = correct_nonlinearity(raw.sci, **nonlinearity)
+        else:
+            sci = np.array(raw.sci, dtype=np.float32)
+            dq = np.zeros(sci.shape, dtype=np.int16)
+    finally:
+        raw.close()
+    
+    rdnoise = read_noise(lnrs)
+    var = np.clip(sci, 0., None) / np.float32(gain) + \
+          np.float32((rdnoise / gain)**2)
+    if bpm is not None:
+        dq[np.asarray(bpm, dtype=bool)] |= DQ_BAD
+    
+    phu['GAIN'] = (gain, 'Gain (e-/ADU)')
+    phu['RDNOISE'] = (rdnoise, 'Read noise (e-)')
+    phu['NREADS'] = (true_lnrs(lnrs), 'Number of reads, LNRS corrected')
+    if nonlinearity is not None:
+        phu['SATLEVEL'] = (nonlinearity['saturation'],
+                           'Saturation level (ADU)')
+        phu['NONLINCR'] = (' '.join('%g' % coeff for coeff
+                                    in nonlinearity['coeffs']),
+                           'Nonlinearity correction coefficients')
+    phu['PREPARE'] = (_timestamp(), 'Time stamp of prepare')
+    return Frame(sci, var.astype(np.float32), dq, phu=phu,
+                 filename=filename)
+
+def prepare_files(filenames, prefix='f', outdir=None, write=True,
+                  nthreads=None, **kwargs):
+    """
+    Prepare a list of raw frames concurrently.
+    
+    Parameters
+    ----------
+    filenames : list of str
+        Raw frames.
+    prefix : str, optional
+        Prefix of the outputs.  Default = 'f'.
+    outdir : str, optional
+        Directory of the outputs.  Default is the directory of each
+        input.
+    write : bool, optional
+        Write the prepared frames.  Default = True.
+    nthreads : int, optional
+        Number of threads.  Default = number of cores.
+    **kwargs
+        Passed to prepare_frame().
+    
+    Returns
+    -------
+    list
+        Names of the files written, or the frames.Frame if write is
+        False.
+    """
+    import multiprocessing
+    import os.path
+    from multiprocessing.pool import ThreadPool
+    
+    def prepare(filename):
+        frame = prepare_frame(filename, **kwargs)
+        if not write:
+            return frame
+        (directory, basename) = os.path.split(filename)
+        output = os.path.join(outdir if outdir is not None else directory,
+                              prefix + basename)
+        frame.write(output)
+        return output
+    
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads <= 1 or len(filenames) <= 1:
+        return [prepare(filename) for filename in filenames]
+    pool = ThreadPool(min(nthreads, len(filenames)))
+    try:
+        return pool.map(prepare, filenames)
+    finally:
+        pool.close()
+        pool.join()
+
+def prepare_record(record, rawdir='', **kwargs):
+    """
+    Prepare the frames of an ObsTable record, with the LNRS of the
+    record.  See prepare_files().
+    """
+    from combine import get_filenames
+    
+    filenames = get_filenames(record.rootname, record.filerange, rawdir)
+    kwargs.setdefault('lnrs', record.lnrs)
+    return prepare_files(filenames, **kwargs)
+
+def _timestamp():
+    import time
+    
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
@@ -0,0 +1,499 @@
+# quicklook.py
+"""
+Streaming quicklook: reduce the F2 frames as they land in the raw
+directory, while observing.
+
+The raw directory is polled for new frames, which are classified from
+their primary headers with bookkeeping.get_frame_info().  The science
+and telluric frames are prepared and each one is paired with the
+previous unpaired frame of the same target at the other nod position.
+Each A-B pair is flat fielded, rectified if a rectification map is
+given, and added to a running stack of the target: a Welford running
+mean and variance of every pixel.  The spectrum is extracted from the
+mean of the stack and plotted to PNG with specplot after every pair, with
+its signal-to-noise ratio and the emission lines detected.  A pair costs
+the same whatever the number of pairs already stacked.
+
+The calibrations are not built here.  The dark cancels in the pairs;
+the flat and the rectification map, eg. from a CalibrationStore or from
+an earlier night, are passed in.
+
+Usage:
+    quick = QuickLook('raw', outdir='quicklook', flat='flat.fits',
+                      wavelength=(9800., 6.7), line_list_name='quasar')
+    quick.run(interval=10.)
+"""
+
+import glob
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Raw frames are written in blocks of 2880 bytes; a file of another size
+# is still being written.
+FITS_BLOCK = 2880
+
+class RunningStack(object):
+    """
+    Running mean and variance of a sequence of frames, pixel by pixel,
+    with the Welford algorithm.
+    
+    Every pixel has its own count, so that pixels flagged in some frames
+    are averaged over the other frames.  The variances of the frames are
+    also summed, to give the variance of the mean when there are too few
+    frames for the scatter.
+    
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the frames.
+    """
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape, dtype=np.int32)
+        self.mean = np.zeros(self.shape, dtype=np.float64)
+        self.m2 = np.zeros(self.shape, dtype=np.float64)
+        self.varsum = np.zeros(self.shape, dtype=np.float64)
+        self.nframes = 0
+    
+    @property
+    def good(self):
+        """
+        Pixels with at least one value.
+        """
+        return self.count > 0
+    
+    def update(self, data, var=None, good=None):
+        """
+        Add a frame.
+        
+        Parameters
+        ----------
+        data : ndarray
+            Frame, of the shape of the stack.
+        var : ndarray, optional
+            Variance of the frame.
+        good : ndarray, optional
+            Boolean, False for the pixels to leave out.  Default is the
+            finite pixels.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape != self.shape:
+            raise ValueError('Frame of shape %s, expected %s' %
+                             (data.shape, self.shape))
+        use = np.isfinite(data)
+        if good is not None:
+            use &= np.asarray(good, dtype=bool)
+        if var is not None:
+            var = np.asarray(var, dtype=np.float64)
+            use &= np.isfinite(var)
+        
+        self.count += use
+        delta = np.where(use, data - self.mean, 0.)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += delta * np.where(use, data - self.mean, 0.)
+        if var is not None:
+            self.varsum += np.where(use, var, 0.)
+        self.nframes += 1
+    
+    def variance(self):
+        """
+        Sample variance of the frames, NaN where there are fewer than two.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1),
+                            np.nan)
+    
+    def variance_of_mean(self, min_count=3):
+        """
+        Variance of the mean.
+        
+        Parameters
+        ----------
+        min_count : int, optional
+            Minimum number of frames for the variance to be estimated
+            from the scatter of the frames.  Pixels with fewer frames use
+            the variances of the frames instead.  Default = 3.
+        
+        Returns
+        -------
+        ndarray
+            Infinite where there is no frame.
+        """
+        count = np.maximum(self.count, 1).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scatter = self.m2 / (count - 1) / count
+        propagated = self.varsum / count**2
+        var = np.where(self.count >= max(min_count, 2), scatter, propagated)
+        var[self.count == 0] = np.inf
+        return var
+
+
+class QuickLookTarget(object):
+    """
+    Running reduction of one target in one band.
+    
+    Attributes
+    ----------
+    name : str
+        Eg. 'SDSSJ0117_JH'.
+    datatype : str
+        'Science' or 'Telluric'.
+    pending : list of tuple
+        (position, frames.Frame) of the frames waiting for a frame at
+        the other nod position.
+    reference : Header
+        Primary header of the first frame, which defines position A.
+    stack : RunningStack
+        Stack of the A-B pairs, None until the first pair.
+    npairs : int
+    spectrum, variance : spectro.Spectrum
+        Last extraction.
+    snr : float
+        Median signal-to-noise ratio per pixel of the last extraction.
+    lines : ndarray
+        Wavelengths of the emission lines detected.
+    plotfile : str
+        Last PNG written.
+    """
+    def __init__(self, name, datatype):
+        self.name = name
+        self.datatype = datatype
+        self.pending = []
+        self.reference = None
+        self.stack = None
+        self.npairs = 0
+        self.spectrum = None
+        self.variance = None
+        self.snr = None
+        self.lines = np.array([])
+        self.plotfile = None
+
+
+class QuickLook(object):
+    """
+    Watch a raw directory and reduce the new frames as they arrive.
+    
+    Parameters
+    ----------
+    rawdir : str
+        Directory where the raw frames are written.
+    outdir : str, optional
+        Directory of the plots.  Default = 'quicklook'.
+    pattern : str, optional
+        Glob pattern of the raw frames.  Default = 'S*S*.fits'.
+    flat : frames.Frame or str, optional
+        Normalized flat.
+    rectmap : rectify.RectificationMap or str, optional
+        Rectification map of the band.  It gives the wavelengths.
+    wavelength : tuple of float, optional
+        (crval, cdelt) of the spectra, in Angstrom, when there is no
+        rectification map.  Default is pixels.
+    dispaxis : int, optional
+        Dispersion axis, as DISPAXIS.  Default = 2.
+    datatypes : tuple of str, optional
+        Data types reduced.  Default = ('Science', 'Telluric').
+    keyword : str, optional
+        Offset keyword of the nod positions.  Default = 'QOFFSET'.
+    tolerance : float, optional
+        Offsets closer than this, in arcsec, are the same nod position.
+        Default = 0.5.
+    cosmics : bool, optional
+        Flag the cosmic rays of each frame, with the parameters of its
+        read mode, see crreject.clean_frame().  Default = False.
+    width : float, optional
+        Half-width of the extraction aperture.  Default is found from the
+        profile, see extract.extract().
+    line_list_name : str, optional
+        Line list annotated on the plots, see spectro.LINELIST_DICT.
+    redshift : float, optional
+        Redshift of the line list.
+    line_nsigma : float, optional
+        Detection threshold of the emission lines.  Default = 5.
+    cache : headercache.HeaderCache, optional
+        Header cache used to classify the frames.
+    """
+    def __init__(self, rawdir, outdir='quicklook', pattern='S*S*.fits',
+                 flat=None, rectmap=None, wavelength=None, dispaxis=2,
+                 datatypes=('Science', 'Telluric'), keyword=None,
+                 tolerance=0.5, cosmics=False, width=None,
+                 line_list_name=None, redshift=None, line_nsigma=5.,
+                 cache=None):
+        from frames import Frame
+        from rectify import RectificationMap
+        from skysub import DEFAULT_OFFSET_KEYWORD
+        
+        self.rawdir = rawdir
+        self.outdir = outdir
+        self.pattern = pattern
+        if isinstance(flat, basestring):
+            flat = Frame.from_file(flat)
+        self.flat = flat
+        if isinstance(rectmap, basestring):
+            rectmap = RectificationMap.load(rectmap)
+        self.rectmap = rectmap
+        self.wavelength = wavelength
+        self.dispaxis = dispaxis
+        self.datatypes = tuple(datatypes)
+        self.keyword = keyword if keyword is not None \
+                       else DEFAULT_OFFSET_KEYWORD
+        self.tolerance = tolerance
+        self.cosmics = cosmics
+        self.width = width
+        self.line_list_name = line_list_name
+        self.redshift = redshift
+        self.line_nsigma = line_nsigma
+        self.cache = cache
+        self.seen = set()
+        self.errors = []
+        self.targets = OrderedDict()
+        self._pool = None
+    
+    def poll(self):
+        """
+        Classify the frames that appeared since the last poll.
+        
+        Frames that are still being written are left for the next poll.
+        
+        Returns
+        -------
+        list of dict
+            Frame information, see bookkeeping.get_frame_info(), with a
+            datatype key, sorted by file name.
+        """
+        from bookkeeping import get_datatype, get_frame_info
+        from bookkeeping import parse_raw_filename
+        
+        frames = []
+        for filename in sorted(glob.glob(os.path.join(self.rawdir,
+                                                      self.pattern))):
+            if filename in self.seen:
+                continue
+            if parse_raw_filename(filename) is None:
+                self.seen.add(filename)
+                continue
+            if not is_complete(filename):
+                continue
+            try:
+                info = get_frame_info(filename, self.cache)
+            except (IOError, OSError, ValueError):
+                continue
+            info['datatype'] = get_datatype(info)
+            self.seen.add(filename)
+            frames.append(info)
+        return frames
+    
+    def process(self, info):
+        """
+        Add a new frame to the reduction of its target.
+        
+        Parameters
+        ----------
+        info : dict
+            From poll().
+        
+        Returns
+        -------
+        QuickLookTarget or None
+            The target, if the frame completed a nod pair and the plot was
+            updated, else None.
+        """
+        from frames import subtract_frames
+        from prepare import prepare_frame
+        from skysub import nod_positions
+        
+        if info['datatype'] not in self.datatypes:
+            return None
+        name = '%s_%s' % (info['object'], info['band'])
+        if name not in self.targets:
+            self.targets[name] = QuickLookTarget(name, info['datatype'])
+        target = self.targets[name]
+        
+        frame = prepare_frame(info['filename'], lnrs=info['lnrs'])
+        if self.cosmics:
+            from crreject import clean_frame
+            
+            (frame, _) = clean_frame(frame, info['rdmode'])
+        if target.reference is None:
+            target.reference = frame.phu
+        position = nod_positions([target.reference, frame.phu],
+                                 self.keyword, self.tolerance)[1]
+        if not target.pending or target.pending[0][0] == position:
+            target.pending.append((position, frame))
+            return None
+        
+        (_, other) = target.pending.pop(0)
+        # A - B, so that the positive trace stays at position A.
+        pair = subtract_frames(*((frame, other) if position == 0
+                                 else (other, frame)))
+        self.add_pair(target, pair)
+        return target
+    
+    def add_pair(self, target, pair):
+        """
+        Flat field and rectify a sky-subtracted pair, add it to the stack
+        of the target, extract the spectrum and write the plot.
+        
+        Parameters
+        ----------
+        target : QuickLookTarget
+        pair : frames.Frame
+            A-B difference, with VAR.
+        """
+        from frames import divide_frames
+        
+        if self.flat is not None:
+            pair = divide_frames(pair, self.flat)
+        sci = pair.sci
+        var = pair.var
+        dq = pair.dq if pair.dq is not None else \
+             np.zeros(pair.shape, dtype=np.int16)
+        if self.rectmap is not None:
+            sci = self.rectmap.apply(sci)
+            var = self.rectmap.apply_variance(var)
+            dq = self.rectmap.apply_dq(dq)
+        
+        if target.stack is None:
+            target.stack = RunningStack(sci.shape)
+        target.stack.update(sci, var, dq == 0)
+        target.npairs += 1
+        self.extract(target)
+        self.plot(target)
+    
+    def extract(self, target):
+        """
+        Extract the spectrum of the mean of the stack, and measure its
+        signal-to-noise ratio and its emission lines.
+        """
+        from scipy import ndimage
+        from astropy import units as u
+        from extract import extract
+        from spectro import Spectrum
+        from wavecal import find_peaks
+        
+        mean = target.stack.mean
+        var = target.stack.variance_of_mean()
+        dq = (~target.stack.good).astype(np.int16)
+        if self.dispaxis == 1:
+            (mean, var, dq) = (mean.T, var.T, dq.T)
+        extraction = extract(mean, var, dq, width=self.width)
+        
+        if self.rectmap is not None:
+            (crval, cdelt, wunit) = (self.rectmap.crval, self.rectmap.cdelt,
+                                     u.Angstrom)
+        elif self.wavelength is not None:
+            (crval, cdelt) = self.wavelength
+            wunit = u.Angstrom
+        else:
+            (crval, cdelt, wunit) = (1., 1., u.pix)
+        target.spectrum = Spectrum.from_array(extraction.flux, crval, cdelt,
+                                              wunit=wunit)
+        target.variance = Spectrum.from_array(extraction.var, crval, cdelt,
+                                              wunit=wunit)
+        
+        valid = np.isfinite(extraction.flux) & (extraction.var > 0.) & \
+                np.isfinite(extraction.var)
+        target.snr = float(np.median(extraction.flux[valid] /
+                                     np.sqrt(extraction.var[valid]))) \
+                     if valid.any() else 0.
+        flux = np.where(valid, extraction.flux, 0.)
+        continuum = ndimage.median_filter(flux, size=51, mode='nearest')
+        (positions, _) = find_peaks(flux - continuum, self.line_nsigma)
+        target.lines = crval + cdelt * np.asarray(positions, dtype=float)
+    
+    def plot(self, target):
+        """
+        Plot the last extraction of a target to <outdir>/<name>.png.
+        """
+        from astropy.io import fits
+        import plottools
+        from specplot import SpecPlotAnnotations, specplot
+        
+        if self._pool is None:
+            # PNG only: draw off screen, whatever the pyplot backend.
+            self._pool = plottools.OffscreenFigurePool(maxsize=1)
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+        annotations = SpecPlotAnnotations('%s: %d pairs, S/N %.1f' %
+                                          (target.name, target.npairs,
+                                           target.snr))
+        if self.line_list_name is not None:
+            annotations.set_line_list_name(self.line_list_name)
+            if self.redshift is not None:
+                annotations.set_redshift(self.redshift)
+        hdulist = fits.HDUList([fits.PrimaryHDU(), target.spectrum.hdu,
+                                target.variance.hdu])
+        target.plotfile = os.path.join(self.outdir, target.name + '.png')
+        plot = specplot(hdulist, '1', '2', annotations=annotations,
+                        output_plot_name=target.plotfile, pool=self._pool)
+        plot.release()
+    
+    def step(self):
+        """
+        Poll once and process the new frames.
+        
+        A frame that cannot be processed is added to self.errors and
+        skipped, so that the watch goes on.
+        
+        Returns
+        -------
+        list of QuickLookTarget
+            Targets updated, once for each new pair.
+        """
+        updated = []
+        for info in self.poll():
+            try:
+                target = self.process(info)
+            except Exception as err:        # pylint: disable=W0703
+                self.errors.append((info['filename'], str(err)))
+                continue
+            if target is not None:
+                updated.append(target)
+        return updated
+    
+    def run(self, interval=10., max_polls=None, verbose=True):
+        """
+        Watch the raw directory until interrupted.
+        
+        Parameters
+        ----------
+        interval : float, optional
+            Time between polls, in seconds.  Default = 10.
+        max_polls : int, optional
+            Stop after this many polls.  Default is to run until
+            KeyboardInterrupt.
+        verbose : bool, optional
+            Print a summary of each new pair and the errors.
+            Default = True.
+        """
+        npolls = 0
+        try:
+            while max_polls is None or npolls < max_polls:
+                nerrors = len(self.errors)
+                updated = self.step()
+                if verbose:
+                    for (filename, error) in self.errors[nerrors:]:
+                        print 'ERROR: %s: %s' % (filename, error)
+                for target in updated:
+                    if verbose:
+                        print '%s: %d pairs, S/N %.1f, %d lines -> %s' % \
+                              (target.name, target.npairs, target.snr,
+                               len(target.lines), target.plotfile)
+                npolls += 1
+                if max_polls is None or npolls < max_polls:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def is_complete(filename):
+    """
+    True if a FITS file is a whole number of 2880-byte blocks, ie. it is
+    not being written.
+    """
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return False
+    return size > 0 and size % FITS_BLOCK == 0
@@ -0,0 +1,420 @@
+# rectify.py
+"""
+Rectify 2-D spectra onto a linear wavelength grid with a cached sparse map.
+
+This replaces the nsfitcoords/nstransform pair.  The wavelength surface
+is fitted once from the lines identified in the arc, with the lxorder and
+lyorder recorded in the reduction notebooks.  The resampling is then
+compiled into a sparse matrix: each output pixel is a linear
+interpolation between two input pixels along the dispersion axis.  The
+matrix is saved on disk, keyed by a hash of the arc solution, and every
+frame rectified with the same arc, and its variance, costs one sparse
+matrix product.
+
+The spatial axis is not resampled: the output column j is the input
+column j.
+
+Usage:
+    rmap = get_rectification_map(xpix, ypix, wavelengths, (2048, 2048),
+                                 lxorder=3, lyorder=8)
+    rectified = rmap.apply_frame(Frame.from_file('fobj_comb.fits'))
+"""
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = 'rectify_cache'
+
+class RectificationMap(object):
+    """
+    Sparse resampling of a 2-D spectrum onto a linear wavelength grid.
+    
+    The dispersion is along the first numpy axis (DISPAXIS=2).  Frames
+    with DISPAXIS=1 are transposed on the way in and out.
+    
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Shape (nout, nin), nin = nrows*ncols of the input frames and
+        nout = nwave*ncols.
+    shape : tuple of int
+        Shape (nrows, ncols) of the input frames, dispersion first.
+    crval : float
+        Wavelength of the first output row.
+    cdelt : float
+        Wavelength step of the output rows.
+    nwave : int
+        Number of output rows.
+    key : str, optional
+        Hash of the arc solution, see solution_hash().
+    dispaxis : int, optional
+        Dispersion axis of the frames, as DISPAXIS.  Default = 2.
+    """
+    def __init__(self, matrix, shape, crval, cdelt, nwave, key=None,
+                 dispaxis=2):
+        self.matrix = matrix.tocsr()
+        self.shape = tuple(shape)
+        self.crval = crval
+        self.cdelt = cdelt
+        self.nwave = nwave
+        self.key = key
+        self.dispaxis = dispaxis
+        self._squared = None
+        self._support = None
+    
+    @property
+    def out_shape(self):
+        """
+        Shape of the rectified frames, dispersion first.
+        """
+        return (self.nwave, self.shape[1])
+    
+    @property
+    def wavelengths(self):
+        """
+        Wavelength of each output row.
+        """
+        return self.crval + self.cdelt * np.arange(self.nwave)
+    
+    def _to_internal(self, data):
+        data = np.asarray(data)
+        if self.dispaxis == 1:
+            data = data.T
+        if data.shape != self.shape:
+            raise ValueError('Frame shape %s does not match the map %s.' %
+                             (str(data.shape), str(self.shape)))
+        return data
+    
+    def _to_external(self, data):
+        data = data.reshape(self.out_shape)
+        if self.dispaxis == 1:
+            data = data.T
+        return data
+    
+    def apply(self, data):
+        """
+        Rectify one image.
+        
+        Parameters
+        ----------
+        data : ndarray
+            Input image, same shape as the frames of the arc.
+        
+        Returns
+        -------
+        ndarray
+            Rectified image.
+        """
+        data = self._to_internal(data).astype(np.float64).ravel()
+        return self._to_external(self.matrix.dot(data))
+    
+    def apply_variance(self, var):
+        """
+        Propagate a variance image: the weights are squared.
+        
+        Parameters
+        ----------
+        var : ndarray
+            Input variance.
+        
+        Returns
+        -------
+        ndarray
+            Variance of the rectified image.
+        """
+        if self._squared is None:
+            self._squared = self.matrix.multiply(self.matrix).tocsr()
+        var = self._to_internal(var).astype(np.float64).ravel()
+        return self._to_external(self._squared.dot(var))
+    
+    def apply_dq(self, dq):
+        """
+        Propagate a DQ image.  Each output pixel gets the bitwise OR of
+        the DQ of the input pixels it is interpolated from.  The output
+        pixels that fall outside the input frame are flagged DQ_NODATA.
+        
+        Parameters
+        ----------
+        dq : ndarray or None
+            Input DQ.
+        
+        Returns
+        -------
+        ndarray
+            int16 DQ of the rectified image.
+        """
+        from frames import DQ_NODATA
+        
+        if self._support is None:
+            self._support = (self.matrix != 0).astype(np.int32).tocsr()
+        out = np.zeros(self.out_shape[0] * self.out_shape[1], dtype=np.int16)
+        nodata = np.asarray(self._support.sum(axis=1)).ravel() == 0
+        out[nodata] = DQ_NODATA
+        if dq is not None:
+            dq = self._to_internal(dq).ravel()
+            for bit in range(16):
+                flagged = ((dq >> bit) & 1).astype(np.int32)
+                if not flagged.any():
+                    continue
+                hit = self._support.dot(flagged) > 0
+                out[hit] |= np.array(1 << bit).astype(np.int16)
+        return self._to_external(out)
+    
+    def apply_frame(self, frame):
+        """
+        Rectify a frame and its variance and DQ planes.  The linear
+        wavelength solution is written in the SCI header.
+        
+        Parameters
+        ----------
+        frame : frames.Frame
+        
+        Returns
+        -------
+        frames.Frame
+        """
+        from frames import Frame
+        
+        sci = self.apply(frame.sci).astype(np.float32)
+        var = None
+        if frame.var is not None:
+            var = self.apply_variance(frame.var).astype(np.float32)
+        dq = self.apply_dq(frame.dq)
+        
+        header = frame.header.copy()
+        axis = 2 if self.dispaxis == 2 else 1
+        header['CTYPE%d' % axis] = 'LINEAR'
+        header['CRVAL%d' % axis] = self.crval
+        header['CRPIX%d' % axis] = 1.
+        header['CDELT%d' % axis] = self.cdelt
+        header['CD%d_%d' % (axis, axis)] = self.cdelt
+        header['DISPAXIS'] = self.dispaxis
+        phu = frame.phu.copy()
+        if self.key is not None:
+            phu['RECTKEY'] = (self.key, 'Hash of the rectification map')
+        return Frame(sci, var, dq, phu=phu, header=header)
+    
+    def save(self, filename):
+        """
+        Save the map in a NumPy .npz file.
+        
+        Parameters
+        ----------
+        filename : str
+        """
+        matrix = self.matrix
+        np.savez(filename, data=matrix.data, indices=matrix.indices,
+                 indptr=matrix.indptr, matrix_shape=matrix.shape,
+                 shape=self.shape, grid=[self.crval, self.cdelt],
+                 nwave=self.nwave, key=str(self.key),
+                 dispaxis=self.dispaxis)
+    
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a map saved with save().
+        
+        Parameters
+        ----------
+        filename : str
+        
+        Returns
+        -------
+        RectificationMap
+        """
+        from scipy import sparse
+        
+        saved = np.load(filename)
+        matrix = sparse.csr_matrix((saved['data'], saved['indices'],
+                                    saved['indptr']),
+                                   shape=tuple(saved['matrix_shape']))
+        (crval, cdelt) = saved['grid']
+        return cls(matrix, tuple(saved['shape']), float(crval),
+                   float(cdelt), int(saved['nwave']), key=str(saved['key']),
+                   dispaxis=int(saved['dispaxis']))
+
+
+def solution_hash(xpix, ypix, wavelengths, shape, lxorder, lyorder,
+                  wave_grid=None, dispaxis=2):
+    """
+    Hash of everything that defines a rectification map.
+    
+    Parameters
+    ----------
+    See build_map().
+    
+    Returns
+    -------
+    str
+        SHA-1 hex digest.
+    """
+    import hashlib
+    
+    sha = hashlib.sha1()
+    for values in (xpix, ypix, wavelengths):
+        sha.update(np.round(np.asarray(values, dtype=np.float64),
+                            6).tostring())
+    sha.update(repr((tuple(shape), lxorder, lyorder, wave_grid,
+                     dispaxis)).encode('ascii'))
+    return sha.hexdigest()
+
+def _scale(values, low, high):
+    # map [low, high] to [-1, 1] for the Legendre polynomials.
+    return 2. * (np.asarray(values, dtype=np.float64) - low) / \
+           (high - low) - 1.
+
+def fit_surface(u, v, values, uorder, vorder, urange, vrange):
+    """
+    Fit a 2-D Legendre surface by least squares.
+    
+    Parameters
+    ----------
+    u, v : ndarray
+        Coordinates of the points.
+    values : ndarray
+        Values to fit.
+    uorder, vorder : int
+        Orders along u and v.
+    urange, vrange : tuple of float
+        Ranges of u and v mapped to [-1, 1].
+    
+    Returns
+    -------
+    ndarray
+        Coefficients, shape (uorder+1, vorder+1).
+    """
+    design = np.polynomial.legendre.legvander2d(_scale(u, *urange),
+                                                _scale(v, *vrange),
+                                                [uorder, vorder])
+    coeffs = np.linalg.lstsq(design, np.asarray(values, dtype=np.float64),
+                             rcond=None)[0]
+    return coeffs.reshape(uorder + 1, vorder + 1)
+
+def eval_surface(coeffs, u, v, urange, vrange):
+    """
+    Evaluate a surface fitted with fit_surface().
+    """
+    return np.polynomial.legendre.legval2d(_scale(u, *urange),
+                                           _scale(v, *vrange), coeffs)
+
+def build_map(xpix, ypix, wavelengths, shape, lxorder=3, lyorder=8,
+              wave_grid=None, dispaxis=2):
+    """
+    Fit the wavelength surface of an arc and compile the sparse map.
+    
+    The inverse surface, the row as a function of the column and the
+    wavelength, is fitted from the same points as the wavelength
+    surface, with lxorder along the spatial axis and lyorder along the
+    dispersion axis.  It is evaluated at every output pixel.
+    
+    Parameters
+    ----------
+    xpix, ypix : array_like
+        0-based pixel coordinates (x = column, y = row) of the arc lines
+        identified along the slit.
+    wavelengths : array_like
+        Wavelength of each point.
+    shape : tuple of int
+        Shape (nrows, ncols) of the frames, as numpy shape.
+    lxorder : int, optional
+        Order of the fit along x.  Default = 3.
+    lyorder : int, optional
+        Order of the fit along y.  Default = 8.
+    wave_grid : tuple, optional
+        (crval, cdelt, nwave) of the output.  Default covers the
+        wavelengths of the centre of the slit with as many pixels as
+        the input.
+    dispaxis : int, optional
+        Dispersion axis, as DISPAXIS.  Default = 2.
+    
+    Returns
+    -------
+    RectificationMap
+    """
+    from scipy import sparse
+    
+    key = solution_hash(xpix, ypix, wavelengths, shape, lxorder, lyorder,
+                        wave_grid, dispaxis)
+    xpix = np.asarray(xpix, dtype=np.float64)
+    ypix = np.asarray(ypix, dtype=np.float64)
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    if dispaxis == 1:
+        # work with the dispersion along the first axis.
+        (xpix, ypix) = (ypix, xpix)
+        shape = (shape[1], shape[0])
+    (nrows, ncols) = shape
+    xrange_ = (0., ncols - 1.)
+    yrange_ = (0., nrows - 1.)
+    
+    if wave_grid is None:
+        forward = fit_surface(xpix, ypix, wavelengths, lxorder, lyorder,
+                              xrange_, yrange_)
+        centre = np.full(nrows, (ncols - 1) / 2.)
+        ends = eval_surface(forward, centre[[0, -1]],
+                            np.array([0., nrows - 1.]), xrange_, yrange_)
+        (crval, cdelt) = (ends[0], (ends[1] - ends[0]) / (nrows - 1.))
+        nwave = nrows
+    else:
+        (crval, cdelt, nwave) = wave_grid
+    wrange = (min(crval, crval + cdelt * (nwave - 1)),
+              max(crval, crval + cdelt * (nwave - 1)))
+    
+    inverse = fit_surface(xpix, wavelengths, ypix, lxorder, lyorder,
+                          xrange_, wrange)
+    (out_w, out_x) = np.meshgrid(crval + cdelt * np.arange(nwave),
+                                 np.arange(ncols, dtype=np.float64),
+                                 indexing='ij')
+    rows = eval_surface(inverse, out_x.ravel(), out_w.ravel(),
+                        xrange_, wrange)
+    
+    columns = np.tile(np.arange(ncols), nwave)
+    outputs = np.arange(nwave * ncols)
+    inside = (rows >= 0.) & (rows <= nrows - 1.)
+    low = np.clip(np.floor(rows), 0, max(nrows - 2, 0)).astype(np.int64)
+    frac = rows - low
+    weights = np.concatenate((1. - frac[inside], frac[inside]))
+    out_index = np.concatenate((outputs[inside], outputs[inside]))
+    in_index = np.concatenate((low[inside] * ncols + columns[inside],
+                               (low[inside] + 1) * ncols + columns[inside]))
+    matrix = sparse.csr_matrix((weights, (out_index, in_index)),
+                               shape=(nwave * ncols, nrows * ncols))
+    matrix.eliminate_zeros()
+    
+    return RectificationMap(matrix, shape, float(crval), float(cdelt),
+                            int(nwave), key=key, dispaxis=dispaxis)
+
+def get_rectification_map(xpix, ypix, wavelengths, shape, lxorder=3,
+                          lyorder=8, wave_grid=None, dispaxis=2,
+                          cachedir=DEFAULT_CACHE_DIR):
+    """
+    Return the map for an arc solution, from the disk cache if it was
+    already built.  See build_map() for the parameters.
+    
+    Parameters
+    ----------
+    cachedir : str, optional
+        Directory of the cached maps.  None disables the cache.
+        Default = 'rectify_cache'.
+    
+    Returns
+    -------
+    RectificationMap
+    """
+    import os
+    import os.path
+    
+    if cachedir is None:
+        return build_map(xpix, ypix, wavelengths, shape, lxorder, lyorder,
+                         wave_grid, dispaxis)
+    
+    key = solution_hash(xpix, ypix, wavelengths, shape, lxorder, lyorder,
+                        wave_grid, dispaxis)
+    filename = os.path.join(cachedir, 'rectify-%s.npz' % key)
+    if os.path.exists(filename):
+        return RectificationMap.load(filename)
+    
+    rmap = build_map(xpix, ypix, wavelengths, shape, lxorder, lyorder,
+                     wave_grid, dispaxis)
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    rmap.save(filename)
+    return rmap
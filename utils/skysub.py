@@ -0,0 +1,337 @@
+# skysub.py
+"""
+Dark subtraction, flat division and nod-pair sky subtraction of a
+sequence of frames, in one vectorized pass.
+
+This replaces the per-frame gemarith loops and the nsreduce steps of
+the reduction.  All the frames of a sequence are read into one stack,
+on a thread pool, and every operation is a broadcast over the stack:
+
+    sci = ((frames - dark) - (sky frames - dark)) / flat
+
+The sky of each frame is the closest frame of the sequence taken at the
+other nod position, eg. in ABBA, A1-B1, B1-A1, B2-A2 and A2-B2.  The
+dark cancels in the difference, so its variance is only added to the
+frames that are not sky subtracted.
+
+Usage:
+    frames = reduce_frames(combine.get_filenames('S20131002', '055-070',
+                                                 prefix='f'),
+                           dark=Frame.from_file('objdark.fits'),
+                           flat=Frame.from_file('flat.fits'),
+                           outprefix='rd')
+"""
+
+import numpy as np
+
+DEFAULT_OFFSET_KEYWORD = 'QOFFSET'
+
+def read_stack(filenames, nthreads=None):
+    """
+    Read frames into stacked arrays, one frame per thread.
+    
+    Parameters
+    ----------
+    filenames : list of str
+        Raw or prepared frames, all of the same shape.
+    nthreads : int, optional
+        Number of threads.  Default = number of cores.
+    
+    Returns
+    -------
+    tuple
+        (sci, var, dq, phus, headers).  sci is float32 of shape
+        (nframes, nrows, ncols); var and dq are None unless all the
+        frames have them.
+    """
+    from frames import Frame
+    
+    first = Frame.from_file(filenames[0])
+    shape = (len(filenames),) + first.shape
+    has_var = first.var is not None
+    has_dq = first.dq is not None
+    first.close()
+    
+    sci = np.empty(shape, dtype=np.float32)
+    var = np.empty(shape, dtype=np.float32) if has_var else None
+    dq = np.empty(shape, dtype=np.int16) if has_dq else None
+    phus = [None] * len(filenames)
+    headers = [None] * len(filenames)
+    
+    def read(index):
+        frame = Frame.from_file(filenames[index])
+        try:
+            if frame.shape != shape[1:]:
+                raise ValueError('%s has shape %s, expected %s' %
+                                 (filenames[index], frame.shape, shape[1:]))
+            sci[index] = frame.sci
+            if has_var:
+                if frame.var is None:
+                    raise ValueError('%s has no VAR' % filenames[index])
+                var[index] = frame.var
+            if has_dq:
+                if frame.dq is None:
+                    raise ValueError('%s has no DQ' % filenames[index])
+                dq[index] = frame.dq
+            phus[index] = frame.phu.copy()
+            headers[index] = frame.header.copy()
+        finally:
+            frame.close()
+    
+    _map_threads(read, range(len(filenames)), nthreads)
+    return (sci, var, dq, phus, headers)
+
+def nod_positions(phus, keyword=DEFAULT_OFFSET_KEYWORD, tolerance=0.5):
+    """
+    Nod position of each frame, from the telescope offsets.
+    
+    Parameters
+    ----------
+    phus : list of Header
+        Primary headers of the frames, in time order.
+    keyword : str, optional
+        Offset keyword.  Default = 'QOFFSET', the offset along the slit.
+    tolerance : float, optional
+        Offsets closer than this, in arcsec, are the same position.
+        Default = 0.5.
+    
+    Returns
+    -------
+    ndarray
+        0 for the frames at the position of the first frame (A), 1 for
+        the others (B).
+    
+    Raises
+    ------
+    ValueError
+        If there are more than two positions.
+    """
+    offsets = np.array([float(phu[keyword]) for phu in phus])
+    other = np.abs(offsets - offsets[0]) > tolerance
+    if other.any():
+        second = offsets[other][0]
+        if np.any(other & (np.abs(offsets - second) > tolerance)):
+            raise ValueError('More than two nod positions: %s' %
+                             sorted(set(np.round(offsets, 1))))
+    return other.astype(int)
+
+def sky_pairs(positions):
+    """
+    Index of the sky frame of each frame: the closest frame in the
+    sequence at the other position, the earlier one on a tie.
+    
+    Parameters
+    ----------
+    positions : array_like
+        Nod positions, see nod_positions().
+    
+    Returns
+    -------
+    ndarray of int
+    
+    Raises
+    ------
+    ValueError
+        If all the frames are at the same position.
+    """
+    positions = np.asarray(positions)
+    if np.all(positions == positions[0]):
+        raise ValueError('All the frames are at the same nod position.')
+    index = np.arange(positions.size)
+    distance = np.abs(index[:, np.newaxis] -
+                      index[np.newaxis, :]).astype(float)
+    distance[positions[:, np.newaxis] == positions[np.newaxis, :]] = np.inf
+    # argmin returns the first minimum, ie. the earlier frame on a tie.
+    return np.argmin(distance, axis=1)
+
+def reduce_stack(sci, var=None, dq=None, dark=None, flat=None, pairs=None):
+    """
+    Subtract the dark, subtract the sky frames and divide by the flat,
+    for a whole stack at once.
+    
+    Parameters
+    ----------
+    sci : ndarray
+        Shape (nframes, nrows, ncols).
+    var : ndarray, optional
+        Variance, same shape.
+    dq : ndarray, optional
+        Data quality, same shape.
+    dark : frames.Frame, optional
+        Dark of the same exposure time.
+    flat : frames.Frame, optional
+        Normalized flat.  Pixels where it is 0 are flagged DQ_BAD.
+    pairs : array_like, optional
+        Index of the sky frame of each frame, see sky_pairs().  Default
+        is no sky subtraction.
+    
+    Returns
+    -------
+    tuple
+        (sci, var, dq), float32 and int16 arrays of the same shape as
+        sci; var and dq are None if they cannot be propagated.
+    """
+    from frames import DQ_BAD
+    
+    sci = np.asarray(sci, dtype=np.float32)
+    var = np.asarray(var, dtype=np.float32) if var is not None else None
+    dq = np.asarray(dq, dtype=np.int16) if dq is not None else None
+    if dark is not None and dark.dq is not None:
+        if dq is None:
+            dq = np.zeros(sci.shape, dtype=np.int16)
+        dq = dq | dark.dq
+    
+    if pairs is not None:
+        pairs = np.asarray(pairs)
+        # the dark cancels in the difference.
+        sci = sci - sci[pairs]
+        if var is not None:
+            var = var + var[pairs]
+        if dq is not None:
+            dq = dq | dq[pairs]
+    elif dark is not None:
+        sci = sci - np.asarray(dark.sci, dtype=np.float32)
+        if var is not None and dark.var is not None:
+            var = var + np.asarray(dark.var, dtype=np.float32)
+    
+    if flat is not None:
+        flatsci = np.asarray(flat.sci, dtype=np.float32)
+        zero = (flatsci == 0.)
+        safe = np.where(zero, 1., flatsci).astype(np.float32)
+        sci = np.where(zero, 0., sci / safe).astype(np.float32)
+        if var is not None:
+            var = var / safe**2
+            if flat.var is not None:
+                var += sci**2 * np.asarray(flat.var, dtype=np.float32) / \
+                       safe**2
+            var[:, zero] = 0.
+        if dq is not None or zero.any() or flat.dq is not None:
+            dq = np.zeros(sci.shape, dtype=np.int16) if dq is None else dq
+            if flat.dq is not None:
+                dq = dq | flat.dq
+            dq[:, zero] |= DQ_BAD
+    return (sci.astype(np.float32),
+            var.astype(np.float32) if var is not None else None,
+            dq.astype(np.int16) if dq is not None else None)
+
+def reduce_frames(filenames, dark=None, flat=None, sky=True,
+                  keyword=DEFAULT_OFFSET_KEYWORD, outprefix=None,
+                  nthreads=None, rdmode=None):
+    """
+    Reduce a sequence of frames in one pass.
+    
+    Parameters
+    ----------
+    filenames : list of str
+        Frames of the sequence, in time order, eg. the f@obj.lis frames.
+    dark : frames.Frame, optional
+        Dark of the same exposure time.
+    flat : frames.Frame, optional
+        Normalized flat.
+    sky : bool, optional
+        Subtract the closest frame at the other nod position.
+        Default = True.
+    keyword : str, optional
+        Offset keyword of the nod positions.  Default = 'QOFFSET'.
+    outprefix : str, optional
+        If given, write each frame with this prefix added to its name.
+    nthreads : int, optional
+        Number of I/O threads.  Default = number of cores.
+    rdmode : str, optional
+        If given, the cosmic rays and the hot pixels are flagged in the
+        DQ planes before the sky subtraction, with the parameters of
+        this read mode, see crreject.clean_frames().
+    
+    Returns
+    -------
+    list of frames.Frame
+    """
+    import os.path
+    from frames import Frame
+    
+    (sci, var, dq, phus, headers) = read_stack(filenames, nthreads)
+    if rdmode is not None:
+        from crreject import clean_frames
+        
+        stack = [Frame(sci[index], var[index] if var is not None else None,
+                       dq[index] if dq is not None else None,
+                       phu=phus[index])
+                 for index in range(len(filenames))]
+        clean_frames(stack, rdmode, nthreads=nthreads)
+        dq = np.array([frame.dq for frame in stack])
+        phus = [frame.phu for frame in stack]
+    pairs = None
+    if sky:
+        pairs = sky_pairs(nod_positions(phus, keyword))
+    (sci, var, dq) = reduce_stack(sci, var, dq, dark, flat, pairs)
+    
+    reduced = []
+    for (index, filename) in enumerate(filenames):
+        phu = phus[index]
+        if dark is not None:
+            phu['DARKIMAG'] = (os.path.basename(dark.filename or 'dark'),
+                               'Dark image subtracted')
+        if flat is not None:
+            phu['FLATIMAG'] = (os.path.basename(flat.filename or 'flat'),
+                               'Flat field image used')
+        if pairs is not None:
+            phu['SKYIMAGE'] = (os.path.basename(filenames[pairs[index]]),
+                               'Sky frame subtracted')
+        reduced.append(Frame(sci[index],
+                             var[index] if var is not None else None,
+                             dq[index] if dq is not None else None,
+                             phu=phu, header=headers[index],
+                             filename=filename))
+    
+    if outprefix is not None:
+        def write(frame):
+            (directory, basename) = os.path.split(frame.filename)
+            frame.write(os.path.join(directory, outprefix + basename))
+        _map_threads(write, reduced, nthreads)
+    return reduced
+
+def reduce_record(record, rawdir='', prefix='f', **kwargs):
+    """
+    Reduce the frames of an ObsTable record, see reduce_frames().
+    The cosmic rays are flagged with the read mode of the record,
+    unless rdmode is given.
+    
+    Parameters
+    ----------
+    record : obstable.ObsRecord
+        A Science or Telluric record.
+    rawdir : str, optional
+        Directory of the frames.  Default = ''.
+    prefix : str, optional
+        Prefix of the frames.  Default = 'f'.
+    **kwargs
+        Passed to reduce_frames().
+    
+    Returns
+    -------
+    list of frames.Frame
+    """
+    from combine import get_filenames
+    
+    filenames = get_filenames(record.rootname, record.filerange, rawdir,
+                              prefix)
+    kwargs.setdefault('rdmode', record.rdmode)
+    return reduce_frames(filenames, **kwargs)
+
+def _map_threads(function, items, nthreads=None):
+    # Apply function to the items on a thread pool, and re-raise the
+    # first exception.
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    
+    items = list(items)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(nthreads, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -12,7 +12,8 @@ import plottools
 import numpy as np
 
 def specplot(hdulist, spec_ext, var_ext, annotations=None, 
-             ylimits=None, output_plot_name=None):
+             ylimits=None, output_plot_name=None, xlimits=None, pool=None,
+             decimate=False):
     """
     Plot a 1-D spectrum and annotates.
     
@@ -48,11 +49,23 @@ def specplot(hdulist, spec_ext, var_ext, annotations=None,
         If set, the plot will be saved to a file of that name. The .png
         filename extension is optional, it will be added appropriately.
         The plot will be display on screen as well as being saved to disk.
+    xlimits : list, optional
+        The lower and upper wavelength limits, in the units of the 
+        spectrum.  Only the pixels in that window are read from the HDU.
+    pool : plottools.FigurePool, optional
+        If set, the figure is taken from this pool and the drawing is
+        deferred until the plot is saved or rendered.  Release the
+        returned plot to give the figure back to the pool.
+    decimate : bool, optional
+        If True, draw the spectrum and the error as min/max envelopes,
+        one column per screen pixel, recomputed when zooming.  Use for
+        long spectra.  Default = False.
     
     Returns
     _______
-    No return values. A plot is produced on screen, and it can be saved 
-    to disk.
+    SpPlot
+        The plot.  It is produced on screen, and it can be saved to disk.
+        Batch callers should close the figure when done with it.
     
     Raises
     ______
@@ -73,9 +86,14 @@ def specplot(hdulist, spec_ext, var_ext, annotations=None,
     # Get the spectrum.
     #print 'debug - specplot - Extension parsed as:', get_valid_extension(spec_ext)
     #print 'debug - specplot - The hdulist is:', hdulist.info()
-    spectrum = spectro.Spectrum(hdulist[get_valid_extension(spec_ext)])
+    spectrum = spectro.Spectrum(hdulist[get_valid_extension(spec_ext)],
+                                lazy=True)
+    if xlimits is not None:
+        spectrum = spectrum.slice_wavelength(xlimits[0], xlimits[1])
     if var_ext is not None:
-        error = spectro.Spectrum(hdulist[get_valid_extension(var_ext)])
+        error = spectro.Spectrum(hdulist[get_valid_extension(var_ext)],
+                                 wunit=spectrum.wunit, lazy=True,
+                                 pixel_range=spectrum.pixel_range)
         error.counts = np.sqrt(error.counts)
     
     # To simplify the rest of the scripts, create an instance of
@@ -99,19 +117,17 @@ def specplot(hdulist, spec_ext, var_ext, annotations=None,
     # ----- START PLOTTING
     #
     # Plot the spectrum and set y-axis limits
-    plot = plottools.SpPlot(title=annotations.title)
-    plot.plot_spectrum(spectrum)
+    plot = plottools.SpPlot(title=annotations.title, pool=pool)
+    plot.plot_spectrum(spectrum, decimate=decimate)
     if var_ext is not None:
-        plot.plot_spectrum(error, color='g')
+        plot.plot_spectrum(error, color='g', decimate=decimate)
     if ylimits is not None:
         plot.adjust_ylimits(ylimits[0], ylimits[1])
     
     # Annotate the lines.
     if annotations.annotate_lines:
-        lines_to_plot = []
-        for line in linelist.lines:
-            lines_to_plot.append( (line.obswlen.to(spectrum.wunit).value, 
-                                   line.name) )
+        obswlen = linelist.observed_wavelengths(unit=spectrum.wunit)
+        lines_to_plot = zip(obswlen, linelist.names)
         plot.annotate_lines(lines_to_plot)
         
     # Draw the band limits
@@ -122,7 +138,7 @@ def specplot(hdulist, spec_ext, var_ext, annotations=None,
     if output_plot_name is not None:
         plot.write_png(output_plot_name)
     
-    return
+    return plot
 
 
 class SpecPlotAnnotations:
@@ -261,6 +277,258 @@ def get_valid_extension(extension_string):
     
     return valid_extension
 
+# Figure pool used by render_batch_job() in each worker process.
+_BATCH_POOL = None
+
+class BatchPlotJob:
+    """
+    Everything needed to render one spectrum to a PNG file.
+    
+    The jobs are sent to the worker processes of batch_specplot(), so they
+    only contain simple attributes.
+    
+    Parameters
+    ----------
+    filename : str
+        FITS file with the extracted spectrum.
+    output_plot_name : str
+        Name of the PNG file to write.
+    spec_ext : str, optional
+        Extension of the science spectrum, eg. '1' or 'sci,1'. Default='1'.
+    var_ext : str, optional
+        Extension of the variance plane.  If set, the error is plotted.
+    title : str, optional
+        Title for the plot.  Default is the OBJECT keyword.
+    line_list_name : str, optional
+        Name of the line list to annotate.  See spectro.LINELIST_DICT.
+    redshift : float, optional
+        Redshift to apply to the line list.  If None, it is looked up in
+        the redshifts dictionary using the OBJECT keyword.
+    redshifts : dict, optional
+        Redshift of each target, keyed by target name.
+    ylimits : list, optional
+        The lower and upper limits for the y-axis.
+    xlimits : list, optional
+        The lower and upper wavelength limits.
+    """
+    # pylint: disable=R0913
+    def __init__(self, filename, output_plot_name, spec_ext='1', 
+                 var_ext=None, title=None, line_list_name=None, 
+                 redshift=None, redshifts=None, ylimits=None, xlimits=None):
+        self.filename = filename
+        self.output_plot_name = output_plot_name
+        self.spec_ext = spec_ext
+        self.var_ext = var_ext
+        self.title = title
+        self.line_list_name = line_list_name
+        self.redshift = redshift
+        self.redshifts = redshifts
+        self.ylimits = ylimits
+        self.xlimits = xlimits
+    # pylint: enable=R0913
+
+
+def render_batch_job(job):
+    """
+    Render one BatchPlotJob to PNG.
+    
+    Errors are caught and returned so that one bad file does not stop
+    the rest of the batch.
+    
+    Parameters
+    ----------
+    job : BatchPlotJob
+        The spectrum to render.
+    
+    Returns
+    -------
+    tuple
+        (filename, output_plot_name, error message or None)
+    """
+    from astropy.io import fits
+    global _BATCH_POOL                  # pylint: disable=W0603
+    
+    # One figure per worker process, reused from one job to the next.
+    if _BATCH_POOL is None:
+        _BATCH_POOL = plottools.FigurePool(maxsize=1)
+    
+    try:
+        hdulist = fits.open(job.filename, memmap=True)
+        try:
+            targetname = hdulist[0].header.get('OBJECT')
+            annotations = SpecPlotAnnotations(job.title)
+            if job.title is None:
+                annotations.set_title(targetname)
+            if job.line_list_name is not None:
+                annotations.set_line_list_name(job.line_list_name)
+                redshift = job.redshift
+                if redshift is None and job.redshifts is not None:
+                    redshift = job.redshifts.get(targetname, 0.)
+                if redshift is not None:
+                    annotations.set_redshift(redshift)
+            plot = specplot(hdulist, job.spec_ext, job.var_ext, 
+                            annotations=annotations, ylimits=job.ylimits,
+                            output_plot_name=job.output_plot_name,
+                            xlimits=job.xlimits, pool=_BATCH_POOL)
+            plot.release()
+        finally:
+            hdulist.close()
+    except Exception as err:        # pylint: disable=W0703
+        return (job.filename, job.output_plot_name, str(err))
+    
+    return (job.filename, job.output_plot_name, None)
+
+
+def batch_specplot(jobs, nprocs=None):
+    """
+    Render many spectra to PNG in parallel.
+    
+    The jobs are distributed to a pool of worker processes.  The workers
+    are forked from the calling process so the modules are imported only
+    once.  The caller must select a non-interactive matplotlib backend
+    (eg. 'Agg') before pyplot is first imported.
+    
+    Parameters
+    ----------
+    jobs : list of BatchPlotJob
+        The spectra to render.
+    nprocs : int, optional
+        Number of worker processes.  Default is the number of cores.
+    
+    Returns
+    -------
+    list of tuple
+        One (filename, output_plot_name, error message or None) per job,
+        in the same order as the jobs.
+    """
+    import multiprocessing
+    
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    nprocs = max(1, min(nprocs, len(jobs)))
+    
+    if nprocs == 1:
+        return [render_batch_job(job) for job in jobs]
+    
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        results = pool.map(render_batch_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def jobs_from_glob(patterns, outdir='.', **kwargs):
+    """
+    Create a BatchPlotJob for every file matching the glob patterns.
+    
+    The PNG files are named after the input files.
+    
+    Parameters
+    ----------
+    patterns : list of str
+        Glob patterns or file names, eg. 'SDSS*/*/redux*/axtfobj_bb.fits'.
+    outdir : str, optional
+        Directory for the PNG files.  Default = '.'.
+    kwargs
+        Any other BatchPlotJob parameter, applied to all the jobs.
+    
+    Returns
+    -------
+    list of BatchPlotJob
+    """
+    import glob
+    import os.path
+    
+    jobs = []
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)):
+            # Keep the directory names in the output name, many products
+            # share the same file name.
+            root = os.path.splitext(os.path.normpath(filename))[0]
+            output = '%s.png' % root.replace(os.sep, '-').lstrip('.-')
+            jobs.append(BatchPlotJob(filename, os.path.join(outdir, output),
+                                     **kwargs))
+    return jobs
+
+
+def jobs_from_obstable(table, rootdir='.', product='axtfobj_bb.fits',
+                       outdir='.', **kwargs):
+    """
+    Create a BatchPlotJob for every science target and band in a table.
+    
+    The extracted spectra are searched for in the directory structure
+    created by bookkeeping.mkdirectories(), ie. 
+    rootdir/targetname/obsdate-reduxdate/reduxBAND/product.
+    
+    Parameters
+    ----------
+    table : ObsTable
+        Observation summary table.  Only the Science records are used.
+    rootdir : str, optional
+        Program directory.  Default = '.'.
+    product : str, optional
+        File name of the extracted spectrum.  Default = 'axtfobj_bb.fits'.
+    outdir : str, optional
+        Directory for the PNG files.  Default = '.'.
+    kwargs
+        Any other BatchPlotJob parameter, applied to all the jobs.
+    
+    Returns
+    -------
+    list of BatchPlotJob
+    """
+    import glob
+    import os.path
+    
+    jobs = []
+    seen = set()
+    for record in table.records:
+        if record.datatype != 'Science':
+            continue
+        if (record.targetname, record.band) in seen:
+            continue
+        seen.add((record.targetname, record.band))
+        
+        pattern = os.path.join(rootdir, record.targetname, '*', 
+                               'redux%s' % record.band, product)
+        for filename in sorted(glob.glob(pattern)):
+            datedir = filename.split(os.sep)[-3]
+            output = '%s-%s-%s.png' % (record.targetname, record.band, 
+                                       datedir)
+            jobs.append(BatchPlotJob(filename, os.path.join(outdir, output),
+                                     **kwargs))
+    return jobs
+
+
+def read_redshift_table(filename):
+    """
+    Read a table of target redshifts.
+    
+    Each line contains a target name and its redshift.  Lines starting
+    with '#' are ignored.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the redshift table.
+    
+    Returns
+    -------
+    dict
+        Redshift of each target, keyed by target name.
+    """
+    redshifts = {}
+    with open(filename, 'r') as table:
+        for line in table:
+            if line.startswith('#') or not line.strip():
+                continue
+            (targetname, redshift) = line.split()[0:2]
+            redshifts[targetname] = float(redshift)
+    return redshifts
+
+
 def example():
     """
     This is just an example.  Cut and paste that on the python prompt.
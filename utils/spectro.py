@@ -3,6 +3,7 @@
 Classes and definitions related to spectroscopic data.
 """
 
+import re
 import numpy as np
 from astropy import wcs
 from astropy import units as u
@@ -222,7 +223,7 @@ class Line:
         """
         assert self.obswlen == (self.redshift + 1) * self.restwlen
 
-class Spectrum:
+class Spectrum(object):
     """
     Class representing a spectrum.
     
@@ -230,6 +231,18 @@ class Spectrum:
     and their values, and information about the WCS and units are obtained
     directly from the HDU.
     
+    When the header describes a linear dispersion (CRVAL1, CRPIX1 and
+    CD1_1 or CDELT1, as written by nstransform), the wavelengths are
+    computed directly with one array expression and no WCS object is
+    created.  The full WCS is used only when the header requires it.
+    The path used is recorded in the "wcs_path" attribute.
+    
+    In lazy mode, the counts, pix and wlen arrays are only read or
+    calculated when they are first accessed.  Combined with a memory-mapped
+    file (see from_file()) and slice_wavelength(), only the pixels in the
+    requested wavelength range are read from disk.  The dispersion axis is
+    the first FITS axis, so 2-D products are sliced along the rows.
+    
     Parameters
     ----------
     hdu : HDU
@@ -240,12 +253,54 @@ class Spectrum:
         astropy.units module.  If it is not provided as an argument, the 
         constructor will try to get the information from the headers, in
         particular from the 'WAT1_001' keyword.
+    fast_wcs : bool, optional
+        If True, use the linear dispersion fast path whenever the header
+        allows it.  If False, always use the full WCS.  Default = True.
+    lazy : bool, optional
+        If True, defer reading the counts and calculating the pixel and
+        wavelength arrays until they are accessed.  Default = False.
+    pixel_range : tuple of int, optional
+        First pixel and last pixel + 1, along the dispersion axis, to
+        include in the spectrum.  Default is the whole axis.
+    
+    Attributes
+    ----------
+    counts : ndarray
+        Pixel values.
+    pix : ndarray
+        Pixel positions, 0-based, along the dispersion axis of the HDU.
+    wlen : ndarray
+        Wavelength for each pixel, in units of wunit.
+    wcs_path : str
+        'linear' if the wavelengths were computed with the linear fast
+        path, 'wcs' if the full WCS was used.  None until wlen is
+        calculated.
+    wcs : WCS
+        The astropy WCS for the HDU.  It is only built when accessed.
+    
+    Examples
+    --------
+    >>> sp = Spectrum.from_file('JHK.fits')
+    >>> window = sp.slice_wavelength(18000., 19500.)
+    >>> window.counts.size
+    231
     """
-    def __init__(self, hdu, wunit=None):
-        self.counts = self.get_counts_array_from_hdu(hdu)
-        self.pix = self.get_pixel_array_from_hdu(hdu)
-        self.wcs = self.get_wcs_from_hdu(hdu)
-        self.wlen = self.apply_wcs_to_pixels()
+    def __init__(self, hdu, wunit=None, fast_wcs=True, lazy=False,
+                 pixel_range=None):
+        self.hdu = hdu
+        self.hdulist = None
+        self.fast_wcs = fast_wcs
+        self.lazy = lazy
+        self.pixel_range = pixel_range
+        self._wcs = None
+        self.wcs_path = None
+        self._counts = None
+        self._pix = None
+        self._wlen = None
+        if not lazy:
+            self.counts = self.get_counts_array_from_hdu(hdu, pixel_range)
+            self.pix = self.get_pixel_array_from_hdu(hdu, pixel_range)
+            self.wlen = self.apply_wcs_to_pixels(fast_wcs)
         self.wunit = wunit
         #print 'debug - Spectrum init - length counts:', self.counts.size
         #print 'debug - Spectrum init - length pix:', self.pix.size
@@ -256,56 +311,370 @@ class Spectrum:
             self.wunit = self.get_wunit(hdu)
     
     @classmethod
-    def get_counts_array_from_hdu(cls, hdu):
-        return hdu.data
+    def from_array(cls, counts, crval, cdelt, crpix=1., wunit=u.Angstrom,
+                   header=None):
+        """
+        Create a Spectrum from an array and a linear dispersion.
+        
+        The HDU is built in memory; nothing is written to disk.
+        
+        Parameters
+        ----------
+        counts : ndarray
+            1-D pixel values.
+        crval : float
+            Wavelength at the reference pixel.
+        cdelt : float
+            Wavelength step per pixel.
+        crpix : float, optional
+            Reference pixel, 1-based as in the headers.  Default = 1.
+        wunit : Unit, optional
+            The units for the wavelengths.  Default = Angstrom.
+        header : Header, optional
+            Header to copy into the HDU, eg. the header of the 2-D frame.
+            The structure and WCS keywords are not copied.
+        
+        Returns
+        -------
+        Spectrum
+        """
+        from astropy.io import fits
+        
+        hdu = fits.ImageHDU(np.asarray(counts))
+        if header is not None:
+            for card in header.cards:
+                if not STRUCTURE_KEYWORDS.match(card.keyword):
+                    hdu.header.append(card)
+        hdu.header['CTYPE1'] = 'LINEAR'
+        hdu.header['CRVAL1'] = crval
+        hdu.header['CRPIX1'] = crpix
+        hdu.header['CDELT1'] = cdelt
+        hdu.header['CD1_1'] = cdelt
+        hdu.header['WAT0_001'] = 'system=equispec'
+        hdu.header['WAT1_001'] = 'wtype=linear label=Wavelength units=%ss' \
+                                 % wunit.to_string().lower()
+        return cls(hdu, wunit=wunit)
+    
+    @classmethod
+    def from_file(cls, filename, extension=0, wunit=None, fast_wcs=True,
+                  lazy=True):
+        """
+        Create a Spectrum from a memory-mapped FITS file.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the FITS file.
+        extension : int or tuple, optional
+            Extension that contains the spectrum, eg. 0 or ('SCI',1).
+            Default = 0.
+        wunit : Unit, optional
+            The units for the wavelengths.
+        fast_wcs : bool, optional
+            Use the linear dispersion fast path when possible.
+        lazy : bool, optional
+            Defer reading the pixels until they are needed. Default = True.
+        
+        Returns
+        -------
+        Spectrum
+            The file stays open until close() is called.
+        """
+        from astropy.io import fits
+        
+        hdulist = fits.open(filename, memmap=True)
+        spectrum = cls(hdulist[extension], wunit=wunit, fast_wcs=fast_wcs,
+                       lazy=lazy)
+        spectrum.hdulist = hdulist
+        return spectrum
+    
+    def close(self):
+        """
+        Close the file opened by from_file(), if any.
+        """
+        if self.hdulist is not None:
+            self.hdulist.close()
+            self.hdulist = None
+    
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = self.get_counts_array_from_hdu(self.hdu,
+                                                          self.pixel_range)
+        return self._counts
+    
+    @counts.setter
+    def counts(self, counts):
+        self._counts = counts
+    
+    @property
+    def pix(self):
+        if self._pix is None:
+            self._pix = self.get_pixel_array_from_hdu(self.hdu,
+                                                      self.pixel_range)
+        return self._pix
+    
+    @pix.setter
+    def pix(self, pix):
+        self._pix = pix
+    
+    @property
+    def wlen(self):
+        if self._wlen is None:
+            self._wlen = self.apply_wcs_to_pixels(self.fast_wcs)
+        return self._wlen
+    
+    @wlen.setter
+    def wlen(self, wlen):
+        self._wlen = wlen
+    
+    @property
+    def wcs(self):
+        if self._wcs is None:
+            self._wcs = self.get_wcs_from_hdu(self.hdu)
+        return self._wcs
+    
+    @classmethod
+    def get_counts_array_from_hdu(cls, hdu, pixel_range=None):
+        if pixel_range is None:
+            return hdu.data
+        
+        # Use the section interface when available, it reads only the
+        # requested pixels from disk.
+        ndim = hdu.header['NAXIS']
+        slices = (slice(None),) * (ndim - 1) + (slice(*pixel_range),)
+        section = getattr(hdu, 'section', None)
+        if section is not None:
+            return section[slices]
+        return hdu.data[slices]
     
     @classmethod
-    def get_pixel_array_from_hdu(cls, hdu):
-        return np.arange(len(hdu.data))
+    def get_pixel_array_from_hdu(cls, hdu, pixel_range=None):
+        if pixel_range is None:
+            pixel_range = (0, hdu.header['NAXIS1'])
+        return np.arange(*pixel_range)
     
     @classmethod
     def get_wcs_from_hdu(cls, hdu):
         return wcs.WCS(hdu.header.tostring())
     
+    @classmethod
+    def get_linear_dispersion(cls, hdu):
+        """
+        Return the linear dispersion solution from the header, if any.
+        
+        The solution is considered linear if the coordinate type is
+        linear, the IRAF DC-FLAG does not request a log-linear scale, and
+        the IRAF WAT keywords do not describe a multispec solution.
+        
+        Parameters
+        ----------
+        hdu : HDU
+            The FITS extension with the header to inspect.
+        
+        Returns
+        -------
+        tuple of float or None
+            (crval, cdelt, crpix) with crpix 1-based as in the header, or
+            None if the full WCS is required.
+        """
+        header = hdu.header
+        ctype = str(header.get('CTYPE1', '')).strip().upper()
+        if ctype not in LINEAR_CTYPES:
+            return None
+        if header.get('DC-FLAG', 0) not in (0, None):
+            return None
+        for keyword in ('WAT0_001', 'WAT1_001'):
+            if 'multispec' in str(header.get(keyword, '')):
+                return None
+        if 'CRVAL1' not in header:
+            return None
+        
+        if 'CD1_1' in header:
+            cdelt = header['CD1_1']
+        else:
+            cdelt = header.get('CDELT1', 1.) * header.get('PC1_1', 1.)
+        return (float(header['CRVAL1']), float(cdelt),
+                float(header.get('CRPIX1', 0.)))
+    
     @classmethod
     def get_wunit(cls, hdu):
-        unit_str = hdu.header['WAT1_001'].split()[2].split('=')[1]
+        header = getattr(hdu, 'header', hdu)
+        unit_str = header['WAT1_001'].split()[2].split('=')[1]
         if unit_str.endswith('s'):
             unit_str = unit_str[:-1]
         return u.Unit(unit_str)
 
-    def apply_wcs_to_pixels(self):
-        #print 'debug - in apply_wcs_to_pixels:', zip(self.pix)[0:3]
-        return self.wcs.wcs_pix2world(zip(self.pix), 0)
+    @classmethod
+    def get_wunit_from_file(cls, filename, extension=0, cache=None):
+        """
+        Get the wavelength units of a spectrum without opening the file,
+        if its header is in the header cache.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the FITS file.
+        extension : int, str or tuple, optional
+            Extension that contains the spectrum.  Default = 0.
+        cache : headercache.HeaderCache, optional
+            Default is the shared cache, see headercache.get_default_cache().
+        
+        Returns
+        -------
+        Unit
+        """
+        import headercache
+        
+        return cls.get_wunit(headercache.get_header(filename, extension,
+                                                    cache=cache))
     
+    def apply_wcs_to_pixels(self, fast_wcs=True):
+        """
+        Compute the wavelength of each pixel.
+        
+        Parameters
+        ----------
+        fast_wcs : bool, optional
+            If True, use the linear dispersion from the header when
+            possible.  Default = True.
+        
+        Returns
+        -------
+        ndarray
+            1-D array of wavelengths, one per pixel.
+        """
+        dispersion = None
+        if fast_wcs:
+            dispersion = self.get_linear_dispersion(self.hdu)
+        
+        if dispersion is not None:
+            (crval, cdelt, crpix) = dispersion
+            self.wcs_path = 'linear'
+            # pix is 0-based, crpix is 1-based.
+            return crval + cdelt * (self.pix + 1. - crpix)
+        
+        self.wcs_path = 'wcs'
+        return self.wcs.wcs_pix2world(self.pix, 0)[0]
 
-class LineList:
+    def get_pixel_range(self, wmin, wmax):
+        """
+        Find the pixels that cover a wavelength range.
+        
+        Only the two limits are converted to pixels; the full wavelength
+        array is not calculated.
+        
+        Parameters
+        ----------
+        wmin, wmax : float or Quantity
+            Wavelength limits.  Floats are assumed to be in units of wunit.
+        
+        Returns
+        -------
+        tuple of int
+            First pixel and last pixel + 1, clipped to the current
+            pixel_range of the spectrum.
+        """
+        limits = []
+        for wlimit in (wmin, wmax):
+            if isinstance(wlimit, u.Quantity):
+                wlimit = wlimit.to(self.wunit).value
+            limits.append(float(wlimit))
+        
+        dispersion = None
+        if self.fast_wcs:
+            dispersion = self.get_linear_dispersion(self.hdu)
+        if dispersion is not None:
+            (crval, cdelt, crpix) = dispersion
+            pixels = (np.array(limits) - crval) / cdelt + crpix - 1.
+        else:
+            pixels = self.wcs.wcs_world2pix(limits, 0)[0]
+        
+        if self.pixel_range is None:
+            (first, last) = (0, self.hdu.header['NAXIS1'])
+        else:
+            (first, last) = self.pixel_range
+        first = max(first, int(np.floor(pixels.min())))
+        last = min(last, int(np.ceil(pixels.max())) + 1)
+        if last <= first:
+            errmsg = 'Wavelength range [%s, %s] outside the spectrum.' % \
+                (wmin, wmax)
+            raise ValueError(errmsg)
+        return (first, last)
+    
+    def slice_wavelength(self, wmin, wmax):
+        """
+        Return a new Spectrum restricted to a wavelength range.
+        
+        The new Spectrum shares the HDU, and in lazy mode only the pixels
+        in the range are read when the counts are accessed.
+        
+        Parameters
+        ----------
+        wmin, wmax : float or Quantity
+            Wavelength limits.  Floats are assumed to be in units of wunit.
+        
+        Returns
+        -------
+        Spectrum
+        
+        Raises
+        ------
+        ValueError
+            Raised if the range does not overlap the spectrum.
+        """
+        pixel_range = self.get_pixel_range(wmin, wmax)
+        spectrum = Spectrum(self.hdu, wunit=self.wunit,
+                            fast_wcs=self.fast_wcs, lazy=self.lazy,
+                            pixel_range=pixel_range)
+        spectrum._wcs = self._wcs
+        return spectrum
+    
+
+class LineList(object):
     """
-    Create a list of Line objects from a line list defined in LINELIST_DICT.
+    Columnar list of spectral lines defined in LINELIST_DICT.
+    
+    The line names and rest wavelengths are stored in NumPy arrays, with
+    the wavelength unit stored only once.  The redshift is applied to the
+    whole list in a single broadcast operation instead of line by line.
+    Individual Line instances are still available through the "lines"
+    attribute; they are built on request as views of the arrays.
     
     Parameters
     ----------
     name : str
         Name of the line list to retrieve from LINELIST_DICT.
     redshift : float, optional
-        Redshift to apply to the lines.  Note that the redshift is only 
-        stored. To apply it run the method apply_redshift().  Default = 0.
+        Redshift to apply to the lines.  Default = 0.
     
     Attributes
     ----------
     name : str
         Name of the line list to retrieve from LINELIST_DICT.
     redshift : float
-        Redshift to apply to the lines.
+        Redshift to apply to the lines.  If it is changed, run
+        reapply_redshift() to update the observed wavelengths.
+    names : ndarray of str
+        Line identifications.
+    restwlen : ndarray of float
+        Rest wavelengths, in units of wunit.
+    obswlen : ndarray of float
+        Observed wavelengths, in units of wunit, for the current redshift.
+    wunit : Unit
+        Unit of the restwlen and obswlen arrays.
     lines : list of Line
-        List of Line instances.  This is the attribute to access once the 
-        LineList instance has been created.
+        List of Line instances built from the arrays.  Kept for
+        compatibility; use the arrays directly when speed matters.
     
     Methods
     -------
     reapply_redshift()
         If the redshift attribute has been changed, reapply the redshift 
         to the lines.
+    observed_wavelengths(redshifts=None, unit=None)
+        Return the observed wavelengths for one redshift or for a vector
+        of redshifts.
     
     Raises
     ------
@@ -319,33 +688,50 @@ class LineList:
     Examples
     --------
     >>> mylinelist = LineList('quasar')
-    >>> mylinelist.lines
-    [<spectro.Line instance at 0x10339ddd0>, <spectro.Line instance ...
-    <spectro.Line instance at 0x10339d050>, <spectro.Line instance ...
-    <spectro.Line instance at 0x10339fb00>, <spectro.Line instance ...
-    <spectro.Line instance at 0x10339f7e8>, <spectro.Line instance ...]
-    
+    >>> mylinelist.restwlen
+    array([ 0.5876,  1.083 ,  0.6563,  0.9546,  1.005 ,  1.094 ,  1.282 ,
+            1.875 ])
     >>> mylinelist.lines[0].obswlen
     <Quantity 0.5876 micron>
     >>> mylinelist.redshift = 1.
     >>> mylinelist.reapply_redshift()
-    >>> ll.lines[0].obswlen
+    >>> mylinelist.lines[0].obswlen
     <Quantity 1.1752 micron>
+    
+    Scanning a grid of redshifts returns one row per redshift.
+    
+    >>> mylinelist.observed_wavelengths(np.linspace(0., 3., 301)).shape
+    (301, 8)
     """
     
     def __init__(self, name, redshift=0.):
         self.name = name
         self.redshift = redshift
-        self.lines = self._get_lines_from_list()
+        self.wunit = None
+        (self.names, self.restwlen) = self._get_lines_from_list()
+        self.obswlen = None
+        self.reapply_redshift()
+
+    def __len__(self):
+        return self.restwlen.size
+
+    @property
+    def lines(self):
+        """
+        List of Line instances, one per entry in the arrays.
+        """
+        return [Line(restwlen=restwlen * self.wunit, redshift=self.redshift,
+                     name=name)
+                for (name, restwlen) in zip(self.names, self.restwlen)]
 
     def _get_lines_from_list(self, name=None):
         """
-        Load the line list as list of Line instances and apply the redshift.
+        Load the line list as arrays of names and rest wavelengths.
         
         The private method will check that the list's name is valid and 
-        retrieve that list from the line dictionary.  Each line is loaded
-        into a Line instance and the redshift is applied.  The redshift 
-        is taken from the instance's "redshift" attribute.
+        retrieve that list from the line dictionary.  The rest wavelengths
+        are converted to the instance's "wunit" attribute.  If "wunit" is
+        not set yet, the unit of the first line in the list is adopted.
         
         Parameters
         ----------
@@ -355,7 +741,8 @@ class LineList:
         
         Returns
         -------
-        list of Line instances
+        tuple of ndarray
+            The line names and the rest wavelengths, in units of wunit.
         
         Raises
         ------
@@ -365,30 +752,31 @@ class LineList:
         See Also
         --------
         LINELIST_DICT for valid line lists.
-        The Line class.
         """
 
         if name is None:
             name = self.name
         
-        lines = []
         try:
-            for line_data in LINELIST_DICT[name]:
-                line = Line(restwlen=line_data[1], redshift=self.redshift, 
-                            name=line_data[0]) 
-                lines.append(line)
+            line_data = LINELIST_DICT[name]
         except KeyError:
             print 'ERROR: Line list name, "%s", invalid.' % (name)
             print 'ERROR: Valid lists are:', LINELIST_DICT.keys()
             raise
         
-        return lines
+        if self.wunit is None:
+            self.wunit = line_data[0][1].unit
+        names = np.array([line[0] for line in line_data])
+        restwlen = np.array([line[1].to(self.wunit).value 
+                             for line in line_data])
+        
+        return (names, restwlen)
         
     def append_linelist(self, name):
         """
         Append a line list to an existing list.
         
-        A line list is appended to the "lines" attribute.  This is a simmple
+        A line list is appended to the arrays.  This is a simmple
         append; the duplicates are not removed, the combined list is not
         sorted.  The LineList "name" attribute is set to a new string
         formatted as "oldname+newname".
@@ -405,9 +793,11 @@ class LineList:
         """
         # duplicates are not removed.
         # list is not sorted
-        new_lines = self._get_lines_from_list(name)
-        self.lines.extend(new_lines)
+        (new_names, new_restwlen) = self._get_lines_from_list(name)
+        self.names = np.concatenate((self.names, new_names))
+        self.restwlen = np.concatenate((self.restwlen, new_restwlen))
         self.name = '%s+%s' % (self.name, name)
+        self.reapply_redshift()
         
     def reapply_redshift(self):
         """
@@ -422,13 +812,59 @@ class LineList:
         >>> mylinelist.redshift = 1.0
         >>> mylinelist.reapply_redshift()
         """
-        for line in self.lines:
-            line.set_redshift(self.redshift)
-            line.set_obswlen()
+        self.obswlen = (self.redshift + 1) * self.restwlen
+
+    def observed_wavelengths(self, redshifts=None, unit=None):
+        """
+        Return the observed wavelengths for one or many redshifts.
+        
+        The redshifts are broadcast against the rest wavelengths.  A scalar
+        redshift returns a 1-D array with one value per line.  A vector
+        of redshifts returns a 2-D array of shape (n_redshift, n_lines).
+        
+        Parameters
+        ----------
+        redshifts : float or array-like, optional
+            Redshift(s) to apply.  If not specified, use the instance's
+            "redshift" attribute.
+        unit : Unit, optional
+            Unit of the returned wavelengths.  The conversion factor is
+            computed only once for the whole array.  Default is wunit.
+        
+        Returns
+        -------
+        ndarray
+            Observed wavelengths as floats in the requested unit.
+        
+        Examples
+        --------
+        >>> mylinelist = LineList('paschen')
+        >>> mylinelist.observed_wavelengths([0., 1.], unit=u.Angstrom)
+        array([[  9546.,  10050.,  10940.,  12820.,  18750.],
+               [ 19092.,  20100.,  21880.,  25640.,  37500.]])
+        """
+        if redshifts is None:
+            redshifts = self.redshift
+        redshifts = np.asarray(redshifts, dtype=float)
+        obswlen = (redshifts[..., np.newaxis] + 1) * self.restwlen
+        if unit is not None:
+            obswlen *= self.wunit.to(unit)
+        return obswlen
 
 
 # -------------------------------
 
+# Coordinate types for which the dispersion is linear in pixels.
+LINEAR_CTYPES = ('', 'LINEAR', 'WAVE')
+
+# Keywords that describe the data layout and WCS of an HDU.  They are not
+# copied from the header of a 2-D frame to a 1-D spectrum.
+STRUCTURE_KEYWORDS = re.compile(r'^(SIMPLE|EXTEND|XTENSION|BITPIX|NAXIS\d*|'
+                                r'PCOUNT|GCOUNT|EXTNAME|EXTVER|NEXTEND|'
+                                r'CTYPE\d|CRVAL\d|CRPIX\d|CDELT\d|CUNIT\d|'
+                                r'CD\d_\d|LTM\d_\d|LTV\d|WAT\d_\d+|WCSDIM|'
+                                r'DISPAXIS|DC-FLAG|COMMENT|HISTORY|)$')
+
 # pylint: disable=E1101
 #  This disable is to ignore the u.micron errors (dynamic loading)
 LINELIST_DICT = {
@@ -446,6 +882,48 @@ LINELIST_DICT = {
                   ('Pa_gamma', 1.094 * u.micron),
                   ('Pa_beta', 1.282 * u.micron),
                   ('Pa_alpha', 1.875 * u.micron)
+                ],
+    # Ar I arc lamp lines in the F2 range, air wavelengths.
+    'argon' :   [ ('ArI', 9122.97 * u.Angstrom),
+                  ('ArI', 9224.50 * u.Angstrom),
+                  ('ArI', 9354.22 * u.Angstrom),
+                  ('ArI', 9657.78 * u.Angstrom),
+                  ('ArI', 9784.50 * u.Angstrom),
+                  ('ArI', 10470.05 * u.Angstrom),
+                  ('ArI', 11488.11 * u.Angstrom),
+                  ('ArI', 12112.33 * u.Angstrom),
+                  ('ArI', 12139.74 * u.Angstrom),
+                  ('ArI', 12343.39 * u.Angstrom),
+                  ('ArI', 12402.83 * u.Angstrom),
+                  ('ArI', 12439.32 * u.Angstrom),
+                  ('ArI', 12456.12 * u.Angstrom),
+                  ('ArI', 12487.66 * u.Angstrom),
+                  ('ArI', 12802.74 * u.Angstrom),
+                  ('ArI', 12956.66 * u.Angstrom),
+                  ('ArI', 13008.26 * u.Angstrom),
+                  ('ArI', 13213.99 * u.Angstrom),
+                  ('ArI', 13273.07 * u.Angstrom),
+                  ('ArI', 13313.21 * u.Angstrom),
+                  ('ArI', 13367.11 * u.Angstrom),
+                  ('ArI', 13499.41 * u.Angstrom),
+                  ('ArI', 13504.19 * u.Angstrom),
+                  ('ArI', 13599.33 * u.Angstrom),
+                  ('ArI', 13622.66 * u.Angstrom),
+                  ('ArI', 13678.55 * u.Angstrom),
+                  ('ArI', 13718.58 * u.Angstrom),
+                  ('ArI', 14093.64 * u.Angstrom),
+                  ('ArI', 15046.50 * u.Angstrom),
+                  ('ArI', 15172.69 * u.Angstrom),
+                  ('ArI', 15989.49 * u.Angstrom),
+                  ('ArI', 16519.86 * u.Angstrom),
+                  ('ArI', 16940.58 * u.Angstrom),
+                  ('ArI', 20616.23 * u.Angstrom),
+                  ('ArI', 20986.11 * u.Angstrom),
+                  ('ArI', 21332.88 * u.Angstrom),
+                  ('ArI', 21534.20 * u.Angstrom),
+                  ('ArI', 22077.06 * u.Angstrom),
+                  ('ArI', 23133.20 * u.Angstrom),
+                  ('ArI', 23966.52 * u.Angstrom)
                 ]
     }
 
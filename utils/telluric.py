@@ -0,0 +1,315 @@
+# telluric.py
+"""
+Telluric correction of 1-D spectra with a batched shift/scale search.
+
+This replaces the interactive nstelluric step.  The telluric spectrum,
+normalized to its continuum, is first aligned on the science spectrum
+with an FFT cross-correlation.  The shift and the airmass scaling
+(Beer's law: the telluric is raised to the power scale) are then refined
+by evaluating the whole grid of trial shifts and scales in one broadcast,
+and keeping the pair that leaves the least high-frequency structure in
+the corrected science within the chosen wavelength windows.
+
+Trying many telluric candidates, eg. for the targets flagged BADTELLURIC,
+is a loop over correct_with_candidates().
+
+Usage:
+    solution = fit_telluric(science, telluric, windows=[(11000., 11500.)])
+    (corrected, variance) = apply_telluric(science, science_var, telluric,
+                                           solution.shift, solution.scale)
+"""
+
+import numpy as np
+
+class TelluricSolution(object):
+    """
+    Best shift and scale of a telluric, with the grid that was searched.
+    
+    Attributes
+    ----------
+    shift : float
+        Shift of the telluric, in science pixels.  A positive shift moves
+        the telluric features to larger pixels.
+    scale : float
+        Power applied to the telluric.
+    metric : float
+        Residual structure of the corrected science at the best point.
+    xcorr_shift : float
+        Shift found by the cross-correlation alone.
+    shifts, scales : ndarray
+        Trial values.
+    grid : ndarray
+        Metric for every (scale, shift) pair, shape (nscale, nshift).
+    """
+    def __init__(self, shift, scale, metric, xcorr_shift, shifts, scales,
+                 grid):
+        self.shift = shift
+        self.scale = scale
+        self.metric = metric
+        self.xcorr_shift = xcorr_shift
+        self.shifts = shifts
+        self.scales = scales
+        self.grid = grid
+
+
+def resample_telluric(science, telluric):
+    """
+    Interpolate the telluric onto the wavelengths of the science.
+    
+    Parameters
+    ----------
+    science, telluric : spectro.Spectrum
+    
+    Returns
+    -------
+    ndarray
+        Telluric transmission at the science wavelengths, 1 outside the
+        range of the telluric.
+    """
+    factor = telluric.wunit.to(science.wunit)
+    return np.interp(science.wlen, telluric.wlen * factor, telluric.counts,
+                     left=1., right=1.)
+
+def high_pass(values, width=25):
+    """
+    Subtract a running mean, to keep only the narrow features.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    kernel = np.ones(width) / float(width)
+    padded = np.pad(values, width, mode='edge')
+    smooth = np.convolve(padded, kernel, mode='same')[width:-width]
+    return values - smooth
+
+def xcorr_shift(science, telluric, max_shift=10., mask=None):
+    """
+    Shift between two spectra from the peak of their FFT cross-correlation.
+    
+    Parameters
+    ----------
+    science, telluric : ndarray
+        Spectra on the same pixel grid.
+    max_shift : float, optional
+        Largest shift searched, in pixels.  Default = 10.
+    mask : ndarray, optional
+        Boolean, the pixels to use.  Default is all.
+    
+    Returns
+    -------
+    float
+        Sub-pixel shift to apply to the telluric, see shift_spectra().
+    """
+    x = high_pass(science)
+    y = high_pass(telluric)
+    if mask is not None:
+        x = np.where(mask, x, 0.)
+        y = np.where(mask, y, 0.)
+    npix = x.size
+    nfft = 2 * npix
+    correlation = np.fft.irfft(np.fft.rfft(x, nfft) *
+                               np.conj(np.fft.rfft(y, nfft)), nfft)
+    lags = np.concatenate((np.arange(nfft // 2), np.arange(-nfft // 2, 0)))
+    allowed = np.abs(lags) <= max_shift
+    best = np.flatnonzero(allowed)[np.argmax(correlation[allowed])]
+    (left, centre, right) = correlation[[best - 1, best, (best + 1) % nfft]]
+    curvature = left - 2. * centre + right
+    offset = 0.5 * (left - right) / curvature if curvature < 0. else 0.
+    return float(lags[best] + offset)
+
+def shift_spectra(values, shifts, pad=32):
+    """
+    Shift a spectrum by many sub-pixel amounts at once, with the Fourier
+    shift theorem.  The spectrum is padded by reflection to limit the
+    ringing at the edges.
+    
+    Parameters
+    ----------
+    values : ndarray
+        1-D spectrum.
+    shifts : array_like
+        Shifts in pixels.  Positive shifts move the features to larger
+        pixels.
+    pad : int, optional
+        Number of pixels added on each side.  Default = 32.
+    
+    Returns
+    -------
+    ndarray
+        Shape (nshift, npix).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    npix = values.size
+    pad = min(pad, npix - 1)
+    padded = np.pad(values, pad, mode='reflect')
+    freqs = np.fft.rfftfreq(padded.size)
+    shifts = np.asarray(shifts, dtype=np.float64)[:, np.newaxis]
+    phase = np.exp(-2j * np.pi * freqs[np.newaxis, :] * shifts)
+    shifted = np.fft.irfft(np.fft.rfft(padded)[np.newaxis, :] * phase,
+                           padded.size)
+    return shifted[:, pad:pad + npix]
+
+def window_mask(wlen, windows):
+    """
+    Boolean mask of the pixels within any of the wavelength windows.
+    
+    Parameters
+    ----------
+    wlen : ndarray
+        Wavelengths.
+    windows : list of tuple or None
+        (wmin, wmax) pairs.  None selects all the pixels.
+    
+    Returns
+    -------
+    ndarray
+    """
+    if windows is None:
+        return np.ones(wlen.size, dtype=bool)
+    mask = np.zeros(wlen.size, dtype=bool)
+    for (wmin, wmax) in windows:
+        mask |= (wlen >= wmin) & (wlen <= wmax)
+    return mask
+
+def fit_telluric(science, telluric, windows=None, shift_range=1.5,
+                 nshift=31, scales=None, max_shift=10., min_transmission=0.05):
+    """
+    Find the shift and the scale that best correct the science.
+    
+    Every trial telluric T(shift)**scale is computed in one broadcast of
+    shape (nscale, nshift, npix).  The metric is the mean square of the
+    pixel-to-pixel differences of the corrected science, relative to its
+    median, within the windows.
+    
+    Parameters
+    ----------
+    science : spectro.Spectrum
+        Science spectrum.
+    telluric : spectro.Spectrum
+        Telluric transmission, ie. the telluric star divided by its
+        continuum.
+    windows : list of tuple, optional
+        (wmin, wmax) wavelength ranges, in the units of the science,
+        where the residuals are measured.  Default is the whole spectrum.
+    shift_range : float, optional
+        Trial shifts span the cross-correlation shift +/- shift_range
+        pixels.  Default = 1.5.
+    nshift : int, optional
+        Number of trial shifts.  Default = 31.
+    scales : array_like, optional
+        Trial scales.  Default = 0.5 to 2 in steps of 0.025.
+    max_shift : float, optional
+        Largest shift searched by the cross-correlation.  Default = 10.
+    min_transmission : float, optional
+        Pixels where the telluric transmission is lower are not used.
+        Default = 0.05.
+    
+    Returns
+    -------
+    TelluricSolution
+    """
+    if scales is None:
+        scales = np.arange(0.5, 2.0001, 0.025)
+    scales = np.asarray(scales, dtype=np.float64)
+    sci = np.asarray(science.counts, dtype=np.float64)
+    tel = resample_telluric(science, telluric)
+    mask = window_mask(science.wlen, windows)
+    
+    shift0 = xcorr_shift(sci, tel, max_shift, mask)
+    shifts = shift0 + np.linspace(-shift_range, shift_range, nshift)
+    shifted = shift_spectra(tel, shifts)
+    use = mask[np.newaxis, :] & (shifted > min_transmission)
+    logtel = np.log(np.clip(shifted, min_transmission, None))
+    
+    corrected = sci / np.exp(scales[:, np.newaxis, np.newaxis] * logtel)
+    level = np.median(sci[mask]) if mask.any() else np.median(sci)
+    level = abs(level) if level != 0. else 1.
+    steps = np.diff(corrected, axis=-1) / level
+    pairs = (use[:, 1:] & use[:, :-1])[np.newaxis, :, :]
+    npairs = np.maximum(pairs.sum(axis=-1), 1)
+    grid = np.where(pairs, steps**2, 0.).sum(axis=-1) / npairs
+    
+    (iscale, ishift) = np.unravel_index(np.argmin(grid), grid.shape)
+    return TelluricSolution(float(shifts[ishift]), float(scales[iscale]),
+                            float(grid[iscale, ishift]), shift0, shifts,
+                            scales, grid)
+
+def apply_telluric(science, variance, telluric, shift, scale,
+                   min_transmission=0.05):
+    """
+    Divide the science and its variance by the shifted, scaled telluric.
+    
+    Parameters
+    ----------
+    science : spectro.Spectrum
+        Science spectrum.
+    variance : spectro.Spectrum or None
+        Variance of the science.
+    telluric : spectro.Spectrum
+        Telluric transmission.
+    shift, scale : float
+        See fit_telluric().
+    min_transmission : float, optional
+        The transmission is clipped to this value to avoid dividing by
+        zero in the opaque bands.  Default = 0.05.
+    
+    Returns
+    -------
+    tuple
+        (corrected, corrected_variance) as spectro.Spectrum; the
+        variance is None if not given.
+    """
+    from spectro import Spectrum
+    
+    tel = shift_spectra(resample_telluric(science, telluric), [shift])[0]
+    transmission = np.clip(tel, min_transmission, None)**scale
+    (crval, cdelt) = linear_grid(science)
+    phu = science.hdu.header
+    
+    corrected = Spectrum.from_array(science.counts / transmission, crval,
+                                    cdelt, wunit=science.wunit, header=phu)
+    corrected_var = None
+    if variance is not None:
+        corrected_var = Spectrum.from_array(variance.counts /
+                                            transmission**2, crval, cdelt,
+                                            wunit=science.wunit, header=phu)
+    return (corrected, corrected_var)
+
+def linear_grid(spectrum):
+    """
+    (crval, cdelt) of the first pixel of a linearly dispersed spectrum.
+    """
+    wlen = spectrum.wlen
+    return (float(wlen[0]), float(wlen[-1] - wlen[0]) / (wlen.size - 1))
+
+def correct_with_candidates(science, variance, candidates, windows=None,
+                            **kwargs):
+    """
+    Try several telluric candidates and keep the one that leaves the
+    least residual structure.
+    
+    Parameters
+    ----------
+    science : spectro.Spectrum
+        Science spectrum.
+    variance : spectro.Spectrum or None
+        Variance of the science.
+    candidates : list of spectro.Spectrum
+        Telluric transmissions to try.
+    windows : list of tuple, optional
+        See fit_telluric().
+    **kwargs
+        Passed to fit_telluric().
+    
+    Returns
+    -------
+    tuple
+        (index, solution, corrected, corrected_variance) for the best
+        candidate, and the list of all the solutions as a fifth element.
+    """
+    solutions = [fit_telluric(science, telluric, windows, **kwargs)
+                 for telluric in candidates]
+    best = int(np.argmin([solution.metric for solution in solutions]))
+    (corrected, corrected_var) = apply_telluric(science, variance,
+                                                candidates[best],
+                                                solutions[best].shift,
+                                                solutions[best].scale)
+    return (best, solutions[best], corrected, corrected_var, solutions)
@@ -3,6 +3,7 @@ import os.path
 import bookkeeping
 from nose.tools import assert_list_equal
 from nose.tools import assert_dict_equal
+from nose.tools import assert_equal
 from astrodata import AstroData
 
 class TestBookkeeping:
@@ -129,4 +130,102 @@ class TestBookkeeping:
             result.append(dirstruct)
         shutil.rmtree(program)
         assert_list_equal(result, expected_result)   
-        
\ No newline at end of file
+        
+class TestBulk:
+    
+    @classmethod
+    def setup_class(cls):
+        import tempfile
+        import numpy as np
+        from astropy.io import fits
+        
+        TestBulk.rawdir = tempfile.mkdtemp()
+        TestBulk.tablename = os.path.join(TestBulk.rawdir, 'table.txt')
+        # number: (OBJECT, OBSTYPE, OBSCLASS, FILTER1, GRISM, EXPTIME, LNRS)
+        frames = {}
+        for number in range(46, 50):
+            frames[number] = ('SDSSJ0227', 'OBJECT', 'science', 'JH_G0809',
+                             'JH_G5801', 90., 6)
+        frames[51] = frames[50] = ('SDSSJ0227', 'OBJECT', 'science', 
+                                 'JH_G0809', 'JH_G5801', 90., 6)
+        frames[54] = ('GCALflat', 'ARC', 'partnerCal', 'JH_G0809', 
+                     'JH_G5801', 30., 6)
+        frames[55] = ('GCALflat', 'FLAT', 'partnerCal', 'JH_G0809', 
+                     'JH_G5801', 8., 1)
+        frames[60] = ('HIP1234', 'OBJECT', 'partnerCal', 'JH_G0809', 
+                     'JH_G5801', 10., 1)
+        for number in range(217, 220):
+            frames[number] = ('Dark', 'DARK', 'dayCal', 'DK_G0807', 
+                             'Open', 90., 6)
+        TestBulk.frames = frames
+        for number, values in frames.items():
+            header = fits.Header()
+            for (keyword, value) in zip(('OBJECT', 'OBSTYPE', 'OBSCLASS',
+                                         'FILTER1', 'GRISM', 'EXPTIME', 
+                                         'LNRS'), values):
+                header[keyword] = value
+            header['FILTER2'] = 'Open'
+            fits.writeto(os.path.join(TestBulk.rawdir, 
+                                      'S20131002S%04d.fits' % number),
+                         np.zeros((2, 2), dtype=np.float32), header)
+        
+    @classmethod
+    def teardown_class(cls):
+        import shutil
+        shutil.rmtree(TestBulk.rawdir)
+    
+    def test_format_filerange(self):
+        numbers = [210, 211, 212, 215, 217, 218, 223]
+        result = bookkeeping.format_filerange(numbers)
+        assert_equal(result, '210-212,215,217-218,223')
+        assert_list_equal(bookkeeping.parse_filerange(result), numbers)
+    
+    def test_scan_raw_headers(self):
+        frames = bookkeeping.scan_raw_headers(TestBulk.rawdir, nthreads=3)
+        assert_list_equal([frame['number'] for frame in frames],
+                          sorted(TestBulk.frames.keys()))
+        dark = frames[-1]
+        assert_equal(dark['band'], 'dark')
+        assert_equal(dark['grism'], 'Open')
+        assert_equal(dark['rdmode'], 'Faint')
+        assert_equal(frames[0]['band'], 'JH')
+    
+    def test_records_from_runs(self):
+        frames = bookkeeping.scan_raw_headers(TestBulk.rawdir)
+        records = bookkeeping.records_from_runs(
+                                        bookkeeping.group_frames(frames))
+        result = [(record.targetname, record.datatype, record.applyto, 
+                   record.filerange) for record in records]
+        expected_result = [('SDSSJ0227', 'Science', 'None', '46-51'),
+                           ('SDSSJ0227', 'Arc', 'Science,Telluric', '54'),
+                           ('SDSSJ0227', 'Flat', 'Science,Telluric', '55'),
+                           ('SDSSJ0227', 'Telluric', 'Science', '60'),
+                           ('SDSSJ0227', 'Dark', 'Science', '217-219')]
+        assert_list_equal(result, expected_result)
+    
+    def test_mktable_bulk(self):
+        import obstable
+        
+        added = bookkeeping.mktable_bulk(TestBulk.tablename, 
+                                         rawdir=TestBulk.rawdir)
+        assert_equal(len(added), 5)
+        added = bookkeeping.mktable_bulk(TestBulk.tablename, 
+                                         rawdir=TestBulk.rawdir)
+        assert_equal(len(added), 0)
+        table = obstable.ObsTable(TestBulk.tablename)
+        table.read_table(use_sidecar=False)
+        assert_equal(len(table.records), 5)
+        os.remove(TestBulk.tablename)
+    
+    def test_scan_raw_headers_cache(self):
+        import headercache
+        
+        cachename = os.path.join(TestBulk.rawdir, 'cache.sqlite')
+        cache = headercache.HeaderCache(cachename)
+        expected_result = bookkeeping.scan_raw_headers(TestBulk.rawdir)
+        result = bookkeeping.scan_raw_headers(TestBulk.rawdir, cache=cache)
+        result = bookkeeping.scan_raw_headers(TestBulk.rawdir, cache=cache)
+        assert_equal(cache.hits, len(TestBulk.frames))
+        cache.close()
+        os.remove(cachename)
+        assert_list_equal(result, expected_result)
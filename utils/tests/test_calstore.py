@@ -0,0 +1,75 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+from calstore import CalibrationStore, calibration_key
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_not_equal
+from numpy.testing import assert_array_almost_equal
+
+class TestCalibrationStore:
+    
+    @classmethod
+    def setup_class(cls):
+        TestCalibrationStore.tmpdir = tempfile.mkdtemp()
+        TestCalibrationStore.darks = []
+        for number in range(1, 4):
+            filename = os.path.join(TestCalibrationStore.tmpdir, 
+                                    'S20131002S%04d.fits' % number)
+            data = np.full((1, 8, 6), float(number), dtype=np.float32)
+            fits.PrimaryHDU(data).writeto(filename)
+            TestCalibrationStore.darks.append(filename)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestCalibrationStore.tmpdir)
+    
+    def test_key(self):
+        darks = TestCalibrationStore.darks
+        key = calibration_key('dark', darks, {'mode': 'average'})
+        assert_equal(key, calibration_key('dark', 
+                                          ['raw/' + os.path.basename(name)
+                                           for name in reversed(darks)],
+                                          {'mode': 'average'}))
+        assert_not_equal(key, calibration_key('dark', darks, 
+                                              {'mode': 'median'}))
+        assert_not_equal(key, calibration_key('flat', darks, 
+                                              {'mode': 'average'}))
+    
+    def test_make_dark(self):
+        tmpdir = TestCalibrationStore.tmpdir
+        store = CalibrationStore(os.path.join(tmpdir, 'store'))
+        built = []
+        for target in ('targetA', 'targetB'):
+            target_dir = os.path.join(tmpdir, target)
+            os.mkdir(target_dir)
+            path = store.make_dark(TestCalibrationStore.darks, target_dir,
+                                   name='objdark.fits')
+            built.append(path)
+            dark = fits.getdata(os.path.join(target_dir, 'objdark.fits'), 
+                                'SCI')
+            assert_array_almost_equal(dark, np.full((8, 6), 2.))
+        # built once, linked twice.
+        assert_equal(built[0], built[1])
+        assert_true(os.path.islink(os.path.join(tmpdir, 'targetB', 
+                                                'objdark.fits')))
+    
+    def test_build(self):
+        store = CalibrationStore(os.path.join(TestCalibrationStore.tmpdir,
+                                              'store2'))
+        calls = []
+        def write_solution(outdir, filenames, order):
+            calls.append(order)
+            with open(os.path.join(outdir, 'idarc'), 'w') as f:
+                f.write('order %d\n' % order)
+            return ['idarc']
+        assert_true(store.get('arc', ['S0001.fits'], {'order': 4}) is None)
+        products = store.build('arc', ['S0001.fits'], {'order': 4}, 
+                               write_solution)
+        store.build('arc', ['S0001.fits'], {'order': 4}, write_solution)
+        store.build('arc', ['S0001.fits'], {'order': 5}, write_solution)
+        assert_equal(calls, [4, 5])
+        assert_equal(open(products['idarc']).read(), 'order 4\n')
@@ -0,0 +1,136 @@
+import os
+import os.path
+import shutil
+import tempfile
+import warnings
+import numpy as np
+from astropy import units as u
+from astropy.io import fits
+import coadd
+from spectro import Spectrum
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+from numpy.testing import assert_array_almost_equal
+
+def make_night(level, variance, crval=10000., cdelt=5., npix=100):
+    flux = np.full(npix, level)
+    var = np.full(npix, variance)
+    return (Spectrum.from_array(flux, crval, cdelt),
+            Spectrum.from_array(var, crval, cdelt))
+
+class TestCoadd:
+    
+    @classmethod
+    def setup_class(cls):
+        pass
+    
+    @classmethod
+    def teardown_class(cls):
+        pass
+    
+    def setup(self):
+        TestCoadd.tmpdir = tempfile.mkdtemp()
+        TestCoadd.store = coadd.CoaddStore(TestCoadd.tmpdir)
+    
+    def teardown(self):
+        shutil.rmtree(TestCoadd.tmpdir)
+    
+    def test_add_remove(self):
+        store = TestCoadd.store
+        store.add('SDSSJ023318', 'JH', 'S20131027', *make_night(10., 4.))
+        store.add('SDSSJ023318', 'JH', 'S20131225', *make_night(20., 1.))
+        assert_equal(store.targets(), [('SDSSJ023318', 'JH')])
+        
+        # read back from the disk.
+        stack = store.get('SDSSJ023318', 'JH')
+        assert_equal(stack.nights, ['S20131027', 'S20131225'])
+        assert_equal((stack.crval, stack.cdelt, stack.npix),
+                     (10000., 5., 100))
+        (spectrum, variance) = stack.result()
+        # inverse-variance weights 1/4 and 1.
+        assert_array_almost_equal(spectrum.counts, np.full(100, 18.))
+        assert_array_almost_equal(variance.counts, np.full(100, 0.8))
+        assert_array_almost_equal(spectrum.wlen, stack.wavelengths)
+        
+        assert_raises(ValueError, stack.add, 'S20131225', 
+                      *make_night(0., 1.))
+        stack.remove('S20131225')
+        (spectrum, variance) = store.get('SDSSJ023318', 'JH').result()
+        assert_array_almost_equal(spectrum.counts, np.full(100, 10.))
+        assert_array_almost_equal(variance.counts, np.full(100, 4.))
+        assert_raises(ValueError, stack.remove, 'S20131225')
+    
+    def test_resample(self):
+        store = TestCoadd.store
+        (spectrum, variance) = make_night(5., 1.)
+        spectrum.counts = np.linspace(0., 99., 100)
+        stack = store.add('TEST', 'HK', 'S20150827', spectrum, variance)
+        # a night shifted by half a pixel and in microns.
+        (shifted, shifted_var) = make_night(0., 1., crval=1.00025, 
+                                            cdelt=5.e-4)
+        shifted.counts = np.linspace(0., 99., 100) + 0.5
+        shifted.wunit = u.micron
+        shifted_var.wunit = u.micron
+        stack.add('S20150904', shifted, shifted_var, weight=3.)
+        (result, result_var) = stack.result()
+        assert_array_almost_equal(result.counts[1:], np.arange(1., 100.))
+        # only the first night covers the first pixel.
+        assert_equal(result_var.counts[0], 1.)
+        # weights 1 and 3: (1 + 9) / 16.
+        assert_array_almost_equal(result_var.counts[1:], 
+                                  np.full(99, 10. / 16.))
+    
+    def test_remove_partial_overlap(self):
+        # night A covers pixels 0-59, nights B, C and D pixels 50-199.
+        store = TestCoadd.store
+        rng = np.random.RandomState(2)
+        (spectrum, variance) = make_night(1.e-17, 1.e-36, npix=60)
+        spectrum.counts = rng.normal(1.e-17, 1.e-18, 60)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            stack = store.add('TEST', 'JH', 'A', spectrum, variance,
+                              grid=(10000., 5., 200))
+            for night in ('B', 'C', 'D'):
+                (spectrum, variance) = make_night(0., 1., crval=10250., 
+                                                  npix=150)
+                spectrum.counts = rng.normal(1.e-17, 1.e-18, 150)
+                variance.counts = rng.uniform(0.5e-36, 2.e-36, 150)
+                stack.add(night, spectrum, variance)
+        assert_equal(stack.ncontrib[55], 4.)
+        for night in ('B', 'C', 'D'):
+            stack.remove(night)
+        (result, _) = store.get('TEST', 'JH').result()
+        assert_true(np.all(np.isfinite(result.counts[:60])))
+        assert_true(np.all(np.isnan(result.counts[60:])))
+        assert_equal(np.count_nonzero(stack.weight[60:]), 0)
+        assert_equal(np.count_nonzero(stack.ncontrib[60:]), 0)
+    
+    def test_rebuild_and_write(self):
+        store = TestCoadd.store
+        stack = None
+        for (index, night) in enumerate(['S20150827', 'S20150904', 
+                                         'S20150905']):
+            (spectrum, variance) = make_night(float(index), 1. + index)
+            spectrum.counts[index * 10:index * 10 + 5] = np.nan
+            stack = store.add('TEST', 'JH', night, spectrum, variance)
+        expected = (stack.wsum.copy(), stack.weight.copy(), 
+                    stack.vsum.copy(), stack.ncontrib.copy())
+        stack.rebuild()
+        for (plane, accumulator) in zip(expected, (stack.wsum, stack.weight,
+                                                   stack.vsum, 
+                                                   stack.ncontrib)):
+            assert_array_almost_equal(plane, accumulator)
+        assert_true(stack.weight[0] > 0.)
+        assert_equal(stack.ncontrib[0], 2.)
+        
+        filename = os.path.join(TestCoadd.tmpdir, 'coadd.fits')
+        stack.write(filename)
+        hdulist = fits.open(filename)
+        assert_equal(hdulist[0].header['NNIGHTS'], 3)
+        assert_equal(hdulist['SCI'].data.size, 100)
+        hdulist.close()
+        for night in stack.nights:
+            stack.remove(night)
+        assert_equal(np.count_nonzero(stack.weight), 0)
+        assert_true(np.all(np.isnan(stack.result()[0].counts)))
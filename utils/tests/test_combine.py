@@ -0,0 +1,121 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+import combine
+from frames import Frame
+from nose.tools import assert_equal
+from nose.tools import assert_list_equal
+from nose.tools import assert_raises
+from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+class TestCombine:
+    
+    @classmethod
+    def setup_class(cls):
+        TestCombine.tmpdir = tempfile.mkdtemp()
+        TestCombine.filenames = combine.get_filenames('S20131002', '217-221',
+                                                      TestCombine.tmpdir, 'f')
+        np.random.seed(0)
+        TestCombine.sci = np.random.normal(100., 5., (5, 16, 12))
+        TestCombine.var = np.full((5, 16, 12), 25.)
+        TestCombine.dq = np.zeros((5, 16, 12), dtype=np.int16)
+        TestCombine.sci[2, 3, 4] = 1.e5
+        TestCombine.dq[1, 5, 6] = 4
+        TestCombine.dq[:, 7, 8] = [1, 4, 1, 1, 1]
+        for (i, filename) in enumerate(TestCombine.filenames):
+            Frame(TestCombine.sci[i].astype(np.float32), 
+                  TestCombine.var[i].astype(np.float32),
+                  TestCombine.dq[i]).write(filename)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestCombine.tmpdir)
+    
+    def test_get_filenames(self):
+        expected_result = [os.path.join(TestCombine.tmpdir, 
+                                        'fS20131002S%04d.fits' % number)
+                           for number in range(217, 222)]
+        assert_list_equal(TestCombine.filenames, expected_result)
+    
+    def test_combine_block_average(self):
+        (sci, var, dq) = combine.combine_block(TestCombine.sci, 
+                                               TestCombine.var, 
+                                               TestCombine.dq)
+        good = np.delete(TestCombine.sci[:, 5, 6], 1)
+        assert_array_almost_equal(sci[5, 6], good.mean(), decimal=4)
+        assert_array_almost_equal(var[5, 6], 25. / 4)
+        assert_array_almost_equal(var[0, 0], 25. / 5)
+        assert_equal(dq[7, 8], 5)
+        assert_equal(dq[5, 6], 0)
+    
+    def test_combine_block_sigclip(self):
+        (sci, var, dq) = combine.combine_block(TestCombine.sci, 
+                                               TestCombine.var,
+                                               mode='sigclip', nsigma=1.5)
+        good = np.delete(TestCombine.sci[:, 3, 4], 2)
+        assert_array_almost_equal(sci[3, 4], good.mean(), decimal=2)
+    
+    def test_combine_block_median(self):
+        (sci, var, dq) = combine.combine_block(TestCombine.sci, mode='median')
+        assert_array_almost_equal(sci, np.median(TestCombine.sci, axis=0),
+                                  decimal=4)
+        assert_equal(var, None)
+        assert_raises(ValueError, combine.combine_block, TestCombine.sci,
+                      mode='sum')
+    
+    def test_combine_files(self):
+        expected_result = combine.combine_block(TestCombine.sci, 
+                                                TestCombine.var, 
+                                                TestCombine.dq, 
+                                                mode='sigclip')
+        output = os.path.join(TestCombine.tmpdir, 'flatdark.fits')
+        # tiny max_memory to force one block of rows per task.
+        for nprocs in (1, 3):
+            combine.combine_files(TestCombine.filenames, output, 
+                                  mode='sigclip', max_memory=1, 
+                                  nprocs=nprocs)
+            result = Frame.from_file(output, memmap=False)
+            assert_array_almost_equal(result.sci, expected_result[0], 
+                                      decimal=3)
+            assert_array_almost_equal(result.var, expected_result[1])
+            assert_array_equal(result.dq, expected_result[2])
+            assert_equal(result.phu['NCOMBINE'], 5)
+    
+    def test_shift_and_combine(self):
+        np.random.seed(3)
+        (nrows, ncols) = (64, 40)
+        columns = np.arange(ncols)
+        frames = []
+        for (position, centre) in zip('ABBA', (12.3, 27.6, 27.6, 12.3)):
+            other = 27.6 if position == 'A' else 12.3
+            profile = np.exp(-0.5 * ((columns - centre) / 1.5)**2) - \
+                      np.exp(-0.5 * ((columns - other) / 1.5)**2)
+            sci = 100. * np.tile(profile, (nrows, 1)) + \
+                  np.random.normal(0., 1., (nrows, ncols))
+            frames.append(Frame(sci.astype(np.float32), 
+                                np.ones((nrows, ncols), dtype=np.float32)))
+        frames[1].sci[10, 20] = 1.e4
+        
+        profiles = [combine.spatial_profile(frame.sci) for frame in frames]
+        offsets = combine.measure_offsets(profiles)
+        assert_array_almost_equal(offsets, [0., -15.3, -15.3, 0.], 
+                                  decimal=1)
+        
+        combined = combine.shift_and_combine(frames, mode='sigclip', 
+                                             max_memory=1e5, nprocs=2)
+        assert_equal(combined.shape, (nrows, ncols))
+        peak = combined.sci[:, 10:15].mean(axis=0)
+        assert_true(np.argmax(peak) == 2)
+        assert_true(np.median(combined.var[:, 5:20]) < 0.5)
+        assert_true(not combined.dq.any())
+        
+        median = combine.shift_and_combine(frames, mode='median', nprocs=1)
+        # the cosmic ray is rejected.
+        assert_true(np.abs(median.sci[10, 4:6]).max() < 10.)
+        serial = combine.shift_and_combine(frames, mode='sigclip', 
+                                           nprocs=1)
+        assert_array_almost_equal(serial.sci, combined.sci)
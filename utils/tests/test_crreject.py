@@ -0,0 +1,71 @@
+import numpy as np
+import crreject
+import obstable
+from frames import Frame, DQ_BAD, DQ_COSMIC
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+
+class TestCRReject:
+    
+    @classmethod
+    def setup_class(cls):
+        np.random.seed(1)
+        (nrows, ncols) = (300, 120)
+        (rows, columns) = np.mgrid[:nrows, :ncols]
+        # sky, a trace and emission lines, all resolved.
+        model = 1000. + 3000. * np.exp(-0.5 * ((columns - 60.) / 1.5)**2)
+        for (row, column) in np.random.uniform(10., 110., (10, 2)):
+            model += 2000. * np.exp(-0.5 * (((rows - 2.5 * row) / 1.5)**2 +
+                                            ((columns - column) / 1.5)**2))
+        TestCRReject.model = model
+        TestCRReject.var = model / 4.44 + 1.
+        TestCRReject.hits = (np.random.randint(0, nrows, 30), 
+                             np.random.randint(0, ncols, 30))
+    
+    def make_frame(self, seed, hot=None):
+        random = np.random.RandomState(seed)
+        sci = TestCRReject.model + random.normal(0., 
+                                                 np.sqrt(TestCRReject.var))
+        hits = (random.randint(0, sci.shape[0], 30), 
+                random.randint(0, sci.shape[1], 30))
+        sci[hits] += random.uniform(300., 5000., 30)
+        if hot is not None:
+            sci[hot] += 3000.
+        return (Frame(sci.astype(np.float32), 
+                      TestCRReject.var.astype(np.float32)), hits)
+    
+    def test_get_parameters(self):
+        record = obstable.ObsRecord(rdmode='Faint')
+        parameters = crreject.get_parameters(record, sigclip=7.)
+        assert_equal(parameters['sigclip'], 7.)
+        assert_equal(parameters['readnoise'], 5.0)
+        assert_raises(ValueError, crreject.get_parameters, 'slow')
+    
+    def test_clean_frame(self):
+        (frame, hits) = self.make_frame(2)
+        (cleaned, mask) = crreject.clean_frame(frame, 'faint', tile=64, 
+                                               nthreads=2)
+        assert_true(mask[hits].mean() > 0.9)
+        # nothing flagged on the trace and the lines, away from the hits.
+        near = np.zeros(mask.shape, dtype=bool)
+        for (drow, dcolumn) in np.ndindex(3, 3):
+            near[np.clip(hits[0] + drow - 1, 0, mask.shape[0] - 1),
+                 np.clip(hits[1] + dcolumn - 1, 0, mask.shape[1] - 1)] = True
+        structure = (TestCRReject.model > 1300.) & ~near
+        assert_true(not (mask & structure).any())
+        assert_true(((cleaned.dq & DQ_COSMIC) != 0).sum() == mask.sum())
+        assert_equal(cleaned.phu['NCOSMIC'], mask.sum())
+        assert_true(frame.dq is None)
+        # the tiles give the same result as the whole frame.
+        (_, whole) = crreject.clean_frame(frame, 'faint', tile=1000)
+        assert_true((whole == mask).all())
+    
+    def test_hot_pixels(self):
+        hot = (np.array([20, 150]), np.array([30, 90]))
+        frames = [self.make_frame(seed, hot)[0] for seed in range(3, 7)]
+        (masks, found) = crreject.clean_frames(frames, 'bright')
+        assert_true(found[hot].all())
+        for (frame, mask) in zip(frames, masks):
+            assert_true((frame.dq[hot] == DQ_BAD).all())
+            assert_true(not mask[hot].any())
@@ -0,0 +1,133 @@
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import dag
+import obstable
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+
+def make_record(targetname, datatype, applyto, filerange, exptime, band='HK'):
+    return obstable.ObsRecord(targetname=targetname, rootname='S20131002',
+                              band=band, grism='HK', datatype=datatype,
+                              applyto=applyto, filerange=filerange,
+                              exptime=exptime, lnrs=1, rdmode='bright')
+
+class TestDag:
+    
+    @classmethod
+    def setup_class(cls):
+        TestDag.tmpdir = tempfile.mkdtemp()
+        records = []
+        for (target, offset) in (('SDSSA', 0), ('SDSSB', 100)):
+            records += [
+                make_record(target, 'Science', 'None', '%d-%d' % 
+                            (10 + offset, 13 + offset), 90),
+                make_record(target, 'Telluric', 'Science', '%d' % 
+                            (20 + offset), 10),
+                make_record(target, 'Flat', 'Science,Telluric', '%d' % 
+                            (30 + offset), 4),
+                make_record(target, 'Arc', 'Science,Telluric', '%d' % 
+                            (40 + offset), 90),
+                make_record(target, 'Dark', 'Science,Arc', '%d' % 
+                            (50 + offset), 90),
+                make_record(target, 'Dark', 'Flat', '%d' % (60 + offset), 4),
+                make_record(target, 'Dark', 'Telluric', '%d' % 
+                            (70 + offset), 10)]
+        TestDag.table = obstable.ObsTable(records=records)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestDag.tmpdir)
+    
+    def make_steps(self, calls):
+        lock = threading.Lock()
+        def step(record, inputs, **parameters):
+            with lock:
+                calls.append((record.datatype, record.targetname))
+            return '%s_%s' % (record.datatype, record.filerange)
+        return dict((stage, step) for stage in dag.STAGES)
+    
+    def test_build_graph(self):
+        graph = dag.build_graph(TestDag.table, self.make_steps([]))
+        assert_equal(len(graph.nodes), 16)
+        science = graph.nodes['science:SDSSA:S20131002:10-13']
+        assert_equal(sorted(science.depends), 
+                     ['arc:SDSSA:S20131002:40', 'dark:SDSSA:S20131002:50',
+                      'flat:SDSSA:S20131002:30'])
+        telluric = graph.nodes['telluric:SDSSB:S20131002:120']
+        assert_true('dark:SDSSB:S20131002:170' in telluric.depends)
+        order = graph.order()
+        assert_true(order.index('flat:SDSSA:S20131002:30') < 
+                    order.index('arc:SDSSA:S20131002:40'))
+        assert_true(order.index('science:SDSSA:S20131002:10-13') < 
+                    order.index('tellcorr:SDSSA:S20131002:10-13'))
+    
+    def test_incremental(self):
+        state_file = os.path.join(TestDag.tmpdir, 'state.json')
+        calls = []
+        steps = self.make_steps(calls)
+        graph = dag.build_graph(TestDag.table, steps)
+        report = graph.run(state_file, nworkers=3)
+        assert_equal(len(report['ran']), 16)
+        assert_equal(report['results']['tellcorr:SDSSA:S20131002:10-13'],
+                     'Science_10-13')
+        
+        # nothing to do.
+        del calls[:]
+        report = dag.build_graph(TestDag.table, steps).run(state_file)
+        assert_equal(calls, [])
+        assert_equal(len(report['uptodate']), 16)
+        
+        # a new flat order redoes the flats and what depends on them.
+        graph = dag.build_graph(TestDag.table, steps, 
+                                parameters={'flat': {'order': 40}})
+        report = graph.run(state_file, nworkers=2)
+        assert_equal(sorted(set(datatype for (datatype, _) in calls)),
+                     ['Arc', 'Flat', 'Science', 'Telluric'])
+        assert_equal(len(report['ran']), 10)
+    
+    def test_failure(self):
+        calls = []
+        steps = self.make_steps(calls)
+        def broken(record, inputs):
+            if record.targetname == 'SDSSA':
+                raise RuntimeError('bad arc')
+            return 'arc'
+        steps['arc'] = broken
+        report = dag.build_graph(TestDag.table, steps).run(nworkers=2)
+        assert_equal(list(report['failed']), ['arc:SDSSA:S20131002:40'])
+        assert_equal(sorted(report['skipped']), 
+                     ['science:SDSSA:S20131002:10-13',
+                      'tellcorr:SDSSA:S20131002:10-13',
+                      'telluric:SDSSA:S20131002:20'])
+        assert_true('tellcorr:SDSSB:S20131002:110-113' in report['ran'])
+    
+    def test_unserializable(self):
+        calls = []
+        steps = self.make_steps(calls)
+        steps['dark'] = lambda record, inputs: object()
+        graph = dag.build_graph(TestDag.table, steps)
+        state_file = os.path.join(TestDag.tmpdir, 'unserializable.json')
+        reports = []
+        thread = threading.Thread(target=lambda: reports.append(
+            graph.run(state_file=state_file, nworkers=2)))
+        thread.daemon = True
+        thread.start()
+        thread.join(30.)
+        assert_true(not thread.is_alive())
+        report = reports[0]
+        assert_equal(len(report['failed']), 6)
+        assert_true(all(name.startswith('dark:') for name in report['failed']))
+        assert_true(all(isinstance(error, TypeError) 
+                        for error in report['failed'].values()))
+        assert_equal(report['ran'], [])
+        assert_true(os.path.exists(state_file))
+    
+    def test_cycle(self):
+        graph = dag.Graph()
+        graph.add(dag.Node('a', 'dark', None, None, depends=['b']))
+        graph.add(dag.Node('b', 'dark', None, None, depends=['a']))
+        assert_raises(ValueError, graph.order)
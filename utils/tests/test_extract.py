@@ -0,0 +1,84 @@
+import numpy as np
+import extract
+from frames import Frame
+from astropy import units as u
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_almost_equal
+from numpy.testing import assert_array_almost_equal
+
+class TestExtract:
+    
+    @classmethod
+    def setup_class(cls):
+        np.random.seed(5)
+        (nrows, ncols) = (400, 60)
+        rows = np.arange(nrows)[:, np.newaxis]
+        columns = np.arange(ncols)[np.newaxis, :]
+        TestExtract.trace = 30.3 + 0.005 * (rows[:, 0] - 200.)
+        TestExtract.flux = 1000. * (1. + 0.3 * np.sin(rows[:, 0] / 30.))
+        profile = np.exp(-0.5 * ((columns - TestExtract.trace[:, np.newaxis])
+                                 / 1.5)**2)
+        profile /= profile.sum(axis=1, keepdims=True)
+        TestExtract.profile = profile
+        model = TestExtract.flux[:, np.newaxis] * profile
+        TestExtract.var = np.abs(model) + 100.
+        TestExtract.data = model + np.random.normal(0., 
+                                                    np.sqrt(TestExtract.var))
+        TestExtract.data[100, 31] += 5000.
+    
+    def test_find_trace(self):
+        centre = extract.find_trace(TestExtract.data)
+        assert_almost_equal(centre, 30.3, places=0)
+        assert_almost_equal(extract.find_trace(-TestExtract.data, sign=-1), 
+                            centre)
+    
+    def test_trace_along_dispersion(self):
+        trace = extract.trace_along_dispersion(TestExtract.data, 30., 
+                                               block=50)
+        assert_true(np.abs(trace - TestExtract.trace).max() < 0.2)
+    
+    def test_extract(self):
+        result = extract.extract(TestExtract.data, TestExtract.var)
+        pull = (result.flux - TestExtract.flux) / np.sqrt(result.var)
+        assert_true(np.abs(pull).max() < 5.)
+        assert_true(0.7 < np.std(pull) < 1.3)
+        # the cosmic ray is rejected.
+        assert_true(not result.mask[100, 31])
+        # better than the sum over the aperture.
+        aperture = extract.aperture_mask(TestExtract.data.shape, 
+                                         result.trace, 6.)
+        box_var = np.where(aperture, TestExtract.var, 0.).sum(axis=1)
+        assert_true(np.median(result.var) < np.median(box_var))
+    
+    def test_optimal_extract_mask(self):
+        good = np.ones(TestExtract.data.shape, dtype=bool)
+        for niter in (0, 1):
+            (flux, var, mask) = extract.optimal_extract(
+                TestExtract.data, TestExtract.var, TestExtract.profile, 
+                good, niter=niter)
+            # the result is the extraction with the returned mask.
+            (flux0, var0, mask0) = extract.optimal_extract(
+                TestExtract.data, TestExtract.var, TestExtract.profile, 
+                mask, niter=0)
+            assert_array_almost_equal(flux, flux0)
+            assert_array_almost_equal(var, var0)
+            assert_true((mask == mask0).all())
+            assert_equal(mask[100, 31], niter == 0)
+    
+    def test_extract_spectrum(self):
+        header = {'CRVAL2': 9000., 'CD2_2': 6.5, 'CRPIX2': 1., 
+                  'DISPAXIS': 2, 
+                  'WAT2_001': 'wtype=linear label=Wavelength units=angstroms'}
+        frame = Frame(TestExtract.data.T, TestExtract.var.T)
+        for (keyword, value) in header.items():
+            frame.header[keyword] = value
+        frame.header['DISPAXIS'] = 1
+        frame.header['CRVAL1'] = 9000.
+        frame.header['CD1_1'] = 6.5
+        frame.header['WAT1_001'] = header['WAT2_001']
+        (spectrum, variance, result) = extract.extract_spectrum(frame)
+        assert_equal(spectrum.counts.size, 400)
+        assert_equal(spectrum.wunit, u.Angstrom)
+        assert_array_almost_equal(spectrum.wlen[:2], [9000., 9006.5])
+        assert_array_almost_equal(variance.counts, result.var)
@@ -0,0 +1,75 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+import flatnorm
+from frames import Frame, read_bpm
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+class TestFlatNorm:
+    
+    @classmethod
+    def setup_class(cls):
+        TestFlatNorm.tmpdir = tempfile.mkdtemp()
+        np.random.seed(2)
+        y = np.linspace(0., 1., 400)[:, np.newaxis]
+        lamp = 1000. * (1. + 0.5 * np.sin(6. * y)) * np.ones((1, 50))
+        TestFlatNorm.response = np.random.normal(1., 0.01, (400, 50))
+        sci = lamp * TestFlatNorm.response
+        # unilluminated columns and a dead pixel.
+        sci[:, :10] = np.random.normal(0., 5., (400, 10))
+        sci[200, 30] = 10.
+        TestFlatNorm.flat = Frame(sci.astype(np.float32), 
+                                  np.full(sci.shape, 1000., dtype=np.float32))
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestFlatNorm.tmpdir)
+    
+    def test_select_order(self):
+        flat = TestFlatNorm.flat
+        data = np.asarray(flat.sci[:, 10:], dtype=np.float64)
+        (order, errors) = flatnorm.select_order(data, np.ones(data.shape, 
+                                                              dtype=bool),
+                                                orders=(1, 2, 10, 15))
+        assert_equal(len(errors), 4)
+        assert_true(order >= 10)
+        assert_true(errors[0] > errors[2])
+    
+    def test_normalize_flat(self):
+        (normflat, bpm, order) = flatnorm.normalize_flat(TestFlatNorm.flat,
+                                                         orders=(5, 10, 15))
+        assert_true(bpm[:, :10].all())
+        assert_true(bpm[200, 30])
+        assert_equal(np.count_nonzero(bpm[:, 10:]), 1)
+        assert_array_equal(normflat.sci[bpm], 1.)
+        good = ~bpm
+        good[:, :10] = False
+        assert_array_almost_equal(normflat.sci[good], 
+                                  TestFlatNorm.response[good], decimal=2)
+        assert_equal(normflat.phu['FLATORDR'], order)
+    
+    def test_normalize_flat_dispaxis(self):
+        flat = TestFlatNorm.flat
+        transposed = Frame(flat.sci.T, flat.var.T)
+        (normflat, bpm, order) = flatnorm.normalize_flat(flat, order=10)
+        (result, result_bpm, order) = flatnorm.normalize_flat(transposed, 
+                                                              order=10, 
+                                                              dispaxis=1)
+        assert_array_equal(result_bpm, bpm.T)
+        assert_array_almost_equal(result.sci, normflat.sci.T)
+    
+    def test_make_flat(self):
+        filename = os.path.join(TestFlatNorm.tmpdir, 'cdfS20131002S0055.fits')
+        flatfile = os.path.join(TestFlatNorm.tmpdir, 'flat.fits')
+        bpmfile = os.path.join(TestFlatNorm.tmpdir, 'f2_ls_bpm.fits')
+        TestFlatNorm.flat.write(filename)
+        (normflat, bpm, order) = flatnorm.make_flat([filename], flatfile, 
+                                                    bpmfile, order=10)
+        assert_array_equal(read_bpm(bpmfile), bpm)
+        result = Frame.from_file(flatfile, memmap=False)
+        assert_array_equal(result.dq != 0, bpm)
@@ -0,0 +1,72 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+from frames import Frame, write_bpm, read_bpm
+from frames import subtract_frames, divide_frames, DQ_BAD
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from numpy.testing import assert_array_equal
+
+class TestFrame:
+    
+    @classmethod
+    def setup_class(cls):
+        TestFrame.tmpdir = tempfile.mkdtemp()
+        TestFrame.rawfile = os.path.join(TestFrame.tmpdir, 'raw.fits')
+        phu = fits.PrimaryHDU(np.arange(12, dtype=np.int32).reshape(1, 3, 4))
+        phu.header['OBJECT'] = 'Dark'
+        phu.writeto(TestFrame.rawfile)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestFrame.tmpdir)
+    
+    def test_from_raw_file(self):
+        frame = Frame.from_file(TestFrame.rawfile)
+        assert_equal(frame.shape, (3, 4))
+        assert_equal(frame.phu['OBJECT'], 'Dark')
+        assert_true(frame.var is None and frame.dq is None)
+        frame.close()
+    
+    def test_write(self):
+        filename = os.path.join(TestFrame.tmpdir, 'prepared.fits')
+        frame = Frame.from_file(TestFrame.rawfile, memmap=False)
+        frame.var = np.ones(frame.shape, dtype=np.float32)
+        frame.dq = np.zeros(frame.shape, dtype=np.int16)
+        frame.write(filename)
+        hdulist = fits.open(filename)
+        assert_equal([hdu.name for hdu in hdulist], 
+                     ['PRIMARY', 'SCI', 'VAR', 'DQ'])
+        assert_equal(hdulist[0].header['NEXTEND'], 3)
+        hdulist.close()
+        result = Frame.from_file(filename)
+        assert_array_equal(result.sci, frame.sci)
+        assert_array_equal(result.var, frame.var)
+        result.close()
+    
+    def test_bpm(self):
+        filename = os.path.join(TestFrame.tmpdir, 'bpm.fits')
+        mask = np.zeros((5, 13), dtype=bool)
+        mask[0, 0] = mask[2, 12] = mask[4, 7] = True
+        write_bpm(filename, mask)
+        assert_equal(fits.getdata(filename).shape, (5, 2))
+        assert_array_equal(read_bpm(filename), mask)
+    
+    def test_arithmetic(self):
+        frame = Frame(np.full((2, 2), 10., dtype=np.float32),
+                      np.full((2, 2), 4., dtype=np.float32),
+                      np.array([[0, 2], [0, 0]], dtype=np.int16))
+        other = Frame(np.array([[2., 0.], [5., 1.]], dtype=np.float32),
+                      np.ones((2, 2), dtype=np.float32))
+        difference = subtract_frames(frame, other)
+        assert_array_equal(difference.sci, [[8., 10.], [5., 9.]])
+        assert_array_equal(difference.var, np.full((2, 2), 5.))
+        assert_array_equal(difference.dq, frame.dq)
+        ratio = divide_frames(frame, other)
+        assert_array_equal(ratio.sci, [[5., 0.], [2., 10.]])
+        # 4/4 + 25*1/4
+        assert_true(abs(ratio.var[0, 0] - 7.25) < 1e-6)
+        assert_array_equal(ratio.dq, [[0, 2 | DQ_BAD], [0, 0]])
@@ -0,0 +1,82 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+import headercache
+from nose.tools import assert_equal
+from nose.tools import assert_raises
+
+class TestHeaderCache:
+    
+    @classmethod
+    def setup_class(cls):
+        TestHeaderCache.tmpdir = tempfile.mkdtemp()
+        TestHeaderCache.filenames = []
+        for number in range(5):
+            filename = os.path.join(TestHeaderCache.tmpdir, 
+                                    'S20131002S%04d.fits' % number)
+            phu = fits.PrimaryHDU()
+            phu.header['OBJECT'] = 'target%d' % number
+            sci = fits.ImageHDU(np.zeros((2, 2)), name='SCI')
+            sci.header['EXTVER'] = 1
+            sci.header['GAIN'] = 4.44
+            fits.HDUList([phu, sci]).writeto(filename)
+            TestHeaderCache.filenames.append(filename)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestHeaderCache.tmpdir)
+    
+    def setup(self):
+        self.cachename = os.path.join(TestHeaderCache.tmpdir, 'cache.sqlite')
+        self.cache = headercache.HeaderCache(self.cachename)
+    
+    def teardown(self):
+        self.cache.close()
+        os.remove(self.cachename)
+    
+    def test_get_header(self):
+        filename = TestHeaderCache.filenames[0]
+        header = self.cache.get_header(filename)
+        assert_equal(header['OBJECT'], 'target0')
+        header = self.cache.get_header(filename, ('SCI', 1))
+        assert_equal(header['GAIN'], 4.44)
+        header = self.cache.get_header(filename, 'SCI')
+        assert_equal(header['GAIN'], 4.44)
+        assert_equal((self.cache.hits, self.cache.misses), (2, 1))
+        assert_raises(KeyError, self.cache.get_header, filename, 'VAR')
+    
+    def test_prefill(self):
+        nread = self.cache.prefill(TestHeaderCache.tmpdir, 'S*.fits')
+        assert_equal(nread, 5)
+        nread = self.cache.prefill(TestHeaderCache.tmpdir, 'S*.fits')
+        assert_equal(nread, 0)
+        self.cache.close()
+        self.cache = headercache.HeaderCache(self.cachename)
+        headers = self.cache.get_headers(TestHeaderCache.filenames)
+        assert_equal([header['OBJECT'] for header in headers], 
+                     ['target%d' % number for number in range(5)])
+        assert_equal(self.cache.misses, 0)
+    
+    def test_modified_file(self):
+        filename = os.path.join(TestHeaderCache.tmpdir, 'modified.fits')
+        shutil.copy(TestHeaderCache.filenames[0], filename)
+        self.cache.get_header(filename)
+        fits.setval(filename, 'OBJECT', value='changed')
+        os.utime(filename, (0, 12345))
+        header = self.cache.get_header(filename)
+        assert_equal(header['OBJECT'], 'changed')
+        assert_equal(self.cache.misses, 2)
+        os.remove(filename)
+    
+    def test_evict(self):
+        self.cache.maxentries = 3
+        for filename in TestHeaderCache.filenames:
+            self.cache.get_header(filename)
+        assert_equal(len(self.cache), 3)
+        # the last three are kept.
+        misses = self.cache.misses
+        self.cache.get_headers(TestHeaderCache.filenames[2:])
+        assert_equal(self.cache.misses, misses)
@@ -98,8 +98,52 @@ class TestObsTable():
         result.append(TestObsTable.obstable.records)
         assert_list_equal(result, expected_result)
     
-    def test_select_records_from_table(self):
-        pass
+    def test_select_records_from_table1(self):
+        # compound criteria, with applyto matching one of several types
+        sci = obstable.ObsRecord('SDSSJ000429.46-002142.8', 'S20130719', 'HK',
+                                 'HK', 'Science', 'None', '496-499', 90, 6,
+                                 'faint')
+        dark = obstable.ObsRecord('SDSSJ000429.46-002142.8', 'S20130719', 'HK',
+                                  'HK', 'Dark', 'Science,Arc', '592-595', 90,
+                                  6, 'faint')
+        flatdark = obstable.ObsRecord('SDSSJ000429.46-002142.8', 'S20130719',
+                                      'HK', 'HK', 'Dark', 'Flat', '588-591',
+                                      4, 1, 'bright')
+        TestObsTable.obstable.add_records_to_table([sci, dark, flatdark])
+        criteria = {'targetname': sci.targetname,
+                    'datatype': 'Dark',
+                    'applyto': ['Science', 'contains'],
+                    'exptime': sci.exptime,
+                    'LNRS': sci.lnrs,
+                    'rdmode': sci.rdmode}
+        result = TestObsTable.obstable.select_records_from_table(criteria)
+        assert_list_equal(result, [dark])
+    
+    def test_select_records_from_table2(self):
+        # contains on a string column, equals is the default
+        other = obstable.ObsRecord('SDSSJ011758.83+002021.4', 'S20131015', 'JH',
+                                   'JH', 'Science', 'None', '38-41', 90, 6,
+                                   'faint')
+        TestObsTable.obstable.add_records_to_table([TestObsTable.obsrecord,
+                                                    other])
+        result = TestObsTable.obstable.select_records_from_table(
+                        {'targetname': ['SDSSJ0117', 'contains']})
+        assert_list_equal(result, [other])
+        result = TestObsTable.obstable.select_records_from_table(
+                        {'band': 'HK', 'datatype': 'Science'})
+        assert_list_equal(result, [TestObsTable.obsrecord])
+    
+    def test_select_records_from_table3(self):
+        # indexes are rebuilt when the table is read from disk
+        TestObsTable.obstable.add_records_to_table(TestObsTable.obsrecord)
+        TestObsTable.obstable.filename = TestObsTable.filename
+        TestObsTable.obstable.read_table()
+        result = TestObsTable.obstable.select_records_from_table(
+                        {'rootname': 'S20130719'})
+        assert_equal(len(result), 2)
+        assert_raises(ValueError,
+                      TestObsTable.obstable.select_records_from_table,
+                      {'exptime': [90., 'contains']})
     
     def test_print_table(self):
         import sys
@@ -157,8 +201,65 @@ class TestObsTable():
         assert_multi_line_equal(result, expected_result)
     
     
+    def test_write_table_pretty(self):
+        # single pass fixed-width output, readable by read_table
+        import os
+        expected_result = "             Targetname   rootname  band  grism  datatype  applyto  filerange  exptime  LNRS  rdmode\n" + \
+                          "SDSSJ000429.46-002142.8  S20130719    HK     HK   Science     None    496-499     90.0     6   faint\n"
+        TestObsTable.obstable.add_records_to_table(TestObsTable.obsrecord)
+        TestObsTable.obstable.write_table('testtable2.dat', pretty=True)
+        result = open('testtable2.dat', 'r').read()
+        table = obstable.ObsTable(filename='testtable2.dat')
+        os.remove('testtable2.dat')
+        assert_multi_line_equal(result, expected_result)
+        assert_list_equal(table.records, [TestObsTable.obsrecord])
+    
     def test_append_table(self):
-        pass
+        # append to both formats without rewriting
+        import os
+        dark = obstable.ObsRecord('SDSSJ000429.46-002142.8', 'S20130719', 'HK',
+                                  'HK', 'Dark', 'Science,Arc', '592-595', 90,
+                                  6, 'faint')
+        TestObsTable.obstable.add_records_to_table(TestObsTable.obsrecord)
+        for pretty in (False, True):
+            TestObsTable.obstable.write_table('testtable2.dat', pretty=pretty)
+            TestObsTable.obstable.append_records(dark, 'testtable2.dat')
+            table = obstable.ObsTable(filename='testtable2.dat')
+            assert_list_equal(table.records, TestObsTable.obstable.records)
+        lines = open('testtable2.dat', 'r').read().splitlines()
+        os.remove('testtable2.dat')
+        assert_equal(len(lines[-1]), len(lines[0]))
+    
+    def test_append_table_wide(self):
+        # a field wider than its column re-pads the whole file
+        import os
+        dark = obstable.ObsRecord('SDSSJ000429.46-002142.8', 'S20130719', 'HK',
+                                  'HK', 'Dark', 'Science,Telluric,Arc', 
+                                  '1592-1595', 90, 6, 'faint')
+        table = obstable.ObsTable(records=[TestObsTable.obsrecord])
+        table.write_table('testtable2.dat', pretty=True)
+        # the rows on disk need not be in memory
+        obstable.ObsTable().append_records(dark, 'testtable2.dat')
+        lines = open('testtable2.dat', 'r').read().splitlines()
+        table = obstable.ObsTable(filename='testtable2.dat')
+        os.remove('testtable2.dat')
+        assert_equal(len(lines), 3)
+        assert_equal(len(set([len(line) for line in lines])), 1)
+        assert_equal(lines[0].index('applyto') + len('applyto'), 
+                     lines[2].index('Science,Telluric,Arc') + 
+                     len('Science,Telluric,Arc'))
+        assert_list_equal(table.records, [TestObsTable.obsrecord, dark])
+    
+    def test_sidecar(self):
+        import os
+        TestObsTable.obstable.filename = TestObsTable.filename
+        TestObsTable.obstable.read_table()
+        TestObsTable.obstable.write_sidecar()
+        columns = obstable.read_sidecar(TestObsTable.filename)
+        table = obstable.ObsTable(filename=TestObsTable.filename)
+        os.remove(obstable.get_sidecar_name(TestObsTable.filename))
+        assert_list_equal(list(columns['filerange']), ['496-499', '496-499'])
+        assert_list_equal(table.records, TestObsTable.obstable.records)
 
     
     
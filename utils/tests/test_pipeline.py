@@ -0,0 +1,75 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+from frames import Frame
+from pipeline import Pipeline
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
+
+class TestPipeline:
+    
+    @classmethod
+    def setup_class(cls):
+        TestPipeline.tmpdir = tempfile.mkdtemp()
+        TestPipeline.filenames = []
+        for number in range(1, 4):
+            filename = os.path.join(TestPipeline.tmpdir, 
+                                    'fS20131002S%04d.fits' % number)
+            frame = Frame(np.full((4, 5), 100. * number, dtype=np.float32),
+                          np.full((4, 5), 10., dtype=np.float32),
+                          np.zeros((4, 5), dtype=np.int16))
+            frame.phu['OBJECT'] = 'HD 1234'
+            frame.write(filename)
+            TestPipeline.filenames.append(filename)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestPipeline.tmpdir)
+    
+    def test_reduce(self):
+        outdir = os.path.join(TestPipeline.tmpdir, 'out')
+        os.mkdir(outdir)
+        pipe = Pipeline(checkpoint=['rdf', 'obj_comb'], outdir=outdir)
+        names = pipe.load(TestPipeline.filenames, prefix='f')
+        assert_equal(names[0], 'S20131002S0001')
+        pipe.products['dark'] = Frame(np.full((4, 5), 50., dtype=np.float32),
+                                      np.full((4, 5), 1., dtype=np.float32))
+        flat = Frame(np.full((4, 5), 2., dtype=np.float32))
+        pipe.subtract_dark(names, 'dark')
+        assert_equal(pipe.name(names[0]), 'dfS20131002S0001')
+        pipe.divide_flat(names, flat)
+        combined = pipe.combine(names, 'obj_comb')
+        assert_array_almost_equal(combined.sci, np.full((4, 5), 75.))
+        # (10 + 1) / 4 per frame, averaged over 3 frames.
+        assert_array_almost_equal(combined.var, np.full((4, 5), 11. / 12.))
+        
+        # only the checkpoints are written.
+        assert_equal(sorted(os.listdir(outdir)), 
+                     ['obj_comb.fits', 'rdfS20131002S0001.fits', 
+                      'rdfS20131002S0002.fits', 'rdfS20131002S0003.fits'])
+        stages = [entry.stage for entry in pipe.history('obj_comb')]
+        assert_equal(stages, ['load', 'subtract_dark', 'divide_flat', 
+                              'combine'])
+        history = str(fits.getheader(os.path.join(outdir, 'obj_comb.fits'))
+                      ['HISTORY'])
+        assert_true('subtract_dark(dark=dark)' in history)
+        
+        # writing again does not repeat the history.
+        ncards = len(fits.getheader(os.path.join(outdir, 'obj_comb.fits'))
+                     ['HISTORY'])
+        pipe.write('obj_comb')
+        assert_equal(len(fits.getheader(os.path.join(outdir, 
+                                                     'obj_comb.fits'))
+                         ['HISTORY']), ncards)
+        assert_equal(len(pipe.products['obj_comb'].phu.get('HISTORY', [])), 
+                     0)
+        # parameter values are not followed as product names.
+        pipe.products['average'] = Frame(np.zeros((4, 5), dtype=np.float32))
+        pipe._record('load', ['average.fits'], ['average'], {}, 0.)
+        pipe.combine(names, 'second', mode='average')
+        assert_equal([entry.stage for entry in pipe.history('second')],
+                     ['load', 'subtract_dark', 'divide_flat', 'combine'])
@@ -1,8 +1,58 @@
+import matplotlib
+# Non-interactive backend, must be selected before pyplot is loaded.
+matplotlib.use('Agg')
 import plottools
-#from nose.tools import assert_equal
+from nose.tools import assert_equal
+from numpy.testing import assert_array_equal
+from astropy import units as u
+import numpy as np
 
 #### Not clear how to test plots
 
+class FakeSpectrum:
+    def __init__(self, npix):
+        self.wlen = np.arange(npix, dtype=float) + 10000.
+        self.counts = np.sin(np.arange(npix) / 10.)
+        self.wunit = u.Angstrom
+
+class TestMinMaxDecimate:
+    
+    def test_short_series_unchanged(self):
+        xdata = np.arange(10.)
+        ydata = xdata ** 2
+        (xresult, yresult) = plottools.minmax_decimate(xdata, ydata, 0., 9., 10)
+        assert_array_equal(xresult, xdata)
+        assert_array_equal(yresult, ydata)
+    
+    def test_envelope(self):
+        # narrow peaks survive and the range is limited to the view
+        xdata = np.arange(100000.)
+        ydata = np.zeros(100000)
+        ydata[54321] = 10.
+        ydata[54322] = -10.
+        (xresult, yresult) = plottools.minmax_decimate(xdata, ydata,
+                                                       50000., 60000., 100)
+        assert xresult.size <= 2 * 102
+        assert_equal(yresult.max(), 10.)
+        assert_equal(yresult.min(), -10.)
+        assert xresult[0] < 50000. and xresult[-1] > 60000.
+        assert np.all(np.diff(xresult) > 0)
+    
+    def test_nan(self):
+        # NaN are skipped in the envelope but the gaps are kept.
+        xdata = np.arange(10000.)
+        ydata = np.sin(xdata / 100.)
+        ydata[500] = np.nan
+        ydata[2000:2300] = np.nan
+        ydata[7777] = 5.
+        (xresult, yresult) = plottools.minmax_decimate(xdata, ydata,
+                                                       0., 9999., 100)
+        assert xresult.size <= 3 * 102
+        assert_equal(np.nanmax(yresult), 5.)
+        assert 500. in xresult
+        assert 2000. in xresult
+        assert np.all(np.diff(xresult) > 0)
+
 class TestPlot:
     
     @classmethod
@@ -30,8 +80,57 @@ class TestSpPlot:
         pass
     
     def setup(self):
-        pass
+        TestSpPlot.pool = plottools.FigurePool(maxsize=1)
     
     def teardown(self):
-        pass
+        TestSpPlot.pool.close_all()
     
+    def test_pool_reuse(self):
+        # the second plot reuses the figure and the line of the first
+        plot = plottools.SpPlot(title='first', pool=TestSpPlot.pool)
+        plot.plot_spectrum(FakeSpectrum(100))
+        fig = plot.fig
+        line = plot.axplot.lines[0]
+        plot.release()
+        
+        spectrum = FakeSpectrum(50)
+        plot = plottools.SpPlot(title='second', pool=TestSpPlot.pool)
+        plot.plot_spectrum(spectrum)
+        plot.render()
+        assert plot.fig is fig
+        assert_equal(plot.axplot.lines, [line])
+        assert_array_equal(line.get_xdata(), spectrum.wlen)
+        fresh = plottools.SpPlot()
+        fresh.plot_spectrum(spectrum)
+        assert_equal(plot.axplot.get_xlim(), fresh.axplot.get_xlim())
+        fresh.release()
+        plot.release()
+
+    def test_unused_lines_removed(self):
+        plot = plottools.SpPlot(pool=TestSpPlot.pool)
+        plot.plot_spectrum(FakeSpectrum(100))
+        plot.plot_spectrum(FakeSpectrum(100), color='g')
+        plot.release()
+        
+        plot = plottools.SpPlot(pool=TestSpPlot.pool)
+        plot.plot_spectrum(FakeSpectrum(100))
+        plot.render()
+        assert_equal(len(plot.axplot.lines), 1)
+        plot.release()
+    
+    def test_decimate_on_zoom(self):
+        spectrum = FakeSpectrum(100000)
+        plot = plottools.SpPlot()
+        plot.plot_spectrum(spectrum, decimate=True)
+        line = plot.axplot.lines[0]
+        assert line.get_xdata().size < spectrum.wlen.size
+        plot.axplot.set_xlim(10100., 10120.)
+        assert_array_equal(line.get_xdata(), spectrum.wlen[99:122])
+        plot.release()
+
+    def test_release_without_pool(self):
+        import matplotlib.pyplot as plt
+        plot = plottools.SpPlot()
+        number = plot.fig.number
+        plot.release()
+        assert number not in plt.get_fignums()
@@ -0,0 +1,86 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+import obstable
+import prepare
+from frames import DQ_BAD, DQ_NONLINEAR, DQ_SATURATED
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+class TestPrepare:
+    
+    @classmethod
+    def setup_class(cls):
+        TestPrepare.tmpdir = tempfile.mkdtemp()
+        TestPrepare.filenames = []
+        for number in range(1, 4):
+            data = np.full((1, 4, 5), 1000. * number, dtype=np.float32)
+            data[0, 0, 0] = 25000.
+            data[0, 0, 1] = 40000.
+            hdu = fits.PrimaryHDU(data)
+            hdu.header['LNRS'] = 6
+            filename = os.path.join(TestPrepare.tmpdir, 
+                                    'S20131002S%04d.fits' % number)
+            hdu.writeto(filename)
+            TestPrepare.filenames.append(filename)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestPrepare.tmpdir)
+    
+    def test_lnrs(self):
+        assert_equal([prepare.true_lnrs(lnrs) for lnrs in (1, 2, 6)], 
+                     [1, 4, 8])
+        assert_equal(prepare.get_read_mode(6), 'faint')
+        assert_equal(prepare.read_noise(1), 11.7)
+        assert_raises(ValueError, prepare.get_read_mode, 3)
+    
+    def test_prepare_frame(self):
+        bpm = np.zeros((4, 5), dtype=bool)
+        bpm[3, 4] = True
+        nonlinearity = {'linlimit': 21000., 'saturation': 35000.,
+                        'coeffs': (4.e-7, 0.)}
+        frame = prepare.prepare_frame(TestPrepare.filenames[0], bpm=bpm,
+                                      nonlinearity=nonlinearity)
+        assert_equal(frame.shape, (4, 5))
+        assert_array_almost_equal(frame.sci[1], 
+                                  np.full(5, 1000. * (1. + 4.e-4)), decimal=3)
+        assert_equal(frame.dq[0, 0], DQ_NONLINEAR)
+        assert_equal(frame.dq[0, 1], DQ_NONLINEAR | DQ_SATURATED)
+        assert_equal(frame.sci[0, 1], 40000.)
+        assert_equal(frame.dq[3, 4], DQ_BAD)
+        gain = frame.phu['GAIN']
+        expected = frame.sci[1, 0] / gain + (5.0 / gain)**2
+        assert_true(abs(frame.var[1, 0] - expected) < 1e-3)
+        assert_equal(frame.phu['NREADS'], 8)
+        assert_equal(frame.phu['NONLINCR'], '4e-07 0')
+    
+    def test_no_nonlinearity(self):
+        # no correction and no flags unless the coefficients are given.
+        frame = prepare.prepare_frame(TestPrepare.filenames[0])
+        assert_array_equal(frame.sci[1], np.full(5, 1000.))
+        assert_equal(frame.sci[0, 1], 40000.)
+        assert_equal(np.count_nonzero(frame.dq), 0)
+        assert_true('NONLINCR' not in frame.phu)
+    
+    def test_prepare_record(self):
+        record = obstable.ObsRecord(rootname='S20131002', filerange='1-3',
+                                    lnrs=1)
+        outputs = prepare.prepare_record(record, 
+                                         rawdir=TestPrepare.tmpdir, 
+                                         nthreads=2)
+        assert_equal([os.path.basename(output) for output in outputs],
+                     ['fS20131002S%04d.fits' % number 
+                      for number in range(1, 4)])
+        hdulist = fits.open(outputs[2])
+        assert_equal([hdu.name for hdu in hdulist], 
+                     ['PRIMARY', 'SCI', 'VAR', 'DQ'])
+        # the LNRS of the record is used, not the header.
+        assert_equal(hdulist[0].header['RDNOISE'], 11.7)
+        hdulist.close()
@@ -0,0 +1,111 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+import matplotlib
+# Non-interactive backend, must be selected before pyplot is loaded.
+matplotlib.use('Agg')
+from astropy.io import fits
+import quicklook
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+def write_raw(filename, offset, obstype='OBJECT', seed=0):
+    # 64 dispersion rows, 40 columns: sky, a trace at column 12 (A) or
+    # 27 (B), and an emission line at row 40.
+    rng = np.random.RandomState(seed)
+    (rows, cols) = np.mgrid[0:64, 0:40]
+    data = np.full((64, 40), 2000., dtype=np.float64)
+    if obstype == 'OBJECT':
+        centre = 12. if offset == 0. else 27.
+        flux = 800. + 3000. * np.exp(-0.5 * ((rows - 40.) / 1.2)**2)
+        data += flux * np.exp(-0.5 * ((cols - centre) / 1.5)**2)
+    data += rng.normal(0., np.sqrt(data / 4.44))
+    hdu = fits.PrimaryHDU(data[np.newaxis].astype(np.float32))
+    hdu.header['OBJECT'] = 'TEST'
+    hdu.header['OBSTYPE'] = obstype
+    hdu.header['OBSCLASS'] = 'science'
+    hdu.header['FILTER1'] = 'JH_G0809'
+    hdu.header['FILTER2'] = 'Open'
+    hdu.header['GRISM'] = 'JH_G5801'
+    hdu.header['EXPTIME'] = 60.
+    hdu.header['LNRS'] = 6
+    hdu.header['QOFFSET'] = offset
+    hdu.writeto(filename)
+
+class TestQuickLook:
+    
+    @classmethod
+    def setup_class(cls):
+        TestQuickLook.tmpdir = tempfile.mkdtemp()
+        TestQuickLook.rawdir = os.path.join(TestQuickLook.tmpdir, 'raw')
+        os.mkdir(TestQuickLook.rawdir)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestQuickLook.tmpdir)
+    
+    def raw_name(self, number):
+        return os.path.join(TestQuickLook.rawdir, 
+                            'S20131002S%04d.fits' % number)
+    
+    def test_running_stack(self):
+        rng = np.random.RandomState(1)
+        frames = rng.normal(10., 2., (6, 5, 4))
+        good = np.ones(frames.shape, dtype=bool)
+        good[2, 0, 0] = False
+        good[:5, 1, 1] = False
+        stack = quicklook.RunningStack((5, 4))
+        for (frame, mask) in zip(frames, good):
+            stack.update(frame, np.full((5, 4), 4.), mask)
+        assert_equal(stack.nframes, 6)
+        assert_equal(stack.count[0, 0], 5)
+        assert_equal(stack.count[1, 1], 1)
+        masked = np.ma.masked_array(frames, ~good)
+        assert_array_almost_equal(stack.mean, masked.mean(axis=0))
+        expected = masked.var(axis=0, ddof=1)
+        assert_array_almost_equal(stack.variance()[2:], expected[2:])
+        var = stack.variance_of_mean()
+        assert_array_almost_equal(var[2:], expected[2:] / 6.)
+        # a single frame: the variance of that frame.
+        assert_equal(var[1, 1], 4.)
+    
+    def test_watch(self):
+        outdir = os.path.join(TestQuickLook.tmpdir, 'quicklook')
+        quick = quicklook.QuickLook(TestQuickLook.rawdir, outdir=outdir,
+                                    wavelength=(9000., 10.))
+        write_raw(self.raw_name(1), 0., 'DARK', seed=1)
+        write_raw(self.raw_name(2), 0., seed=2)
+        # a frame being written is left for the next poll.
+        with open(self.raw_name(3), 'w') as f:
+            f.write('SIMPLE  =                    T')
+        assert_equal(quick.step(), [])
+        assert_equal(sorted(quick.seen), [self.raw_name(1), 
+                                          self.raw_name(2)])
+        
+        os.remove(self.raw_name(3))
+        write_raw(self.raw_name(3), 15., seed=3)
+        updated = quick.step()
+        assert_equal([target.name for target in updated], ['TEST_JH'])
+        target = updated[0]
+        assert_equal(target.npairs, 1)
+        assert_true(os.path.exists(os.path.join(outdir, 'TEST_JH.png')))
+        
+        write_raw(self.raw_name(4), 15., seed=4)
+        write_raw(self.raw_name(5), 0., seed=5)
+        first_snr = target.snr
+        updated = quick.step()
+        assert_equal(len(updated), 1)
+        assert_equal(target.npairs, 2)
+        assert_equal(quick.errors, [])
+        assert_array_equal(target.stack.count[0, :3], [2, 2, 2])
+        assert_equal(len(target.spectrum.counts), 64)
+        assert_true(target.snr > first_snr)
+        assert_true(np.any(np.abs(target.lines - 9400.) <= 10.))
+        # the stack is the mean of the A-B pairs.
+        peak = target.spectrum.counts[10]
+        assert_true(abs(peak / (800. * 1.5 * np.sqrt(2. * np.pi)) - 1.)
+                    < 0.1)
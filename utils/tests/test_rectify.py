@@ -0,0 +1,90 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+import rectify
+from frames import Frame, DQ_NODATA
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+def wavelength(x, y):
+    # tilted lines with a slightly curved dispersion.
+    return 10000. + 6.5 * y + 1.e-4 * y**2 + 0.02 * (x - 20.)
+
+class TestRectify:
+    
+    @classmethod
+    def setup_class(cls):
+        TestRectify.tmpdir = tempfile.mkdtemp()
+        TestRectify.shape = (120, 40)
+        # the arc lines, traced along the slit.
+        (y, x) = np.mgrid[0:120:7, 0:40:4].astype(float)
+        TestRectify.points = (x.ravel(), y.ravel(), 
+                              wavelength(x, y).ravel())
+        (y, x) = np.mgrid[0:120, 0:40].astype(float)
+        TestRectify.sci = np.sin(wavelength(x, y) / 50.)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestRectify.tmpdir)
+    
+    def test_apply(self):
+        (xpix, ypix, wlen) = TestRectify.points
+        rmap = rectify.build_map(xpix, ypix, wlen, TestRectify.shape, 
+                                 lxorder=2, lyorder=3)
+        result = rmap.apply(TestRectify.sci)
+        expected_result = np.sin(rmap.wavelengths / 50.)
+        dq = rmap.apply_dq(None)
+        good = (dq == 0)
+        assert_true(good.sum() > 0.9 * good.size)
+        assert_array_almost_equal(result[good], 
+                                  (expected_result[:, np.newaxis] * 
+                                   np.ones((1, 40)))[good], decimal=2)
+        assert_array_equal(result[~good], 0.)
+        assert_equal(dq[~good][0], DQ_NODATA)
+    
+    def test_apply_frame(self):
+        (xpix, ypix, wlen) = TestRectify.points
+        rmap = rectify.build_map(xpix, ypix, wlen, TestRectify.shape, 
+                                 lxorder=2, lyorder=3, 
+                                 wave_grid=(10100., 6.5, 100))
+        dq = np.zeros(TestRectify.shape, dtype=np.int16)
+        dq[60, 10] = 8
+        frame = Frame(TestRectify.sci, np.ones(TestRectify.shape), dq)
+        result = rmap.apply_frame(frame)
+        assert_equal(result.sci.shape, (100, 40))
+        assert_equal(result.header['CRVAL2'], 10100.)
+        assert_equal(result.header['CD2_2'], 6.5)
+        assert_true((result.var <= 1.).all())
+        assert_equal(np.count_nonzero(result.dq[:, 10] & 8), 2)
+        assert_equal(np.count_nonzero(result.dq[:, 11] & 8), 0)
+    
+    def test_dispaxis(self):
+        (xpix, ypix, wlen) = TestRectify.points
+        rmap = rectify.build_map(xpix, ypix, wlen, TestRectify.shape, 
+                                 lxorder=2, lyorder=3)
+        rmap_t = rectify.build_map(ypix, xpix, wlen, TestRectify.shape[::-1],
+                                   lxorder=2, lyorder=3, dispaxis=1)
+        assert_array_almost_equal(rmap_t.apply(TestRectify.sci.T), 
+                                  rmap.apply(TestRectify.sci).T)
+    
+    def test_cache(self):
+        (xpix, ypix, wlen) = TestRectify.points
+        cachedir = os.path.join(TestRectify.tmpdir, 'cache')
+        rmap = rectify.get_rectification_map(xpix, ypix, wlen, 
+                                             TestRectify.shape, cachedir=cachedir)
+        assert_equal(os.listdir(cachedir), ['rectify-%s.npz' % rmap.key])
+        cached = rectify.get_rectification_map(xpix, ypix, wlen, 
+                                               TestRectify.shape, 
+                                               cachedir=cachedir)
+        assert_equal(cached.key, rmap.key)
+        assert_array_almost_equal(cached.apply(TestRectify.sci), 
+                                  rmap.apply(TestRectify.sci))
+        other = rectify.get_rectification_map(xpix, ypix, wlen, 
+                                              TestRectify.shape, lyorder=4,
+                                              cachedir=cachedir)
+        assert_true(other.key != rmap.key)
+        assert_equal(len(os.listdir(cachedir)), 2)
@@ -0,0 +1,85 @@
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+import skysub
+from frames import Frame, DQ_BAD
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_almost_equal
+
+class TestSkySub:
+    
+    @classmethod
+    def setup_class(cls):
+        TestSkySub.tmpdir = tempfile.mkdtemp()
+        TestSkySub.filenames = []
+        (nrows, ncols) = (20, 6)
+        for (number, position) in enumerate('ABBAABBA'):
+            # the source is at row 5 in A and at row 15 in B, on a sky
+            # that varies from frame to frame.
+            sci = np.full((nrows, ncols), 100. + 10. * number + 50.)
+            sci[5 if position == 'A' else 15] += 1000.
+            frame = Frame(sci.astype(np.float32), 
+                          np.full((nrows, ncols), 4., dtype=np.float32),
+                          np.zeros((nrows, ncols), dtype=np.int16))
+            frame.phu['QOFFSET'] = 0. if position == 'A' else 6.
+            filename = os.path.join(TestSkySub.tmpdir, 
+                                    'fS20131002S%04d.fits' % (number + 1))
+            frame.write(filename)
+            TestSkySub.filenames.append(filename)
+        TestSkySub.dark = Frame(np.full((nrows, ncols), 50., 
+                                        dtype=np.float32),
+                                np.full((nrows, ncols), 1., 
+                                        dtype=np.float32))
+        flat = np.full((nrows, ncols), 2., dtype=np.float32)
+        flat[0, 0] = 0.
+        TestSkySub.flat = Frame(flat)
+    
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(TestSkySub.tmpdir)
+    
+    def test_sky_pairs(self):
+        assert_array_equal(skysub.sky_pairs([0, 1, 1, 0]), [1, 0, 3, 2])
+        assert_array_equal(skysub.sky_pairs([0, 1, 0, 1]), [1, 0, 1, 2])
+        assert_raises(ValueError, skysub.sky_pairs, [0, 0])
+    
+    def test_nod_positions(self):
+        phus = [fits.Header([('QOFFSET', offset)]) 
+                for offset in (-3., 3., 3.1, -3.)]
+        assert_array_equal(skysub.nod_positions(phus), [0, 1, 1, 0])
+        phus.append(fits.Header([('QOFFSET', 10.)]))
+        assert_raises(ValueError, skysub.nod_positions, phus)
+    
+    def test_reduce_frames(self):
+        reduced = skysub.reduce_frames(TestSkySub.filenames, 
+                                       dark=TestSkySub.dark, 
+                                       flat=TestSkySub.flat, 
+                                       outprefix='r', nthreads=2)
+        assert_equal(len(reduced), 8)
+        # A1 - B1: positive source at row 5, negative at row 15, and the
+        # sky difference of -10 counts, divided by the flat.
+        first = reduced[0].sci
+        assert_array_almost_equal(first[5, 1:], np.full(5, (1000. - 10.) / 2.))
+        assert_array_almost_equal(first[15, 1:], np.full(5, (-1000. - 10.) / 2.))
+        assert_array_almost_equal(first[10, 1:], np.full(5, -5.))
+        # the dark variance cancels with the dark.
+        assert_array_almost_equal(reduced[0].var[10], np.full(6, 8. / 4.))
+        assert_equal(reduced[0].var[0, 0], 0.)
+        assert_equal(reduced[0].dq[0, 0], DQ_BAD)
+        assert_equal(reduced[2].phu['SKYIMAGE'], 'fS20131002S0004.fits')
+        written = os.path.join(TestSkySub.tmpdir, 'rfS20131002S0001.fits')
+        assert_array_almost_equal(fits.getdata(written, 'SCI'), first)
+    
+    def test_no_sky(self):
+        (sci, var, dq, phus, headers) = skysub.read_stack(
+            TestSkySub.filenames[:2])
+        (sci, var, dq) = skysub.reduce_stack(sci, var, dq, 
+                                             dark=TestSkySub.dark)
+        assert_array_almost_equal(sci[1, 10], np.full(6, 110.))
+        assert_array_almost_equal(var[1, 10], np.full(6, 5.))
@@ -0,0 +1,56 @@
+import specplot
+import obstable
+from nose.tools import assert_equal
+from nose.tools import assert_dict_equal
+import os
+import os.path
+import shutil
+import tempfile
+
+class TestBatch:
+    
+    @classmethod
+    def setup_class(cls):
+        pass
+    
+    @classmethod
+    def teardown_class(cls):
+        pass
+    
+    def setup(self):
+        TestBatch.tmpdir = tempfile.mkdtemp()
+    
+    def teardown(self):
+        shutil.rmtree(TestBatch.tmpdir)
+    
+    def test_read_redshift_table(self):
+        expected_result = {'SDSSJ011758.83+002021.4': 0.61296,
+                           'SDSSJ022721.25-010445.8': 0.5}
+        filename = os.path.join(TestBatch.tmpdir, 'redshifts.dat')
+        with open(filename, 'w') as table:
+            table.write('# targetname redshift\n')
+            table.write('SDSSJ011758.83+002021.4  0.61296\n')
+            table.write('SDSSJ022721.25-010445.8  0.5\n')
+        result = specplot.read_redshift_table(filename)
+        assert_dict_equal(result, expected_result)
+    
+    def test_jobs_from_obstable(self):
+        targetname = 'SDSSJ011758.83+002021.4'
+        reduxdir = os.path.join(TestBatch.tmpdir, targetname,
+                                '20131015-16Oct2013', 'reduxHK')
+        os.makedirs(reduxdir)
+        open(os.path.join(reduxdir, 'axtfobj_bb.fits'), 'w').close()
+        records = [obstable.ObsRecord(targetname, 'S20131015', 'HK', 'HK',
+                                      'Science', 'None', '38-41', 90, 6,
+                                      'faint'),
+                   obstable.ObsRecord(targetname, 'S20131015', 'HK', 'HK',
+                                      'Dark', 'Science', '60-63', 90, 6,
+                                      'faint')]
+        table = obstable.ObsTable(records=records)
+        jobs = specplot.jobs_from_obstable(table, rootdir=TestBatch.tmpdir,
+                                           outdir='png', redshift=0.61296)
+        assert_equal(len(jobs), 1)
+        assert_equal(jobs[0].output_plot_name, 
+                     os.path.join('png', '%s-HK-20131015-16Oct2013.png' %
+                                  targetname))
+        assert_equal(jobs[0].redshift, 0.61296)
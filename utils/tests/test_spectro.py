@@ -6,6 +6,7 @@ from nose.tools import assert_equal
 from nose.tools import assert_list_equal
 from nose.tools import assert_almost_equal
 from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_almost_equal
 import numpy as np
 import os.path
 
@@ -194,8 +195,31 @@ class TestLineList:
         for line in TestLineList.linelist.lines:
             result.append( (line.name, line.obswlen) )
         assert_list_equal(result, expected_result)
-       
-    
+
+    def test_columns(self):
+        expected_result = [wlen.value for (_, wlen) in TestLineList.quasar_rest]
+        result = TestLineList.linelist.restwlen
+        assert_array_equal(result, expected_result)
+        assert_equal(TestLineList.linelist.wunit, u.micron)
+        assert_equal(len(TestLineList.linelist), 8)
+
+    def test_observed_wavelengths1(self):
+        # scalar redshift, converted to Angstrom
+        expected_result = [wlen.to(u.Angstrom).value * 1.5
+                           for (_, wlen) in TestLineList.quasar_rest]
+        result = TestLineList.linelist.observed_wavelengths(0.5,
+                                                            unit=u.Angstrom)
+        assert_array_almost_equal(result, expected_result)
+
+    def test_observed_wavelengths2(self):
+        # vector of redshifts gives a (n_redshift x n_lines) matrix
+        redshifts = np.array([0., 1., 2.])
+        rest = np.array([wlen.value for (_, wlen) in TestLineList.quasar_rest])
+        expected_result = np.outer(redshifts + 1, rest)
+        result = TestLineList.linelist.observed_wavelengths(redshifts)
+        assert_array_almost_equal(result, expected_result)
+
+
 class TestSpectrum:
     
     @classmethod
@@ -279,4 +303,29 @@ class TestSpectrum:
         assert_almost_equal(result[2], expected_result[2],3)
 
 
-    
\ No newline at end of file
+    
+    def test_apply_wcs_to_pixels_fast(self):
+        # linear header takes the fast path and matches the full WCS
+        sp_fast = spectro.Spectrum(TestSpectrum.apfhdu)
+        sp_wcs = spectro.Spectrum(TestSpectrum.apfhdu, fast_wcs=False)
+        assert_equal(sp_fast.wcs_path, 'linear')
+        assert_equal(sp_wcs.wcs_path, 'wcs')
+        assert_array_almost_equal(sp_fast.wlen, sp_wcs.wlen, 3)
+
+    def test_lazy(self):
+        # nothing is read until accessed
+        sp = spectro.Spectrum(TestSpectrum.apfhdu, lazy=True)
+        assert_equal(sp._counts, None)
+        assert_equal(sp._wlen, None)
+        assert_array_equal(sp.counts, TestSpectrum.apfhdu.data)
+        assert_almost_equal(sp.wlen[1000], 16292.345, 3)
+
+    def test_slice_wavelength(self):
+        full = spectro.Spectrum(TestSpectrum.apfhdu)
+        sp = spectro.Spectrum.from_file(TestSpectrum.testfile)
+        window = sp.slice_wavelength(18000., 19500.)
+        first, last = window.pixel_range
+        assert window.wlen[0] <= 18000. and window.wlen[-1] >= 19500.
+        assert_array_equal(window.counts, full.counts[first:last])
+        assert_array_almost_equal(window.wlen, full.wlen[first:last])
+        sp.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import telluric
+from spectro import Spectrum
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_almost_equal
+from numpy.testing import assert_array_almost_equal
+
+def absorption(wlen, centres, depth=0.6, width=3.):
+    transmission = np.ones_like(wlen)
+    for centre in centres:
+        transmission *= 1. - depth * np.exp(-0.5 * ((wlen - centre) / 
+                                                    width)**2)
+    return transmission
+
+class TestTelluric:
+    
+    @classmethod
+    def setup_class(cls):
+        np.random.seed(7)
+        (crval, cdelt, npix) = (11000., 2., 1000)
+        wlen = crval + cdelt * np.arange(npix)
+        centres = crval + np.random.uniform(50., 1950., 60)
+        TestTelluric.telluric = Spectrum.from_array(
+            absorption(wlen, centres), crval, cdelt)
+        # the science sees 1.4 times the airmass, shifted by 1.3 pixels.
+        star = 1000. * (1. + 0.2 * np.sin(wlen / 300.))
+        observed = star * absorption(wlen - 1.3 * cdelt, centres)**1.4
+        TestTelluric.star = star
+        TestTelluric.science = Spectrum.from_array(
+            observed + np.random.normal(0., 2., npix), crval, cdelt)
+        TestTelluric.variance = Spectrum.from_array(
+            np.ones(npix) * 4., crval, cdelt)
+    
+    def test_shift_spectra(self):
+        values = np.sin(np.arange(64.) / 5.)
+        shifted = telluric.shift_spectra(values, [0., 1., -0.5])
+        assert_equal(shifted.shape, (3, 64))
+        assert_array_almost_equal(shifted[0], values)
+        assert_array_almost_equal(shifted[1, 1:], values[:-1])
+        assert_array_almost_equal(telluric.shift_spectra(shifted[1], [-1.])[0, 1:-1], values[1:-1])
+    
+    def test_xcorr_shift(self):
+        values = np.exp(-0.5 * ((np.arange(200.) - 80.) / 2.)**2)
+        shifted = np.exp(-0.5 * ((np.arange(200.) - 83.4) / 2.)**2)
+        assert_almost_equal(telluric.xcorr_shift(shifted, values), 3.4, 
+                            places=1)
+    
+    def test_fit_telluric(self):
+        solution = telluric.fit_telluric(TestTelluric.science, 
+                                         TestTelluric.telluric,
+                                         windows=[(11100., 12900.)])
+        assert_almost_equal(solution.shift, 1.3, places=1)
+        assert_true(abs(solution.scale - 1.4) < 0.06)
+        assert_equal(solution.grid.shape, (solution.scales.size, 
+                                           solution.shifts.size))
+    
+    def test_apply_telluric(self):
+        (corrected, variance) = telluric.apply_telluric(
+            TestTelluric.science, TestTelluric.variance, 
+            TestTelluric.telluric, 1.3, 1.4)
+        residuals = corrected.counts / TestTelluric.star - 1.
+        assert_true(np.std(residuals[50:-50]) < 0.01)
+        assert_array_almost_equal(corrected.wlen, TestTelluric.science.wlen)
+        assert_true(variance.counts.min() > 3.9)
+        assert_true(variance.counts.max() > 4. / 0.5**2)
+    
+    def test_candidates(self):
+        wlen = TestTelluric.science.wlen
+        wrong = Spectrum.from_array(absorption(wlen, wlen[::25]), 
+                                    wlen[0], 2.)
+        (best, solution, corrected, variance, solutions) = \
+            telluric.correct_with_candidates(TestTelluric.science, None,
+                                             [wrong, TestTelluric.telluric])
+        assert_equal(best, 1)
+        assert_equal(len(solutions), 2)
+        assert_true(variance is None)
@@ -0,0 +1,74 @@
+import numpy as np
+import wavecal
+from spectro import LineList
+from nose.tools import assert_equal
+from nose.tools import assert_true
+from nose.tools import assert_raises
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+def true_solution(pixels, column=0.):
+    return 8900. + 4.4 * pixels + 1.e-4 * pixels**2 + 0.01 * column
+
+def make_arc(npix=2048, ncols=1):
+    np.random.seed(4)
+    reference = LineList('argon').restwlen
+    pixels = np.arange(npix, dtype=float)
+    heights = np.random.uniform(50., 500., reference.size)
+    arc = np.random.normal(100., 1., (npix, ncols))
+    for column in range(ncols):
+        positions = np.interp(reference, true_solution(pixels, column), 
+                              pixels, left=-100., right=-100.)
+        for (position, height) in zip(positions, heights):
+            arc[:, column] += height * np.exp(-0.5 * 
+                                              ((pixels - position) / 1.3)**2)
+    return arc
+
+class TestWavecal:
+    
+    @classmethod
+    def setup_class(cls):
+        TestWavecal.arc = make_arc()[:, 0]
+    
+    def test_find_peaks(self):
+        flux = np.zeros(100)
+        flux[[20, 21, 22]] = [5., 10., 5.]
+        flux[[60, 61, 62]] = [4., 10., 8.]
+        flux[63] = 9.
+        (positions, heights) = wavecal.find_peaks(flux)
+        assert_array_almost_equal(positions, [21., 61.2], decimal=1)
+        assert_array_equal(heights, [10., 10.])
+    
+    def test_match_lines(self):
+        reference = np.array([10., 20., 30., 40.])
+        predicted = np.array([9.5, 10.2, 29., 35., 41.])
+        (peaks, lines) = wavecal.match_lines(predicted, reference, 1.5)
+        assert_array_equal(peaks, [1, 2, 4])
+        assert_array_equal(lines, [0, 2, 3])
+    
+    def test_identify_lines(self):
+        solution = wavecal.identify_lines(TestWavecal.arc, 'argon', 
+                                          crval=8960., cdelt=4.5)
+        assert_equal(solution.order, 8)
+        assert_true(solution.used.sum() >= 25)
+        assert_true(solution.rms < 0.2)
+        pixels = np.arange(60., 1750.)
+        assert_true(np.abs(solution(pixels) - 
+                           true_solution(pixels)).max() < 0.5)
+        report = solution.report().split('\n')
+        assert_equal(len(report), solution.used.size + 2)
+    
+    def test_identify_lines_failure(self):
+        assert_raises(ValueError, wavecal.identify_lines, 
+                      np.random.normal(0., 1., 500), 'argon', 9000., 4.4)
+    
+    def test_trace_lines(self):
+        arc = make_arc(ncols=60)
+        flux = wavecal.extract_arc_spectrum(arc, nsum=10)
+        solution = wavecal.identify_lines(flux, 'argon', crval=8900., 
+                                          cdelt=4.4, order=3)
+        (x, y, wavelengths) = wavecal.trace_lines(arc, solution, step=20,
+                                                  nsum=5)
+        assert_array_equal(np.unique(x), [2., 22., 42.])
+        expected_result = true_solution(y, x)
+        assert_true(np.abs(wavelengths - expected_result).max() < 1.)
@@ -0,0 +1,501 @@
+# wavecal.py
+"""
+Automatic identification of arc lines and wavelength solution.
+
+This replaces the interactive nswavelength step.  The peaks of the arc
+spectrum are detected and centroided in one vectorized pass, matched to
+a sorted reference line list with searchsorted, and fitted with a
+Legendre polynomial with iterative sigma rejection.  The residual of
+every line is kept for the verification tables.
+
+The reference lines come from spectro.LINELIST_DICT through LineList,
+eg. LineList('argon'), or from an IRAF coordinate list.
+
+Usage:
+    arc = Frame.from_file('arc.fits')
+    flux = extract_arc_spectrum(arc.sci)
+    solution = identify_lines(flux, 'argon', crval=9800., cdelt=6.5)
+    print solution.report()
+    (x, y, wlen) = trace_lines(arc.sci, solution)
+"""
+
+import numpy as np
+
+class WavelengthSolution(object):
+    """
+    Wavelength as a function of pixel, with the lines used to derive it.
+    
+    Parameters
+    ----------
+    polynomial : numpy.polynomial.Legendre
+        Fitted solution, pixel (0-based) to wavelength.
+    pixels : ndarray
+        Centroids of the matched lines.
+    wavelengths : ndarray
+        Reference wavelengths of the matched lines.
+    names : ndarray
+        Names of the matched lines.
+    used : ndarray
+        Boolean, False for the lines rejected by the fit.
+    wunit : Unit, optional
+        Unit of the wavelengths.
+    
+    Attributes
+    ----------
+    residuals : ndarray
+        Reference minus fitted wavelength of each matched line.
+    rms : float
+        RMS of the residuals of the lines used.
+    """
+    def __init__(self, polynomial, pixels, wavelengths, names, used,
+                 wunit=None):
+        self.polynomial = polynomial
+        self.pixels = pixels
+        self.wavelengths = wavelengths
+        self.names = names
+        self.used = used
+        self.wunit = wunit
+    
+    def __call__(self, pixels):
+        """
+        Wavelength at the given 0-based pixels.
+        """
+        return self.polynomial(np.asarray(pixels, dtype=np.float64))
+    
+    @property
+    def order(self):
+        """
+        Order of the fitted polynomial.
+        """
+        return self.polynomial.degree()
+    
+    @property
+    def residuals(self):
+        """
+        Reference minus fitted wavelength of each matched line.
+        """
+        return self.wavelengths - self(self.pixels)
+    
+    @property
+    def rms(self):
+        """
+        RMS of the residuals of the lines used by the fit.
+        """
+        if not self.used.any():
+            return np.nan
+        return np.sqrt(np.mean(self.residuals[self.used]**2))
+    
+    def dispersion(self, pixel):
+        """
+        Local dispersion, in wavelength per pixel.
+        """
+        return self.polynomial.deriv()(pixel)
+    
+    def report(self):
+        """
+        Table of the matched lines and their residuals.
+        
+        Returns
+        -------
+        str
+            One line per matched line: name, reference wavelength,
+            pixel, fitted wavelength, residual, and whether it was used.
+        """
+        lines = ['# %-8s %12s %10s %12s %10s %s' % ('name', 'wavelength',
+                                                    'pixel', 'fit',
+                                                    'residual', 'used')]
+        fitted = self(self.pixels)
+        for (name, wlen, pixel, fit, used) in zip(self.names,
+                                                  self.wavelengths,
+                                                  self.pixels, fitted,
+                                                  self.used):
+            lines.append('  %-8s %12.3f %10.3f %12.3f %10.4f %s' %
+                         (name, wlen, pixel, fit, wlen - fit,
+                          'yes' if used else 'no'))
+        lines.append('# order=%d nlines=%d nused=%d rms=%.4f' %
+                     (self.order, self.used.size, self.used.sum(), self.rms))
+        return '\n'.join(lines)
+
+
+def get_reference_lines(reference, wunit=None):
+    """
+    Sorted wavelengths and names of the reference lines.
+    
+    Parameters
+    ----------
+    reference : str, LineList or array_like
+        Name of a list in spectro.LINELIST_DICT, a LineList, or the
+        wavelengths themselves.
+    wunit : Unit, optional
+        Unit to convert the LineList wavelengths to.
+    
+    Returns
+    -------
+    tuple
+        (wavelengths, names, wunit), sorted by wavelength.
+    """
+    from spectro import LineList
+    
+    if isinstance(reference, basestring):
+        reference = LineList(reference)
+    if isinstance(reference, LineList):
+        wavelengths = reference.observed_wavelengths(unit=wunit)
+        names = reference.names
+        wunit = wunit if wunit is not None else reference.wunit
+    else:
+        wavelengths = np.asarray(reference, dtype=np.float64)
+        names = np.array(['%.2f' % wlen for wlen in wavelengths])
+    order = np.argsort(wavelengths)
+    return (wavelengths[order], names[order], wunit)
+
+def read_coordlist(filename):
+    """
+    Read an IRAF line list, eg. gemini$gcal/linelists/argon.dat.  The
+    first column is the wavelength; comments start with #.
+    
+    Parameters
+    ----------
+    filename : str
+    
+    Returns
+    -------
+    ndarray
+        Wavelengths.
+    """
+    wavelengths = []
+    for line in open(filename):
+        fields = line.split('#')[0].split()
+        if fields:
+            wavelengths.append(float(fields[0]))
+    return np.array(wavelengths)
+
+def extract_arc_spectrum(data, dispaxis=2, nsum=20):
+    """
+    Median of the central columns (or rows) of a 2-D arc.
+    
+    Parameters
+    ----------
+    data : ndarray
+        2-D arc.
+    dispaxis : int, optional
+        Dispersion axis, as DISPAXIS.  Default = 2.
+    nsum : int, optional
+        Number of columns combined.  Default = 20.
+    
+    Returns
+    -------
+    ndarray
+        1-D arc spectrum along the dispersion axis.
+    """
+    data = np.asarray(data)
+    if dispaxis == 1:
+        data = data.T
+    centre = data.shape[1] // 2
+    low = max(centre - nsum // 2, 0)
+    return np.median(data[:, low:low + max(nsum, 1)], axis=1)
+
+def find_peaks(flux, nsigma=5., min_separation=3.):
+    """
+    Detect and centroid the emission lines of a 1-D spectrum.
+    
+    A peak is a local maximum more than nsigma times the robust noise
+    (from the median absolute deviation) above the median.  The centroid
+    is the vertex of the parabola through the peak and its neighbours.
+    Of two peaks closer than min_separation, only the brightest is kept.
+    
+    Parameters
+    ----------
+    flux : array_like
+        1-D spectrum.
+    nsigma : float, optional
+        Detection threshold.  Default = 5.
+    min_separation : float, optional
+        Minimum distance between two peaks, in pixels.  Default = 3.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (positions, heights), sorted by position.  Positions are 0-based.
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    median = np.median(flux)
+    noise = 1.4826 * np.median(np.abs(flux - median))
+    threshold = median + nsigma * max(noise, np.finfo(float).tiny)
+    
+    centre = flux[1:-1]
+    is_peak = (centre > flux[:-2]) & (centre >= flux[2:]) & \
+              (centre > threshold)
+    index = np.flatnonzero(is_peak) + 1
+    (left, peak, right) = (flux[index - 1], flux[index], flux[index + 1])
+    curvature = left - 2. * peak + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0., 0.5 * (left - right) / curvature,
+                          0.)
+    positions = index + offset
+    
+    # brightest first; drop the peaks too close to a brighter one.
+    keep = []
+    for i in np.argsort(-peak):
+        if all(abs(positions[i] - positions[j]) >= min_separation
+               for j in keep):
+            keep.append(i)
+    keep = np.sort(np.array(keep, dtype=int))
+    return (positions[keep], peak[keep])
+
+def match_lines(predicted, reference, tolerance):
+    """
+    Match predicted wavelengths to the nearest reference lines.
+    
+    Each reference line is matched to at most one peak, the closest.
+    
+    Parameters
+    ----------
+    predicted : ndarray
+        Predicted wavelength of each peak.
+    reference : ndarray
+        Sorted reference wavelengths.
+    tolerance : float
+        Maximum distance, in wavelength.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (peak_index, reference_index) of the matches.
+    """
+    (nearest, distance) = _nearest(predicted, reference)
+    matched = np.flatnonzero(distance <= tolerance)
+    # one peak per reference line: keep the closest.
+    order = np.lexsort((distance[matched], nearest[matched]))
+    matched = matched[order]
+    first = np.concatenate(([True],
+                            np.diff(nearest[matched]) != 0))
+    matched = np.sort(matched[first])
+    return (matched, nearest[matched])
+
+def _nearest(values, reference):
+    # index of, and distance to, the nearest reference value.
+    index = np.clip(np.searchsorted(reference, values), 1,
+                    reference.size - 1)
+    below = reference[index - 1]
+    above = reference[index]
+    use_below = np.abs(values - below) <= np.abs(above - values)
+    nearest = np.where(use_below, index - 1, index)
+    return (nearest, np.abs(values - reference[nearest]))
+
+def search_linear(positions, reference, crval, cdelt, crpix=1.,
+                  max_shift=50., max_stretch=0.03, nshift=201, nstretch=31,
+                  tolerance=3.):
+    """
+    Refine a linear guess of the dispersion by maximizing the number of
+    peaks that land on a reference line.
+    
+    All the trial shifts and stretches are evaluated at once: the
+    predicted wavelengths of all the peaks for all the trials are
+    matched to the reference with one searchsorted.
+    
+    Parameters
+    ----------
+    positions : ndarray
+        Peak positions, 0-based pixels.
+    reference : ndarray
+        Sorted reference wavelengths.
+    crval, cdelt, crpix : float
+        Initial linear solution, crpix 1-based as in the headers.
+    max_shift : float, optional
+        Largest shift tried, in pixels.  Default = 50.
+    max_stretch : float, optional
+        Largest relative change of cdelt tried.  Default = 0.03.
+    nshift, nstretch : int, optional
+        Number of trial shifts and stretches.
+    tolerance : float, optional
+        Match tolerance, in pixels.  Default = 3.
+    
+    Returns
+    -------
+    tuple of float
+        (crval, cdelt, crpix) of the best trial, and the number of
+        matched peaks.
+    """
+    shifts = np.linspace(-max_shift, max_shift, nshift)
+    stretches = 1. + np.linspace(-max_stretch, max_stretch, nstretch)
+    (shift, stretch) = [grid.ravel()[:, np.newaxis]
+                        for grid in np.meshgrid(shifts, stretches)]
+    predicted = crval + cdelt * stretch * (positions + 1. - crpix + shift)
+    (_, distance) = _nearest(predicted.ravel(), reference)
+    distance = distance.reshape(predicted.shape)
+    close = distance <= tolerance * abs(cdelt)
+    score = close.sum(axis=1) - \
+            np.where(close, distance, 0.).sum(axis=1) / \
+            (tolerance * abs(cdelt) * max(positions.size, 1))
+    best = int(np.argmax(score))
+    crval_best = crval + cdelt * stretch[best, 0] * shift[best, 0]
+    return ((crval_best, cdelt * stretch[best, 0], crpix),
+            int(close[best].sum()))
+
+def fit_solution(pixels, wavelengths, order, npix, nsigma=3., niter=5):
+    """
+    Fit wavelength against pixel with iterative sigma rejection.
+    
+    Parameters
+    ----------
+    pixels, wavelengths : ndarray
+        Matched lines.
+    order : int
+        Order of the Legendre polynomial.  It is lowered if there are
+        not enough lines.
+    npix : int
+        Number of pixels, for the domain of the polynomial.
+    nsigma : float, optional
+        Rejection threshold.  Default = 3.
+    niter : int, optional
+        Maximum number of rejection iterations.  Default = 5.
+    
+    Returns
+    -------
+    tuple
+        (polynomial, used), the Legendre fit and the boolean mask of the
+        lines kept.
+    """
+    from numpy.polynomial import Legendre
+    
+    if pixels.size < 2:
+        raise ValueError('At least two lines are needed, %d found.' %
+                         pixels.size)
+    used = np.ones(pixels.size, dtype=bool)
+    for _ in range(niter + 1):
+        degree = min(order, used.sum() - 2) if used.sum() > 2 else 1
+        polynomial = Legendre.fit(pixels[used], wavelengths[used], degree,
+                                  domain=[0., npix - 1.])
+        residuals = wavelengths - polynomial(pixels)
+        sigma = np.sqrt(np.mean(residuals[used]**2))
+        keep = np.abs(residuals) <= nsigma * sigma
+        if sigma == 0. or (keep == used).all() or keep.sum() < 2:
+            break
+        used = keep
+    return (polynomial, used)
+
+def identify_lines(flux, reference, crval, cdelt, crpix=1., order=8,
+                   wunit=None, tolerance=3., nsigma_peaks=5.,
+                   nsigma_fit=3., niter=5, max_shift=50., max_stretch=0.03):
+    """
+    Identify the lines of a 1-D arc and fit the wavelength solution.
+    
+    The linear guess, usually from the header or the grism, is first
+    refined with search_linear().  The order of the fit is then raised
+    step by step up to the requested order, matching the peaks again
+    with the current solution at each step.
+    
+    Parameters
+    ----------
+    flux : array_like
+        1-D arc spectrum.
+    reference : str, LineList or array_like
+        Reference lines, see get_reference_lines().  Eg. 'argon'.
+    crval, cdelt, crpix : float
+        Approximate linear solution, in the unit of the reference.
+    order : int, optional
+        Order of the final solution.  Default = 8, as nswavelength in
+        the reduction scripts.
+    wunit : Unit, optional
+        Unit of crval and cdelt when the reference is a LineList.
+    tolerance : float, optional
+        Match tolerance, in pixels.  Default = 3.
+    nsigma_peaks : float, optional
+        Peak detection threshold.  Default = 5.
+    nsigma_fit : float, optional
+        Rejection threshold of the fit.  Default = 3.
+    niter : int, optional
+        Rejection iterations.  Default = 5.
+    max_shift, max_stretch : float, optional
+        Search range of the linear guess, see search_linear().
+    
+    Returns
+    -------
+    WavelengthSolution
+    """
+    (refwlen, refnames, wunit) = get_reference_lines(reference, wunit)
+    flux = np.asarray(flux, dtype=np.float64)
+    (positions, _) = find_peaks(flux, nsigma=nsigma_peaks)
+    if positions.size < 2:
+        raise ValueError('Not enough peaks in the arc: %d.' % positions.size)
+    
+    ((crval, cdelt, crpix), _) = search_linear(positions, refwlen, crval,
+                                               cdelt, crpix, max_shift,
+                                               max_stretch,
+                                               tolerance=tolerance)
+    predicted = crval + cdelt * (positions + 1. - crpix)
+    
+    degrees = sorted(set([1, min(3, order), order]))
+    for degree in degrees:
+        (peaks, lines) = match_lines(predicted, refwlen,
+                                     tolerance * abs(cdelt))
+        if peaks.size < 2:
+            raise ValueError('Not enough lines identified: %d.' %
+                             peaks.size)
+        (polynomial, used) = fit_solution(positions[peaks], refwlen[lines],
+                                          degree, flux.size,
+                                          nsigma=nsigma_fit, niter=niter)
+        predicted = polynomial(positions)
+    
+    return WavelengthSolution(polynomial, positions[peaks], refwlen[lines],
+                              refnames[lines], used, wunit=wunit)
+
+def trace_lines(data, solution, dispaxis=2, step=50, nsum=10, tolerance=3.,
+                nsigma=5.):
+    """
+    Follow the identified lines along the slit of a 2-D arc.
+    
+    The arc is divided in bands of nsum columns every step columns.  In
+    each band, the peaks are detected and matched to the pixel positions
+    of the lines used by the solution.  The output are the points needed
+    by rectify.build_map().
+    
+    Parameters
+    ----------
+    data : ndarray
+        2-D arc.
+    solution : WavelengthSolution
+        Solution at the centre of the slit.
+    dispaxis : int, optional
+        Dispersion axis, as DISPAXIS.  Default = 2.
+    step : int, optional
+        Distance between the bands, in pixels.  Default = 50.
+    nsum : int, optional
+        Width of each band.  Default = 10.
+    tolerance : float, optional
+        Maximum distance between a peak and the line position at the
+        centre of the slit, in pixels.  Default = 3.
+    nsigma : float, optional
+        Peak detection threshold.  Default = 5.
+    
+    Returns
+    -------
+    tuple of ndarray
+        (x, y, wavelength): 0-based column and row of each line in each
+        band, and its reference wavelength.
+    """
+    data = np.asarray(data)
+    if dispaxis == 1:
+        data = data.T
+    pixels = solution.pixels[solution.used]
+    wavelengths = solution.wavelengths[solution.used]
+    order = np.argsort(pixels)
+    (pixels, wavelengths) = (pixels[order], wavelengths[order])
+    
+    (xs, ys, ws) = ([], [], [])
+    for low in range(0, data.shape[1] - nsum + 1, step):
+        flux = np.median(data[:, low:low + nsum], axis=1)
+        (positions, _) = find_peaks(flux, nsigma=nsigma)
+        if positions.size == 0:
+            continue
+        (peaks, lines) = match_lines(positions, pixels, tolerance)
+        xs.append(np.full(peaks.size, low + (nsum - 1) / 2.))
+        ys.append(positions[peaks])
+        ws.append(wavelengths[lines])
+    
+    if not xs:
+        return (np.array([]), np.array([]), np.array([]))
+    (x, y, w) = (np.concatenate(xs), np.concatenate(ys), np.concatenate(ws))
+    if dispaxis == 1:
+        (x, y) = (y, x)
+    return (x, y, w)